@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+This script:
+  • Appends new records to a log table instead of dropping and reloading it.
+  • Creates the table if it doesn't exist yet (the loaders' schema).
+  • Reads how far every source file has been ingested from the "ingest_state"
+    table (see ingest_state.py), which the loaders also fill in.
+  • For raw log files (e.g. a growing linux.log), parses only the complete lines
+    after the last ingested byte position with the process_*.py converter. The
+    syslog year keeps being tracked across runs. A file smaller than the recorded
+    position is assumed to have been rotated and is read from the start.
+  • For gzip-compressed JSONL files, ingests every file that hasn't been ingested
+    yet as a whole.
+  • Shifts the timestamps and embedded dates by the shift recorded for the table,
+    so appended records line up with the ones loaded before. A table without any
+    state gets the loaders' shift: the maximum timestamp becomes 'now'.
+  • Inserts the records of a table loaded with --virtual-shift into its raw table,
+    as they are: its view shifts them (see virtual_shift.py).
+  • Enriches the IPs of OpenSSH records with --enrich-ips, like load_openssh.py.
+    The option has to match the load of the table, as recorded in its fingerprint.
+  • Records the new position after every inserted batch, so an interrupted run
+    resumes where it stopped, and adds the batch to the number of rows of the
+    table's fingerprint, so the loaders keep the table on the next start (see
+    fingerprints.py).
+  • Numbers the records of a raw log with the byte offset of the end of their
+    line (seq), which keeps growing across runs; JSONL records are numbered by
+    their position in the file, like the loaders do.
+  • With --follow, keeps polling the files for new lines.
+
+Example:
+  python append.py linux /var/log/messages --follow 10
+"""
+
+import argparse
+import calendar
+import importlib
+import json
+import os
+import time
+
+from common import DEFAULT_BATCH_SIZE, insert_columnar_batches, iter_records, with_seq
+from connection import add_connection_args, connect
+from fingerprints import add_appended_rows, read_fingerprint
+from ingest_state import read_state, save_state, table_shift
+from ip_lookup import add_enrich_args
+from metadata import DatasetStats, dataset_max_timestamp
+from schemas import add_schema_arg, create_table
+from syslog_chunks import parse_lines, print_parse_error
+from timeshift import MICROSECONDS, SECONDS, TimeShifter
+from virtual_shift import is_virtual, raw_table
+
+SOURCES = ["apache", "hadoop", "linux", "openssh"]
+
+# Year the syslog converters start from when a raw log is read from its beginning
+DEFAULT_YEARS = {"linux": 2005, "openssh": 2023}
+
+class LineReader:
+    """
+    Iterates over the complete lines of a file after a byte position. A partially
+    written last line is left for the next run. position is the end of the last
+    line handed out.
+    """
+
+    def __init__(self, path, position):
+        self.path = path
+        self.position = position
+
+    def __iter__(self):
+        with open(self.path, "rb") as f:
+            f.seek(self.position)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    return
+                self.position += len(line)
+                yield line.decode("utf-8")
+
+class Source:
+    """
+    A log source: its converter, loader, table and the state of one of its files.
+    """
+
+    def __init__(self, name, year):
+        self.name = name
+        self.converter = importlib.import_module(f"process_{name}")
+        self.loader = importlib.import_module(f"load_{name}")
+        self.table = f"{name}_logs"
+        self.unit = MICROSECONDS if name == "hadoop" else SECONDS
+        self.year = year or DEFAULT_YEARS.get(name)
+        # The shift in microseconds and the function of columns_builder
+        self.builder = None
+
+    def is_syslog(self):
+        return self.name in DEFAULT_YEARS
+
+    def parse(self, reader, file_state):
+        """
+        Parses the lines of a LineReader, resuming the year tracking of a syslog file.
+        """
+        if self.is_syslog():
+            if file_state and file_state["year"]:
+                return parse_lines(self.converter.parse_log_line, reader, file_state["year"],
+                                   prev_month=file_state["month"])
+            return parse_lines(self.converter.parse_log_line, reader, self.year)
+        return self.parse_plain(reader)
+
+    def parse_plain(self, lines):
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue  # skip empty lines
+            parsed_log = self.converter.parse_log_line(line)
+            if parsed_log:
+                yield parsed_log
+            else:
+                print_parse_error(line)
+
+    def columns_builder(self, shifter, args):
+        """
+        Returns the loader's function building the columns of records shifted by
+        shifter. It's only built again when the shift changes, so --follow doesn't
+        read the IP dataset of --enrich-ips on every poll.
+        """
+        if self.builder is None or self.builder[0] != shifter.microseconds:
+            self.builder = (shifter.microseconds, self.loader.columns_builder(shifter, args))
+        return self.builder[1]
+
+    def rewriters(self, shift):
+        if self.name == "linux":
+            return self.loader.date_rewriters(shift)
+        return self.loader.logline_rewriter(shift)
+
+def is_jsonl(path):
+    return path.endswith(".jsonl.gz")
+
+def start_position(path, file_state):
+    """
+    Returns the position to resume reading a raw log from.
+    """
+    if file_state is None:
+        return 0
+    if os.path.getsize(path) < file_state["position"]:
+        print(f"{path} is smaller than when it was last read, reading it from the start.")
+        return 0
+    return file_state["position"]
+
+def new_max_timestamp(source, paths, state):
+    """
+    Returns the maximum timestamp of the records that haven't been ingested yet.
+    Only needed for the first ingestion into a table, to compute its shift.
+    """
+    stats = DatasetStats()
+    for path in paths:
+        file_state = state.get(os.path.abspath(path))
+        if is_jsonl(path):
+            if file_state is None:
+                stats.add(dataset_max_timestamp(path))
+        else:
+            reader = LineReader(path, start_position(path, file_state))
+            for record in source.parse(reader, file_state):
+                stats.add(record.timestamp)
+    return stats.max_timestamp
+
+def numbered(records, reader):
+    """
+    Sets the seq of the records parsed from a LineReader to the position of the
+    end of their line, which is unique and increasing within the file.
+    """
+    for record in records:
+        record.seq = reader.position
+        yield record
+
+def check_enrichment(source, stored, args):
+    """
+    Checks that --enrich-ips is only given for OpenSSH, and matches how the table
+    of the fingerprint stored was loaded, so appended rows are enriched like the others.
+    """
+    if source.name != "openssh":
+        if args.enrich_ips:
+            raise ValueError("--enrich-ips only applies to openssh")
+        return
+    if stored is None:
+        return
+    enriched = "ips" in json.loads(stored["options"])
+    if enriched != args.enrich_ips:
+        loaded = "with" if enriched else "without"
+        raise ValueError(f"{source.table} was loaded {loaded} --enrich-ips: append to it {loaded} it too")
+
+def append_file(client, source, table, path, file_state, shifter, to_columns, stored, args):
+    """
+    Appends the new records of one file to table, building their columns with
+    to_columns (see the loaders' columns_builder), and counting them in stored,
+    the fingerprint of the source's table, if any. Returns the number of inserted rows.
+    """
+    key = os.path.abspath(path)
+    query = f"INSERT INTO {table} ({', '.join(source.loader.TABLE_COLUMNS)}) VALUES"
+    dtypes = source.loader.COLUMN_DTYPES if args.numpy else None
+
+    def count_rows(batch):
+        if stored is not None:
+            add_appended_rows(client, source.table, stored, len(batch))
+
+    if is_jsonl(path):
+        if file_state is not None:
+            return 0
+        total = insert_columnar_batches(client, query, with_seq(iter_records(path, record_type=source.loader.RECORD_TYPE)), to_columns, args.batch_size, dtypes, count_rows)
+        save_state(client, source.table, key, os.path.getsize(path), shifter.microseconds)
+        return total
+
+    start = start_position(path, file_state)
+    reader = LineReader(path, start)
+    # Position, year and month of the last saved state
+    saved = {
+        "position": start,
+        "year": file_state["year"] if file_state else 0,
+        "month": file_state["month"] if file_state else "",
+    }
+
+    def after_insert(batch):
+        count_rows(batch)
+        # Remember where the batch ends, and the year and month of its last line
+        if source.is_syslog():
+            timestamp = batch[-1].timestamp
+            saved["year"] = int(timestamp[:4])
+            saved["month"] = calendar.month_abbr[int(timestamp[5:7])]
+        saved["position"] = reader.position
+        save_state(client, source.table, key, reader.position, shifter.microseconds, saved["year"], saved["month"])
+
+    total = insert_columnar_batches(client, query, numbered(source.parse(reader, file_state), reader), to_columns,
+                                    args.batch_size, dtypes, after_insert)
+    if reader.position != saved["position"]:
+        # The file ends with empty or unparseable lines: don't read them again
+        save_state(client, source.table, key, reader.position, shifter.microseconds, saved["year"], saved["month"])
+    return total
+
+def append(client, source, args):
+    """
+    Appends the new records of all the files to the source's table.
+    Returns the number of inserted rows.
+    """
+    stored = read_fingerprint(client, source.table)
+    check_enrichment(source, stored, args)
+    state = read_state(client, source.table)
+    if is_virtual(client, source.table):
+        table = raw_table(source.table)
+        shift_us = 0
+    else:
+        create_table(client, source.table, source.loader, args.schema, if_not_exists=True)
+        table = source.table
+        shift_us = table_shift(state)
+    if shift_us is None:
+        max_ts = new_max_timestamp(source, args.paths, state)
+        if max_ts is None:
+            return 0
+        shifter = TimeShifter(max_ts, source.unit)
+    else:
+        shifter = TimeShifter.from_microseconds(shift_us, source.unit)
+    to_columns = source.columns_builder(shifter, args)
+
+    total = 0
+    for path in args.paths:
+        file_state = state.get(os.path.abspath(path))
+        rows = append_file(client, source, table, path, file_state, shifter, to_columns, stored, args)
+        if rows:
+            print(f"Appended {rows} rows from {path} to {source.table}.")
+        total += rows
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Append new log records to a ClickHouse table.")
+    parser.add_argument("source", choices=SOURCES, help="Log source of the files")
+    parser.add_argument("paths", nargs="+", help="Raw log files or converted .jsonl.gz files")
+    parser.add_argument("--year", type=int, help="Year a syslog file starts in when it's read from the start")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Number of rows per INSERT (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--numpy", action="store_true", help="Insert columns as NumPy arrays")
+    parser.add_argument("--follow", type=float, metavar="SECONDS",
+                        help="Keep polling the files for new lines every SECONDS seconds")
+    add_enrich_args(parser)
+    add_schema_arg(parser)
+    add_connection_args(parser)
+    args = parser.parse_args()
+
+    # Connect to ClickHouse (see connection.py)
+    client = connect(args)
+    source = Source(args.source, args.year)
+
+    while True:
+        total = append(client, source, args)
+        if args.follow is None:
+            print(f"Appended {total} rows in total.")
+            return
+        time.sleep(args.follow)
+
+if __name__ == "__main__":
+    main()
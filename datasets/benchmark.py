@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+This script:
+  • Generates fixed synthetic inputs (deterministic for a given --seed) in the
+    Apache, Hadoop, Linux syslog and OpenSSH log formats, at 100k, 1M and/or 10M lines.
+  • Runs them through the conversion and load pipeline batch by batch, so memory
+    use doesn't depend on the number of lines.
+  • Times every stage separately (wall and CPU time):
+      parse          - parse_log_line of the process_*.py converter
+      json_encode    - json.dumps of the parsed records, as written by the converters
+      json_decode    - json.loads of the encoded records into typed records (see
+                       records.py), as read by the loaders
+      build_columns  - to_columns of the load_*.py loader (timestamps, dates and columns)
+      insert         - inserting the columns
+    and, timed again on their own, parts of these stages (marked with part_of in
+    the results, and not to be added to the other stages):
+      extract        - extract_additional_details (OpenSSH only), part of parse
+      shift_dates    - rewriting the dates in logline/msg, part of build_columns;
+                       with DateRewriters of its own, so that it doesn't warm up
+                       the caches of build_columns
+  • Inserts into a null sink that discards the columns, or with --clickhouse into
+    tables with the Null engine on a ClickHouse server (see connection.py for the
+    options, e.g. --host and --compression), which measures the driver's
+    serialization, compression and the network round trips as well.
+  • Writes the results as JSON (to stdout or --output) for tracking throughput
+    regressions across versions.
+
+Example:
+  python benchmark.py --sizes 100k 1m --output benchmark.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import load_apache
+import load_hadoop
+import load_linux
+import load_openssh
+import process_apache
+import process_hadoop
+import process_linux
+import process_openssh
+from common import DEFAULT_BATCH_SIZE, list_columns, numpy_columns
+from connection import add_connection_args, connect
+from timeshift import MICROSECONDS, SECONDS, TimeShifter
+
+SIZES = {"100k": 100000, "1m": 1000000, "10m": 10000000}
+
+STAGES = ["parse", "extract", "json_encode", "json_decode", "shift_dates", "build_columns", "insert"]
+
+# Stages timing again a part of another stage
+PART_OF = {"extract": "parse", "shift_dates": "build_columns"}
+
+HOSTS = ["combo", "LabSZ"]
+CLIENT_IPS = ["65.138.118.158", "211.234.84.17", "173.234.31.186", "5.36.59.76", "112.95.230.3"]
+USERS = ["root", "admin", "test", "oracle", "webmaster", "guest"]
+
+# Message templates of every format. {n} is a small number, {ip} a client IP,
+# {user} a user name and {date} a full embedded date.
+APACHE_TEMPLATES = [
+    ("notice", False, "jk2_init() Found child {n} in scoreboard slot {n}"),
+    ("notice", False, "workerEnv.init() ok /etc/httpd/conf/workers2.properties"),
+    ("error", False, "mod_jk child workerEnv in error state {n}"),
+    ("error", True, "Directory index forbidden by rule: /var/www/html/"),
+    ("error", True, "File does not exist: /var/www/html/scripts/user{n}"),
+]
+HADOOP_TEMPLATES = [
+    ("INFO", "main", "org.apache.hadoop.mapred.MapTask", "(EQUATOR) {n} kvi {n}({n})"),
+    ("INFO", "main", "org.apache.hadoop.metrics2.impl.MetricsConfig", "loaded properties from hadoop-metrics2.properties"),
+    ("INFO", "AsyncDispatcher event handler", "org.apache.hadoop.yarn.util.RackResolver",
+     "Resolved MSRA-SA-{n}.fareast.corp.microsoft.com to /default-rack"),
+    ("WARN", "LeaseRenewer:msrabi@msra-sa-41:9000", "org.apache.hadoop.hdfs.LeaseRenewer",
+     "Failed to renew lease for [DFSClient_NONMAPREDUCE_{n}_1] for {n} seconds.  Will retry shortly ..."),
+]
+LINUX_TEMPLATES = [
+    "sshd(pam_unix)[{pid}]: session opened for user {user} by (uid=0)",
+    "kernel: Out of Memory: Killed process {n} (httpd).",
+    "ftpd[{pid}]: connection from {ip} () at {date}",
+    "syslogd 1.4.1: restart.",
+]
+OPENSSH_TEMPLATES = [
+    "sshd[{pid}]: Invalid user {user} from {ip}",
+    "sshd[{pid}]: Failed password for {user} from {ip} port {n} ssh2",
+    "sshd[{pid}]: pam_unix(sshd:auth): authentication failure; logname= uid=0 euid=0 tty=ssh ruser= rhost={ip}  user={user}",
+    "sshd[{pid}]: Received disconnect from {ip}: 11: Bye Bye [preauth]",
+]
+
+def syslog_date(dt):
+    """
+    Formats a datetime like syslog does, e.g., "Jun  9 06:06:20".
+    """
+    return f"{dt.strftime('%b')} {dt.day:2d} {dt.strftime('%H:%M:%S')}"
+
+def fill(template, rng, dt):
+    """
+    Fills the placeholders of a message template.
+    """
+    return template.format(
+        n=rng.randrange(1, 100000),
+        pid=rng.randrange(1000, 32768),
+        ip=rng.choice(CLIENT_IPS),
+        user=rng.choice(USERS),
+        date=dt.strftime("%a %b ") + f"{dt.day:2d} " + dt.strftime("%H:%M:%S %Y"),
+    )
+
+def synthetic_lines(source, seed):
+    """
+    Yields an endless stream of synthetic log lines of the given source, with
+    increasing timestamps. The stream only depends on the source and the seed.
+    """
+    rng = random.Random(f"{source}:{seed}")
+    dt = datetime.datetime(2005, 6, 9, 6, 6, 17)
+    while True:
+        dt += datetime.timedelta(microseconds=rng.randrange(0, 3000000))
+        if source == "apache":
+            severity, with_client, template = rng.choice(APACHE_TEMPLATES)
+            client = f"[client {rng.choice(CLIENT_IPS)}] " if with_client else ""
+            yield f"[{dt.strftime('%a %b %d %H:%M:%S %Y')}] [{severity}] {client}{fill(template, rng, dt)}"
+        elif source == "hadoop":
+            severity, thread, logger, template = rng.choice(HADOOP_TEMPLATES)
+            date = dt.strftime("%Y-%m-%d %H:%M:%S,%f")[:-3]
+            yield f"{date} {severity} [{thread}] {logger}: {fill(template, rng, dt)}"
+        elif source == "linux":
+            yield f"{syslog_date(dt)} {HOSTS[0]} {fill(rng.choice(LINUX_TEMPLATES), rng, dt)}"
+        else:
+            yield f"{syslog_date(dt)} {HOSTS[1]} {fill(rng.choice(OPENSSH_TEMPLATES), rng, dt)}"
+
+class Source:
+    """
+    The converter and loader functions of one log format.
+    """
+
+    def __init__(self, name, converter, loader, unit, year=None):
+        self.name = name
+        self.converter = converter
+        self.loader = loader
+        self.unit = unit
+        # Syslog formats have no year in the lines
+        self.year = year
+
+    def parse(self, lines, start):
+        if self.year is None:
+            records = [self.converter.parse_log_line(line) for line in lines]
+        else:
+            records = [self.converter.parse_log_line(line, self.year)[0] for line in lines]
+        # Number the records in order, like the converters do
+        for seq, record in enumerate(records, start):
+            record.seq = seq
+        return records
+
+    def extract(self, records):
+        if not hasattr(self.converter, "extract_additional_details"):
+            return None
+        return [self.converter.extract_additional_details(record) for record in records]
+
+    def rewriters(self, shift):
+        if self.name == "linux":
+            return self.loader.date_rewriters(shift)
+        return self.loader.logline_rewriter(shift)
+
+    def shift_dates(self, records, rewriters):
+        if self.name == "linux":
+            return [
+                (self.loader.shift_dates_in_text(record.msg, rewriters, int(record.timestamp[:4])),
+                 self.loader.shift_dates_in_text(record.logline, rewriters, int(record.timestamp[:4])))
+                for record in records
+            ]
+        if self.name == "openssh":
+            return [rewriters.replace_first(record.logline, int(record.timestamp[:4])) for record in records]
+        return [rewriters.replace_first(record.logline) for record in records]
+
+SOURCES = [
+    Source("apache", process_apache, load_apache, SECONDS),
+    Source("hadoop", process_hadoop, load_hadoop, MICROSECONDS),
+    Source("linux", process_linux, load_linux, SECONDS, year=2005),
+    Source("openssh", process_openssh, load_openssh, SECONDS, year=2005),
+]
+
+class NullSink:
+    """
+    Stands in for a clickhouse_driver Client and discards the inserted columns.
+    """
+
+    def execute(self, query, params=None, columnar=False, settings=None):
+        return len(params[0]) if params else 0
+
+class Timings:
+    """
+    Accumulates the wall and CPU time spent in every stage.
+    """
+
+    def __init__(self):
+        self.wall = dict.fromkeys(STAGES, 0.0)
+        self.cpu = dict.fromkeys(STAGES, 0.0)
+
+    def run(self, stage, function, *args):
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = function(*args)
+        self.wall[stage] += time.perf_counter() - wall
+        self.cpu[stage] += time.process_time() - cpu
+        return result
+
+def benchmark_source(source, lines, args, client):
+    """
+    Runs lines synthetic lines of a source through the pipeline.
+    Returns the result entries of every stage.
+    """
+    table = f"benchmark_{source.name}"
+    if args.clickhouse:
+        client.execute(f"DROP TABLE IF EXISTS {table}")
+        client.execute(f"CREATE TABLE {table} ({source.loader.COLUMNS}) ENGINE = Null")
+
+    timings = Timings()
+    generator = synthetic_lines(source.name, args.seed)
+    shifter = rewriters = shift_dates_rewriters = None
+    extracted = False
+    remaining = lines
+    while remaining > 0:
+        batch = [next(generator) for _ in range(min(args.batch_size, remaining))]
+        remaining -= len(batch)
+
+        records = timings.run("parse", source.parse, batch, lines - remaining - len(batch))
+        extracted = timings.run("extract", source.extract, records) is not None
+        encoded = timings.run("json_encode", lambda: [json.dumps(record.to_dict()) for record in records])
+        decoded = timings.run("json_decode", lambda: [source.loader.RECORD_TYPE.from_dict(json.loads(line))
+                                                      for line in encoded])
+
+        if shifter is None:
+            # Shift the first batch's last timestamp to 'now', like the loaders do with the maximum
+            shifter = TimeShifter(decoded[-1].timestamp, source.unit)
+            rewriters = source.rewriters(shifter.timedelta)
+            shift_dates_rewriters = source.rewriters(shifter.timedelta)
+        timings.run("shift_dates", source.shift_dates, decoded, shift_dates_rewriters)
+        columns = timings.run("build_columns", source.loader.to_columns, decoded, shifter, rewriters)
+
+        if args.numpy:
+            timings.run("insert", lambda: client.execute(
+                f"INSERT INTO {table} VALUES", numpy_columns(columns, source.loader.COLUMN_DTYPES),
+                columnar=True, settings={"use_numpy": True}))
+        else:
+            timings.run("insert", lambda: client.execute(
+                f"INSERT INTO {table} VALUES", list_columns(columns), columnar=True))
+
+    if args.clickhouse:
+        client.execute(f"DROP TABLE IF EXISTS {table}")
+
+    results = []
+    for stage in STAGES:
+        if stage == "extract" and not extracted:
+            continue
+        wall = timings.wall[stage]
+        result = {
+            "source": source.name,
+            "lines": lines,
+            "stage": stage,
+            "wall_seconds": round(wall, 6),
+            "cpu_seconds": round(timings.cpu[stage], 6),
+            "rows_per_second": round(lines / wall) if wall else None,
+        }
+        if stage in PART_OF:
+            result["part_of"] = PART_OF[stage]
+        results.append(result)
+    return results
+
+def git_commit():
+    """
+    Returns the commit of the working tree, or None outside of a git checkout.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dataset conversion and load pipeline.")
+    parser.add_argument("--sizes", nargs="+", choices=SIZES, default=["100k"],
+                        help="Number of synthetic lines per source (default: 100k)")
+    parser.add_argument("--sources", nargs="+", choices=[source.name for source in SOURCES],
+                        default=[source.name for source in SOURCES], help="Log formats to benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic inputs (default: 0)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Number of lines per batch and INSERT (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--numpy", action="store_true", help="Insert columns as NumPy arrays")
+    parser.add_argument("--clickhouse", action="store_true",
+                        help="Insert into Null tables on the ClickHouse server instead of a null sink")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    add_connection_args(parser)
+    args = parser.parse_args()
+
+    client = connect(args) if args.clickhouse else NullSink()
+
+    results = []
+    for size in args.sizes:
+        for source in SOURCES:
+            if source.name not in args.sources:
+                continue
+            print(f"Benchmarking {source.name} with {size} lines...", file=sys.stderr)
+            results.extend(benchmark_source(source, SIZES[size], args, client))
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "batch_size": args.batch_size,
+        "sink": f"clickhouse://{args.host}:{args.port}" if args.clickhouse else "null",
+        "compression": args.compression,
+        "numpy": args.numpy,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Helpers shared by the load_*.py scripts:
+  • Streaming records out of a gzip-compressed JSONL file one at a time.
+  • Inserting rows (or columns) into ClickHouse in fixed-size batches, so that
+    memory usage stays flat regardless of the size of the dataset.
+  • Optionally inserting columns as NumPy arrays through clickhouse_driver's
+    NumPy support, which serializes numeric columns with a single copy instead
+    of item by item.
+  • Loading datasets written as gzip frames (see frames.py) with --workers
+    processes: every worker decompresses, decodes, shifts and inserts groups of
+    frames of about --batch-size rows on its own, found through the frame index
+    of the dataset's metadata sidecar.
+  • Partial loads of a time window (--since, --until, --sample, see windows.py),
+    which only read the frames overlapping it.
+  • Loads shifted at query time with --virtual-shift (see virtual_shift.py).
+  • Timing these stages for the --metrics report (see instrumentation.py).
+"""
+
+import gzip
+import importlib
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from connection import add_connection_args, connect
+from fingerprints import add_fingerprint_args
+from frames import read_frame
+from instrumentation import NO_METRICS, Metrics, add_metrics_args
+from metadata import dataset_frames
+from schemas import add_schema_arg
+from virtual_shift import add_virtual_shift_arg
+from windows import add_window_args, frame_positions
+
+# Number of rows sent to ClickHouse in a single INSERT.
+DEFAULT_BATCH_SIZE = 100000
+
+# Bytes of lines decompressed at once by iter_records
+READ_BLOCK_BYTES = 1 << 20
+
+def iter_records(path, metrics=NO_METRICS, record_type=None):
+    """
+    Yields decoded records from a gzip-compressed JSONL file, skipping empty lines.
+    The records are dicts, or instances of record_type (see records.py) if given.
+    Lines are decompressed and decoded in blocks of about READ_BLOCK_BYTES, so only
+    one block of records is kept in memory at a time, and metrics times both stages.
+    """
+    metrics.add_bytes("in", os.path.getsize(path))
+    with gzip.open(path, "rb") as f:
+        while True:
+            with metrics.stage("gunzip"):
+                lines = f.readlines(READ_BLOCK_BYTES)
+            if not lines:
+                return
+            yield from decode_lines(lines, metrics, record_type)
+
+def iter_frame_records(path, frames, metrics=NO_METRICS, record_type=None):
+    """
+    Yields the decoded records of some of the frames of a dataset (see frames.py),
+    like iter_records, decompressing one frame at a time.
+    """
+    with open(path, "rb") as f:
+        for frame in frames:
+            metrics.add_bytes("in", frame["size"])
+            with metrics.stage("gunzip"):
+                lines = read_frame(f, frame).splitlines()
+            yield from decode_lines(lines, metrics, record_type)
+
+def decode_lines(lines, metrics=NO_METRICS, record_type=None):
+    """
+    Returns the records decoded from a block of JSON lines, skipping empty lines.
+    """
+    metrics.add_bytes("decompressed", sum(map(len, lines)))
+    with metrics.stage("json_decode"):
+        # json.loads decodes UTF-8 bytes itself
+        records = [json.loads(line) for line in lines if line and not line.isspace()]
+        if record_type is not None:
+            records = [record_type.from_dict(record) for record in records]
+    metrics.add_rows("json_decode", len(records))
+    return records
+
+def with_seq(records, start=0):
+    """
+    Numbers the typed records of a file in order: every record gets its position
+    in the file as seq, unless it already has one (written by the converters).
+    The log tables are ordered by (timestamp, seq) so lines within the same
+    second keep their order.
+    """
+    for seq, record in enumerate(records, start):
+        if record.seq is None:
+            record.seq = seq
+        yield record
+
+def batched(iterable, batch_size):
+    """
+    Splits an iterable into lists of at most batch_size items.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def numpy_columns(columns, dtypes):
+    """
+    Converts the columns of a batch to NumPy arrays of the given dtypes.
+    None becomes NaN in float columns and NaT in datetime64 columns, which
+    clickhouse_driver writes as NULL into Nullable columns.
+    """
+    return [
+        column if isinstance(column, np.ndarray) else np.array(column, dtype=dtype)
+        for column, dtype in zip(columns, dtypes)
+    ]
+
+def list_columns(columns):
+    """
+    Converts the columns of a batch to the plain lists expected by clickhouse_driver's
+    columnar mode when NumPy support is not used.
+    """
+    return [column.tolist() if isinstance(column, np.ndarray) else list(column) for column in columns]
+
+def written_bytes(client):
+    """
+    Returns the bytes the server reports as written by the client's last INSERT.
+    """
+    last_query = getattr(client, "last_query", None)
+    return last_query.progress.written_bytes if last_query is not None else 0
+
+def insert_columnar_batches(client, query, records, to_columns, batch_size=DEFAULT_BATCH_SIZE, dtypes=None,
+                            after_insert=None, metrics=NO_METRICS):
+    """
+    Consumes an iterable of records, converts every batch into a list of columns
+    with to_columns and inserts it with clickhouse_driver's columnar mode.
+    When dtypes (one NumPy dtype per column) are given, the columns are sent as
+    NumPy arrays. after_insert(batch) is called once every batch has been inserted.
+    metrics times the build_columns and insert stages.
+    Returns the number of inserted rows.
+    """
+    total = 0
+    for batch in batched(records, batch_size):
+        with metrics.stage("build_columns", len(batch)):
+            columns = to_columns(batch)
+            columns = list_columns(columns) if dtypes is None else numpy_columns(columns, dtypes)
+        with metrics.stage("insert", len(batch)):
+            if dtypes is None:
+                client.execute(query, columns, columnar=True)
+            else:
+                client.execute(query, columns, columnar=True, settings={"use_numpy": True})
+        metrics.add_bytes("out", written_bytes(client))
+        total += len(batch)
+        if after_insert is not None:
+            after_insert(batch)
+    return total
+
+def frame_groups(positions, batch_size):
+    """
+    Splits frames, each with the position of its first row in the file (see
+    windows.frame_positions), into groups of consecutive frames of at most
+    batch_size rows (or a single frame), each with the position of its first row.
+    """
+    group = []
+    start = rows = 0
+    for position, frame in positions:
+        if group and (rows + frame["rows"] > batch_size or position != start + rows):
+            yield start, group
+            group = []
+        if not group:
+            start = position
+            rows = 0
+        group.append(frame)
+        rows += frame["rows"]
+    if group:
+        yield start, group
+
+def insert_frames(client, query, path, group, loader, to_columns, args, metrics=NO_METRICS, window=None):
+    """
+    Decodes a group of frames of a dataset and inserts its records (of the
+    window, if any) with query. Returns the number of inserted rows.
+    """
+    start, frames = group
+    records = with_seq(iter_frame_records(path, frames, metrics, loader.RECORD_TYPE), start)
+    return insert_columnar_batches(
+        client,
+        query,
+        records if window is None else window.filter(records),
+        to_columns,
+        args.batch_size,
+        loader.COLUMN_DTYPES if args.numpy else None,
+        metrics=metrics
+    )
+
+# Per-process state of the pool workers of insert_dataset
+worker = {}
+
+def init_frame_worker(loader_name, path, query, shifter, args, window, detailed):
+    loader = importlib.import_module(loader_name)
+    metrics = Metrics(loader_name, enabled=True, detailed=detailed)
+    worker["loader"] = loader
+    worker["path"] = path
+    worker["query"] = query
+    worker["args"] = args
+    worker["window"] = window
+    worker["metrics"] = metrics
+    worker["to_columns"] = loader.columns_builder(shifter, args, metrics)
+    worker["client"] = connect(args)
+
+def insert_frame_group(group):
+    """
+    Decodes a group of frames in a worker and inserts it into ClickHouse.
+    Returns the number of rows and the worker's metrics since its last group.
+    """
+    metrics = worker["metrics"]
+    rows = insert_frames(worker["client"], worker["query"], worker["path"], group, worker["loader"],
+                         worker["to_columns"], worker["args"], metrics, worker["window"])
+    return rows, metrics.take()
+
+def insert_dataset(client, args, loader_name, path, query, shifter, metrics=NO_METRICS, window=None):
+    """
+    Inserts the records of a JSONL dataset with query, building the columns of
+    every batch with the columns_builder(shifter, args, metrics) of the loader
+    module loader_name. Only the records of window (see windows.py) are inserted
+    if given, reading only the frames it overlaps when the dataset has a frame
+    index. With --workers, datasets made of several frames are inserted by that
+    many processes; others are streamed by this one.
+    Returns the number of inserted rows.
+    """
+    loader = importlib.import_module(loader_name)
+    frames = dataset_frames(path)
+    if window is not None and frames is not None and window.indexes(frames):
+        positions = window.select(frames)
+        if metrics.verbose:
+            print(f"Loading {len(positions)} of {len(frames)} chunks "
+                  f"({sum(frame['rows'] for _, frame in positions)} rows) for {window}.")
+    elif window is None and args.workers > 1 and frames is not None and len(frames) > 1:
+        positions = list(frame_positions(frames))
+    else:
+        records = with_seq(iter_records(path, metrics, loader.RECORD_TYPE))
+        if window is not None:
+            if metrics.verbose:
+                print(f"No chunk index for {path}, reading the whole file for {window}.")
+            records = window.filter(records, sample=True)
+        return insert_columnar_batches(
+            client,
+            query,
+            records,
+            loader.columns_builder(shifter, args, metrics),
+            args.batch_size,
+            loader.COLUMN_DTYPES if args.numpy else None,
+            metrics=metrics
+        )
+
+    groups = list(frame_groups(positions, args.batch_size))
+    if args.workers > 1 and len(groups) > 1:
+        total = 0
+        with ProcessPoolExecutor(args.workers, initializer=init_frame_worker,
+                                 initargs=(loader_name, path, query, shifter, args, window,
+                                           metrics.detailed)) as executor:
+            for rows, snapshot in executor.map(insert_frame_group, groups):
+                total += rows
+                metrics.merge(snapshot)
+        return total
+
+    to_columns = loader.columns_builder(shifter, args, metrics)
+    return sum(insert_frames(client, query, path, group, loader, to_columns, args, metrics, window)
+               for group in groups)
+
+def add_common_args(parser, log_table=True):
+    """
+    Adds the command line options shared by all loaders, and with log_table those
+    of the loaders of the log tables, which load_ips.py doesn't support.
+    """
+    parser.add_argument("--input", help="Dataset file to load instead of the bundled one (.jsonl.gz or .parquet)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Number of rows per INSERT (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--numpy", action="store_true",
+                        help="Insert columns as NumPy arrays (requires clickhouse-driver[numpy])")
+    add_fingerprint_args(parser, reshift=log_table)
+    if log_table:
+        parser.add_argument("--workers", type=int, default=1,
+                            help="Number of processes inserting the frames of the dataset (default: 1, see frames.py)")
+        parser.add_argument("--server-side", action="store_true",
+                            help="Send the compressed file to ClickHouse as-is and shift the dates there")
+        add_virtual_shift_arg(parser)
+        add_window_args(parser)
+        add_schema_arg(parser)
+    add_connection_args(parser)
+    add_metrics_args(parser)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Connection to ClickHouse shared by the datasets scripts.
+
+Every option can be given on the command line or through an environment variable
+(the command line wins), e.g. for a remote server:
+  CLICKHOUSE_HOST=ch.example.com CLICKHOUSE_PASSWORD=... python load_all.py --compression zstd
+
+  --host              CLICKHOUSE_HOST         (default: clickhouse)
+  --port              CLICKHOUSE_PORT         native protocol port (default: 9000)
+  --http-port         CLICKHOUSE_HTTP_PORT    HTTP port, for --server-side loads (default: 8123)
+  --user              CLICKHOUSE_USER         (default: default)
+  --password          CLICKHOUSE_PASSWORD     (default: empty; prefer the variable,
+                                              the command line shows up in ps)
+  --database          CLICKHOUSE_DATABASE     (default: default)
+  --secure            CLICKHOUSE_SECURE=1     TLS for both protocols (the ports are
+                                              usually 9440 and 8443 then)
+  --compression       CLICKHOUSE_COMPRESSION  none, lz4 or zstd (default: none)
+  --insert-block-size                         rows per block sent to and squashed by ClickHouse
+  --async-insert                              let ClickHouse batch small inserts itself
+
+Compression of the native protocol needs the optional clickhouse-driver extras:
+  pip install 'clickhouse-driver[lz4]'   or   pip install 'clickhouse-driver[zstd]'
+It pays off when the server is remote: the log columns compress several times.
+
+connect() keeps one client per set of options in every process, so the datasets
+loaded one after another by the same process (e.g. a load_all.py worker) reuse
+the connection instead of opening a new one each. A forked worker process opens
+its own instead of sharing the socket of its parent.
+"""
+
+import base64
+import os
+import urllib.parse
+
+from clickhouse_driver import Client, errors
+
+COMPRESSIONS = ["none", "lz4", "zstd"]
+
+# Clients already opened by this process, keyed by their options
+_clients = {}
+
+def env_flag(name):
+    return os.environ.get(name, "").lower() in ("1", "true", "yes")
+
+def add_connection_args(parser):
+    """
+    Adds the connection options (see the module docstring).
+    """
+    env = os.environ.get
+    group = parser.add_argument_group("ClickHouse connection")
+    group.add_argument("--host", default=env("CLICKHOUSE_HOST", "clickhouse"),
+                       help="ClickHouse host (default: $CLICKHOUSE_HOST or clickhouse)")
+    group.add_argument("--port", type=int, default=int(env("CLICKHOUSE_PORT", 9000)),
+                       help="Native protocol port (default: $CLICKHOUSE_PORT or 9000)")
+    group.add_argument("--http-port", type=int, default=int(env("CLICKHOUSE_HTTP_PORT", 8123)),
+                       help="HTTP port, used by --server-side loads (default: $CLICKHOUSE_HTTP_PORT or 8123)")
+    group.add_argument("--user", default=env("CLICKHOUSE_USER", "default"),
+                       help="User (default: $CLICKHOUSE_USER or default)")
+    group.add_argument("--password", default=env("CLICKHOUSE_PASSWORD", ""),
+                       help="Password (default: $CLICKHOUSE_PASSWORD, which is safer than the command line)")
+    group.add_argument("--database", default=env("CLICKHOUSE_DATABASE", "default"),
+                       help="Database (default: $CLICKHOUSE_DATABASE or default)")
+    group.add_argument("--secure", action="store_true", default=env_flag("CLICKHOUSE_SECURE"),
+                       help="Connect with TLS (default: $CLICKHOUSE_SECURE)")
+    group.add_argument("--compression", choices=COMPRESSIONS, default=env("CLICKHOUSE_COMPRESSION", "none"),
+                       help="Native protocol compression (default: $CLICKHOUSE_COMPRESSION or none)")
+    group.add_argument("--insert-block-size", type=int,
+                       help="Maximum number of rows per block sent to and formed by ClickHouse on INSERT")
+    group.add_argument("--async-insert", action="store_true",
+                       help="Use ClickHouse async inserts (waiting for them to be flushed)")
+
+def block_settings(args):
+    """
+    Returns the server settings for the size of the blocks formed on INSERT.
+    """
+    if args.insert_block_size:
+        return {"max_insert_block_size": args.insert_block_size}
+    return {}
+
+def insert_settings(args):
+    """
+    Returns the server settings for the INSERTs of the scripts over the native protocol.
+    """
+    settings = block_settings(args)
+    if args.async_insert:
+        # Waiting keeps errors visible and the ingest state accurate
+        settings["async_insert"] = 1
+        settings["wait_for_async_insert"] = 1
+    return settings
+
+def connect(args):
+    """
+    Returns a client for the connection options, reusing the one of this process if any.
+    """
+    compression = False if args.compression == "none" else args.compression
+    settings = insert_settings(args)
+    if args.insert_block_size:
+        # Rows per block the driver sends, a client-side setting
+        settings["insert_block_size"] = args.insert_block_size
+
+    key = (os.getpid(), args.host, args.port, args.user, args.password, args.database, args.secure, compression,
+           tuple(sorted(settings.items())))
+    if key not in _clients:
+        try:
+            _clients[key] = Client(
+                host=args.host,
+                port=args.port,
+                user=args.user,
+                password=args.password,
+                database=args.database,
+                secure=args.secure,
+                compression=compression,
+                settings=settings,
+            )
+        except errors.UnknownCompressionMethod as e:
+            raise RuntimeError(f"--compression {compression} needs pip install 'clickhouse-driver[{compression}]'") from e
+    return _clients[key]
+
+class HttpEndpoint:
+    """
+    ClickHouse's HTTP interface, for streaming files (see server_shift.py).
+    """
+
+    def __init__(self, url, user="default", password="", database="default", settings=None):
+        self.url = url
+        self.user = user
+        self.password = password
+        self.database = database
+        self.settings = settings or {}
+
+    @classmethod
+    def from_args(cls, args):
+        scheme = "https" if args.secure else "http"
+        # Whole files are inserted at once: async inserts wouldn't help
+        return cls(f"{scheme}://{args.host}:{args.http_port}/", args.user, args.password, args.database,
+                   block_settings(args))
+
+    def query_url(self, query, settings):
+        params = {"query": query, "database": self.database, **self.settings, **settings}
+        return f"{self.url}?{urllib.parse.urlencode(params)}"
+
+    def headers(self):
+        credentials = base64.b64encode(f"{self.user}:{self.password}".encode("utf-8")).decode("ascii")
+        return {"Authorization": f"Basic {credentials}"}
+
+# The endpoint the scripts used before it became configurable
+DEFAULT_HTTP = HttpEndpoint("http://clickhouse:8123/")
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Fingerprints of the datasets loaded into ClickHouse, kept in the table
+"dataset_fingerprints", so that restarting the stack doesn't reload everything.
+
+Every table loaded by a loader has a row with:
+  • the dataset file and the SHA-256 of its content,
+  • the schema version of its records (see metadata.py),
+  • the options shaping the table: schema profile, time window, and for
+    openssh_logs the IP enrichment (and the SHA-256 of the IP dataset),
+  • the number of rows loaded,
+  • the shift applied to the timestamps and where it moved the end of the
+    dataset to (epoch microseconds).
+
+Before dropping its table, a loader compares the fingerprint of the dataset with
+the stored one and checks that the table still has that many rows. When they
+match, the load is skipped:
+  • if the end of the dataset was shifted less than --reshift-after ago (default:
+    10m), the table is kept as it is,
+  • otherwise it's shifted again in ClickHouse: the table is copied by a single
+    INSERT ... SELECT with the loader's server-side shift (see server_shift.py),
+    keeping seq, which takes seconds instead of decoding the dataset again. The
+    shift recorded for append.py (see ingest_state.py) follows.
+Tables loaded with --virtual-shift are moved to 'now' on every start instead, by
+replacing their views (see virtual_shift.py).
+--reload always drops and reloads the table.
+
+The fingerprint is removed before a table is dropped, and written once it's
+completely loaded, so an interrupted load is redone on the next start. append.py
+adds the rows it appends to the stored number of rows after every batch, so the
+table is kept with them; replay.py and synthetic.py remove the fingerprint of
+the tables they recreate.
+"""
+
+import datetime
+import importlib
+import json
+import os
+
+import numpy as np
+
+from ingest_state import record_load
+from metadata import SCHEMA_VERSION, file_sha256
+from rollups import create_rollup, drop_rollup
+from server_shift import UNIT_MICROSECONDS
+from timeshift import MICROSECONDS, parse_timestamps, utc_now
+from virtual_shift import create_views, raw_table, view_offset_us
+from windows import parse_duration
+
+FINGERPRINT_TABLE = "dataset_fingerprints"
+
+# Drift of the timestamps below which a table is kept as it is
+DEFAULT_RESHIFT_AFTER = "10m"
+
+def create_fingerprint_table(client):
+    """
+    Creates the fingerprint table if it doesn't exist yet.
+    ReplacingMergeTree keeps the latest row of every table.
+    """
+    client.execute(f"""
+        CREATE TABLE IF NOT EXISTS {FINGERPRINT_TABLE} (
+            table_name String,
+            source String,
+            sha256 String,
+            schema_version UInt32,
+            options String,
+            rows UInt64,
+            shift_us Int64,
+            shifted_end_us Nullable(Int64),
+            updated_at DateTime64(6)
+        ) ENGINE = ReplacingMergeTree(updated_at)
+        ORDER BY table_name
+    """)
+
+def dataset_fingerprint(path, args=None, enrich_ips=False):
+    """
+    Returns the fingerprint of the dataset at path as loaded into a log table
+    with the options args, or as is without them. With enrich_ips (only the
+    OpenSSH loader enriches IPs), it also depends on the IP dataset of args.ips.
+    """
+    options = {}
+    if args is not None:
+        options["schema"] = args.schema
+        if enrich_ips:
+            options["ips"] = file_sha256(args.ips)
+        for name in ("since", "until"):
+            if getattr(args, name) is not None:
+                options[name] = str(getattr(args, name))
+        if args.sample < 1:
+            options["sample"] = args.sample
+        if args.virtual_shift:
+            options["virtual_shift"] = True
+    return {
+        "source": os.path.abspath(path),
+        "sha256": file_sha256(path),
+        "schema_version": SCHEMA_VERSION,
+        "options": json.dumps(options, sort_keys=True),
+    }
+
+def read_fingerprint(client, table):
+    """
+    Returns the stored fingerprint of table as a dict, or None.
+    """
+    create_fingerprint_table(client)
+    rows = client.execute(
+        f"SELECT source, sha256, schema_version, options, rows, shift_us, shifted_end_us "
+        f"FROM {FINGERPRINT_TABLE} FINAL WHERE table_name = %(table)s",
+        {"table": table},
+    )
+    if not rows:
+        return None
+    keys = ("source", "sha256", "schema_version", "options", "rows", "shift_us", "shifted_end_us")
+    return dict(zip(keys, rows[0]))
+
+def forget_fingerprint(client, table):
+    """
+    Removes the fingerprint of table, e.g. before the table is dropped.
+    """
+    create_fingerprint_table(client)
+    client.execute(f"DELETE FROM {FINGERPRINT_TABLE} WHERE table_name = %(table)s", {"table": table})
+
+def save_fingerprint(client, table, fingerprint, rows, shift_us=0, shifted_end_us=None):
+    """
+    Records that table holds rows of the dataset of fingerprint, shifted by shift_us,
+    which moved the end of the dataset to shifted_end_us (None for tables without timestamps).
+    """
+    create_fingerprint_table(client)
+    client.execute(
+        f"INSERT INTO {FINGERPRINT_TABLE} (table_name, source, sha256, schema_version, options, rows, "
+        f"shift_us, shifted_end_us, updated_at) VALUES",
+        [(table, fingerprint["source"], fingerprint["sha256"], fingerprint["schema_version"],
+          fingerprint["options"], rows, shift_us, shifted_end_us,
+          datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None))],
+    )
+
+def add_appended_rows(client, table, stored, rows):
+    """
+    Adds rows appended to table by append.py to stored, its fingerprint, so that the
+    table still holds the stored number of rows on the next start.
+    """
+    stored["rows"] += rows
+    save_fingerprint(client, table, stored, stored["rows"], stored["shift_us"], stored["shifted_end_us"])
+
+def shifted_end_us(max_timestamp, shift_us):
+    """
+    Returns where a shift moves the maximum timestamp of a dataset (an ISO-8601 string), in epoch microseconds.
+    """
+    return int(parse_timestamps([max_timestamp], MICROSECONDS)[0].astype(np.int64)) + shift_us
+
+def table_end_us(client, table):
+    """
+    Returns the maximum timestamp of a table in epoch microseconds.
+    """
+    return client.execute(f"SELECT toUnixTimestamp64Micro(toDateTime64(max(timestamp), 6)) FROM {table}")[0][0]
+
+def reshift_table(client, table, loader, shift):
+    """
+    Adds shift (in units of the loader's SHIFT_UNIT) to the timestamps of table
+    by copying it with the shifted_columns of its loader module, and rebuilds its
+    rollup (see rollups.py). Timestamps are part of the sorting key, so they can't
+    be updated in place.
+    """
+    staging = f"{table}_reshift"
+    drop_rollup(client, table)
+    client.execute(f"DROP TABLE IF EXISTS {staging}")
+    client.execute(f"RENAME TABLE {table} TO {staging}")
+    client.execute(f"CREATE TABLE {table} AS {staging}")
+    client.execute(f"INSERT INTO {table} ({', '.join(loader.TABLE_COLUMNS)}) "
+                   f"SELECT {', '.join(loader.shifted_columns(shift))} FROM {staging}")
+    client.execute(f"DROP TABLE {staging}")
+    create_rollup(client, table, loader.ROLLUP_KEYS)
+
+def refresh_views(client, table, loader_name, stored):
+    """
+    Moves the views of table, loaded with --virtual-shift by the loader module
+    loader_name, so that the end of its dataset is 'now' again (see virtual_shift.py),
+    and updates stored, its fingerprint, if any. Returns the offset of the views
+    in microseconds.
+    """
+    if stored is None or stored["shifted_end_us"] is None:
+        end_us = table_end_us(client, raw_table(table))
+    else:
+        end_us = stored["shifted_end_us"] - stored["shift_us"]
+    offset_us = view_offset_us(int(utc_now(MICROSECONDS).astype(np.int64)) - end_us)
+    create_views(client, table, loader_name, offset_us)
+    if stored is not None:
+        save_fingerprint(client, table, stored, stored["rows"], offset_us, end_us + offset_us)
+    return offset_us
+
+def reuse_table(client, args, table, fingerprint, loader_name=None):
+    """
+    Returns the number of rows of table if it already holds the dataset of
+    fingerprint, shifting it again with the shifted_columns of the loader module
+    loader_name if its timestamps drifted by --reshift-after, or moving its views
+    with --virtual-shift. Returns None if the dataset must be loaded.
+    """
+    if args.reload:
+        return None
+    stored = read_fingerprint(client, table)
+    if stored is None or any(stored[key] != value for key, value in fingerprint.items()):
+        return None
+    if not client.execute(f"EXISTS TABLE {table}")[0][0]:
+        return None
+    rows = client.execute(f"SELECT count() FROM {table}")[0][0]
+    if rows != stored["rows"]:
+        return None
+
+    if loader_name is None or stored["shifted_end_us"] is None:
+        print(f"{table} already holds {fingerprint['source']}, skipping the load.")
+        return rows
+    if args.virtual_shift:
+        offset_us = refresh_views(client, table, loader_name, stored)
+        print(f"{table} already holds {fingerprint['source']}, moved its views by "
+              f"{datetime.timedelta(microseconds=offset_us - stored['shift_us'])} instead of reloading it.")
+        return rows
+    drift_us = int(utc_now(MICROSECONDS).astype(np.int64)) - stored["shifted_end_us"]
+    if drift_us < args.reshift_after / datetime.timedelta(microseconds=1):
+        print(f"{table} already holds {fingerprint['source']}, skipping the load.")
+        return rows
+
+    # Don't keep the fingerprint of a table that may be left half copied
+    forget_fingerprint(client, table)
+    loader = importlib.import_module(loader_name)
+    shift = drift_us // UNIT_MICROSECONDS[loader.SHIFT_UNIT]
+    reshift_table(client, table, loader, shift)
+    shift_us = shift * UNIT_MICROSECONDS[loader.SHIFT_UNIT]
+    # Appends line up with the new shift (see append.py)
+    record_load(client, table, fingerprint["source"], stored["shift_us"] + shift_us)
+    save_fingerprint(client, table, fingerprint, rows, stored["shift_us"] + shift_us,
+                     stored["shifted_end_us"] + shift_us)
+    print(f"{table} already holds {fingerprint['source']}, shifted it by "
+          f"{datetime.timedelta(microseconds=shift_us)} instead of reloading it.")
+    return rows
+
+def record_dataset(client, args, table, loader_name, path, fingerprint, rows, shift_us, end_us=None):
+    """
+    Records the complete load of rows of the dataset at path into table, shifted
+    by shift_us, for append.py (see ingest_state.py) and the next start. end_us is
+    where the shift moved the end of the dataset (read from the table if None).
+    With --virtual-shift, the rows were inserted as they are, and the views of
+    the loader module loader_name shifting them are created (see virtual_shift.py).
+    """
+    if args.virtual_shift:
+        shift_us = view_offset_us(shift_us)
+        create_views(client, table, loader_name, shift_us)
+        # append.py inserts the new records into the raw table as they are
+        record_load(client, table, path, 0)
+    else:
+        record_load(client, table, path, shift_us)
+    if end_us is None:
+        end_us = table_end_us(client, table)
+    save_fingerprint(client, table, fingerprint, rows, shift_us, end_us)
+
+def add_fingerprint_args(parser, reshift=True):
+    """
+    Adds the --reload option, and with reshift the --reshift-after option.
+    """
+    parser.add_argument("--reload", action="store_true",
+                        help="Reload the dataset even if the table already holds it (see fingerprints.py)")
+    if not reshift:
+        return
+    parser.add_argument("--reshift-after", type=parse_duration, default=parse_duration(DEFAULT_RESHIFT_AFTER),
+                        help=f"Shift a table that already holds the dataset again once its timestamps are "
+                             f"this much behind, e.g. 1h (default: {DEFAULT_RESHIFT_AFTER})")
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Output formats of the process_*.py converters:
+  • jsonl   - gzip-compressed JSON Lines, one object per record (the default),
+              written as independently compressed frames (see frames.py).
+  • parquet - typed, columnar Parquet file (requires pyarrow). Timestamps are
+              stored as timestamp[us], low-cardinality columns are dictionary
+              encoded and the file is ZSTD-compressed.
+
+The loaders don't decode Parquet files in Python: they are sent to ClickHouse
+as-is with INSERT ... FORMAT Parquet (see server_shift.py).
+
+Every converter describes its records (see records.py) with a list of (name, kind)
+fields, where kind is one of "timestamp", "string", "dictionary" (low-cardinality
+string), "int32" or "int64".
+"""
+
+import contextlib
+import json
+
+from frames import DEFAULT_LEVEL, FRAME_ROWS, FrameWriter, add_frame_args
+
+FORMATS = ["jsonl", "parquet"]
+
+# Number of records per Parquet row group.
+PARQUET_ROW_GROUP_SIZE = 100000
+
+# ClickHouse input format of every output format.
+CLICKHOUSE_FORMATS = {"jsonl": "JSONEachRow", "parquet": "Parquet"}
+
+def format_of(path):
+    """
+    Guesses the format of a dataset file from its extension.
+    """
+    return "parquet" if path.endswith(".parquet") else "jsonl"
+
+class JsonlWriter:
+    """
+    Writes records as gzip-compressed JSON Lines, in frames of frame_rows records.
+    """
+
+    def __init__(self, path, fields, frame_rows=FRAME_ROWS, level=DEFAULT_LEVEL):
+        self.writer = FrameWriter(path, frame_rows, level)
+
+    @property
+    def frames(self):
+        return self.writer.frames
+
+    def write(self, record):
+        # Write one JSON object per line (ASCII, as json.dumps escapes the rest)
+        self.writer.write_line((json.dumps(record.to_dict()) + "\n").encode("ascii"), record.timestamp)
+
+    def close(self):
+        self.writer.close()
+
+class ParquetWriter:
+    """
+    Buffers records into columns and writes them as Parquet row groups.
+    """
+
+    # Parquet files are split into row groups, which ClickHouse reads in parallel
+    frames = None
+
+    def __init__(self, path, fields, row_group_size=PARQUET_ROW_GROUP_SIZE):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("--format parquet needs pyarrow: pip install -r requirements-parquet.txt") from e
+
+        self.pa = pa
+        self.fields = fields
+        self.row_group_size = row_group_size
+        types = {
+            "timestamp": pa.timestamp("us"),
+            "string": pa.string(),
+            "dictionary": pa.string(),
+            "int32": pa.int32(),
+            "int64": pa.int64(),
+        }
+        self.schema = pa.schema([(name, types[kind]) for name, kind in fields])
+        self.writer = pq.ParquetWriter(
+            path,
+            self.schema,
+            compression="zstd",
+            use_dictionary=[name for name, kind in fields if kind == "dictionary"],
+        )
+        self.columns = {name: [] for name, _ in fields}
+
+    def write(self, record):
+        for name, values in self.columns.items():
+            values.append(getattr(record, name))
+        if len(self.columns[self.fields[0][0]]) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        pa = self.pa
+        if not self.columns[self.fields[0][0]]:
+            return
+        arrays = []
+        for (name, kind), field in zip(self.fields, self.schema):
+            values = self.columns[name]
+            if kind == "timestamp":
+                # Parse the whole column of ISO-8601 strings at once
+                arrays.append(pa.array(values, pa.string()).cast(field.type))
+            else:
+                arrays.append(pa.array(values, field.type))
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.columns = {name: [] for name, _ in self.fields}
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+@contextlib.contextmanager
+def open_writer(path, fmt, fields, frame_rows=FRAME_ROWS, level=DEFAULT_LEVEL):
+    """
+    Opens a writer for the given format, closing it when the block exits.
+    frame_rows and level are the frames of the jsonl format. The writer's frames
+    is their index, for the metadata sidecar (None for Parquet).
+    """
+    if fmt == "jsonl":
+        writer = JsonlWriter(path, fields, frame_rows, level)
+    else:
+        writer = ParquetWriter(path, fields)
+    try:
+        yield writer
+    finally:
+        writer.close()
+
+def add_format_arg(parser):
+    """
+    Adds the --format option, and the --level and --frame-rows options of the
+    jsonl frames, to a converter.
+    """
+    parser.add_argument("--format", choices=FORMATS, default="jsonl",
+                        help="Output format: gzip JSON Lines (default) or Parquet (requires pyarrow, "
+                             "see requirements-parquet.txt)")
+    add_frame_args(parser)
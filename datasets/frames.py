@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Seekable gzip datasets made of independently compressed frames.
+
+A single gzip stream can only be decompressed from its beginning, by one core.
+The converters instead write the JSONL datasets as a series of gzip members
+("frames", like BGZF): every FRAME_ROWS lines are compressed on their own and
+appended to the file. The result is still a regular .jsonl.gz that gzip,
+Python's gzip module and ClickHouse read as a whole, but:
+  • the frames are compressed by a pool of threads (zlib releases the GIL), at
+    gzip's level 9 by default: frames of 10000 lines compress within 1% of a
+    single gzip -9 stream of the same lines. --level 6 compresses about twice
+    as fast, but the bundled datasets grow by 5 to 11%,
+  • the frame index (offset and size in the file, number of rows and minimum and
+    maximum timestamp of every frame) is stored in the dataset's metadata sidecar
+    (see metadata.py), so that any frame can be read and decompressed on its own,
+  • the loaders decompress, decode and insert the frames in parallel processes
+    with --workers (see common.py), and only read the frames of the time window
+    of a partial load (see windows.py).
+
+Existing datasets, or any file of lines (plain, gzip-compressed or - for stdin),
+can be rewritten as frames, along with the sidecar of JSONL datasets:
+  python frames.py apache.jsonl.gz apache.framed.jsonl.gz
+"""
+
+import argparse
+import collections
+import gzip
+import os
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of lines per frame
+FRAME_ROWS = 10000
+
+# zlib compression level of the frames
+DEFAULT_LEVEL = 9
+
+# Size of the blocks read by scan_frames
+SCAN_BLOCK_SIZE = 1 << 20
+
+def compress_frame(data, level=DEFAULT_LEVEL):
+    """
+    Compresses data as a complete gzip member.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip header and trailer
+    return compressor.compress(data) + compressor.flush()
+
+def read_frame(f, frame):
+    """
+    Returns the decompressed content of a frame of a file opened in binary mode.
+    """
+    f.seek(frame["offset"])
+    return zlib.decompress(f.read(frame["size"]), 31)
+
+class FrameWriter:
+    """
+    Writes lines (bytes ending with a newline) to a file as gzip frames of
+    frame_rows lines. Frames are compressed by threads threads and written in
+    order; frames is the index of the frames written so far, with the bounds of
+    the ISO-8601 timestamps of their lines when given.
+    """
+
+    def __init__(self, path, frame_rows=FRAME_ROWS, level=DEFAULT_LEVEL, threads=None):
+        self.f = open(path, "wb")
+        self.frame_rows = frame_rows
+        self.level = level
+        self.threads = threads or min(4, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(self.threads)
+        # Frames being compressed, with their number of rows, in file order
+        self.pending = collections.deque()
+        self.lines = []
+        self.min_timestamp = self.max_timestamp = None
+        self.frames = []
+        self.offset = 0
+
+    def write_line(self, line, timestamp=None):
+        self.lines.append(line)
+        if timestamp is not None:
+            # ISO-8601 timestamps with a fixed format sort lexicographically
+            if self.min_timestamp is None or timestamp < self.min_timestamp:
+                self.min_timestamp = timestamp
+            if self.max_timestamp is None or timestamp > self.max_timestamp:
+                self.max_timestamp = timestamp
+        if len(self.lines) >= self.frame_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Hands the buffered lines over to be compressed as a frame.
+        """
+        if not self.lines:
+            return
+        data = b"".join(self.lines)
+        frame = {"rows": len(self.lines), "min_timestamp": self.min_timestamp, "max_timestamp": self.max_timestamp}
+        self.pending.append((self.executor.submit(compress_frame, data, self.level), frame))
+        self.lines = []
+        self.min_timestamp = self.max_timestamp = None
+        # Keep a bounded number of frames in memory
+        while len(self.pending) > 2 * self.threads:
+            self.write_next()
+
+    def write_next(self):
+        future, frame = self.pending.popleft()
+        data = future.result()
+        self.f.write(data)
+        self.frames.append({"offset": self.offset, "size": len(data), **frame})
+        self.offset += len(data)
+
+    def close(self):
+        try:
+            self.flush()
+            while self.pending:
+                self.write_next()
+        finally:
+            self.executor.shutdown()
+            self.f.close()
+
+def scan_frames(path):
+    """
+    Returns the frame index of a gzip file by finding where its members end,
+    without timestamp bounds. A file written as a single gzip stream has a single frame.
+    """
+    frames = []
+    with open(path, "rb") as f:
+        offset = position = rows = 0
+        decompressor = zlib.decompressobj(31)
+        for block in iter(lambda: f.read(SCAN_BLOCK_SIZE), b""):
+            while block:
+                rows += decompressor.decompress(block).count(b"\n")
+                if not decompressor.eof:
+                    position += len(block)
+                    break
+                # The member ends in this block and the next one starts right after it
+                end = position + len(block) - len(decompressor.unused_data)
+                frames.append({"offset": offset, "size": end - offset, "rows": rows})
+                block = decompressor.unused_data
+                offset = position = end
+                rows = 0
+                decompressor = zlib.decompressobj(31)
+    return frames
+
+def open_lines(path):
+    """
+    Opens a file of lines in binary mode: - for stdin, gzip-compressed if it ends with .gz.
+    """
+    if path == "-":
+        return sys.stdin.buffer
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+def add_frame_args(parser):
+    """
+    Adds the --level and --frame-rows options.
+    """
+    parser.add_argument("--level", type=int, choices=range(1, 10), default=DEFAULT_LEVEL, metavar="{1..9}",
+                        help=f"gzip compression level of the frames (default: {DEFAULT_LEVEL})")
+    parser.add_argument("--frame-rows", type=int, default=FRAME_ROWS,
+                        help=f"Number of lines per independently compressed frame (default: {FRAME_ROWS})")
+
+def main():
+    # metadata.py imports this module
+    from metadata import DatasetStats, line_timestamp, write_metadata
+
+    parser = argparse.ArgumentParser(description="Rewrite a file of lines as seekable gzip frames.")
+    parser.add_argument("input", help="File to rewrite: plain, gzip-compressed (.gz) or - for stdin")
+    parser.add_argument("output", help="Output file (.gz); .jsonl.gz datasets of JSON lines get a sidecar")
+    add_frame_args(parser)
+    args = parser.parse_args()
+
+    dataset = args.output.endswith(".jsonl.gz")
+    stats = DatasetStats()
+    writer = FrameWriter(args.output, args.frame_rows, args.level)
+    error = None
+    try:
+        with open_lines(args.input) as f:
+            for number, line in enumerate(f, 1):
+                timestamp = None
+                if dataset:
+                    if line.isspace():
+                        # Not a record: the loaders skip blank lines, so the frames leave them out
+                        continue
+                    # The timestamps of JSONL datasets bound the frames
+                    try:
+                        timestamp = line_timestamp(line.decode("utf-8"))
+                    except ValueError as e:
+                        error = f"line {number} of {args.input} isn't a JSON object ({e}), name the output .gz instead"
+                        break
+                    stats.add(timestamp)
+                writer.write_line(line if line.endswith(b"\n") else line + b"\n", timestamp)
+    finally:
+        writer.close()
+    if error:
+        os.remove(args.output)
+        parser.error(error)
+
+    if dataset:
+        write_metadata(args.output, stats, writer.frames)
+    print(f"Wrote {sum(frame['rows'] for frame in writer.frames)} lines in {len(writer.frames)} frames to {args.output}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Ingestion state of the log tables, kept in the ClickHouse table "ingest_state".
+
+Every (table, source file) pair has a row with:
+  • the byte position up to which the source file has been ingested,
+  • for syslog-style raw logs, the year and month of the last ingested line,
+    to keep tracking the year across Dec to Jan transitions,
+  • the shift (in microseconds) applied to the timestamps of the table, so that
+    appended records line up with the ones loaded before.
+
+The loaders reset the state of their table and record the file they loaded;
+append.py reads it to only ingest what's new.
+"""
+
+import datetime
+import os
+
+STATE_TABLE = "ingest_state"
+
+def create_state_table(client):
+    """
+    Creates the state table if it doesn't exist yet.
+    ReplacingMergeTree keeps the latest row of every (table, source) pair.
+    """
+    client.execute(f"""
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            table_name String,
+            source String,
+            position UInt64,
+            year UInt16,
+            month String,
+            shift_us Int64,
+            updated_at DateTime64(6)
+        ) ENGINE = ReplacingMergeTree(updated_at)
+        ORDER BY (table_name, source)
+    """)
+
+def reset_state(client, table):
+    """
+    Forgets everything ingested into table, e.g. when the table is recreated.
+    """
+    create_state_table(client)
+    client.execute(f"DELETE FROM {STATE_TABLE} WHERE table_name = %(table)s", {"table": table})
+
+def read_state(client, table):
+    """
+    Returns the state of every source file of table, as a dict keyed by source.
+    """
+    create_state_table(client)
+    rows = client.execute(
+        f"SELECT source, position, year, month, shift_us FROM {STATE_TABLE} FINAL "
+        f"WHERE table_name = %(table)s",
+        {"table": table},
+    )
+    return {
+        source: {"position": position, "year": year, "month": month, "shift_us": shift_us}
+        for source, position, year, month, shift_us in rows
+    }
+
+def save_state(client, table, source, position, shift_us, year=0, month=""):
+    """
+    Records how far source has been ingested into table.
+    """
+    client.execute(
+        f"INSERT INTO {STATE_TABLE} (table_name, source, position, year, month, shift_us, updated_at) VALUES",
+        [(table, source, position, year, month, shift_us,
+          datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None))],
+    )
+
+def table_shift(state):
+    """
+    Returns the shift (in microseconds) of a table from its state, or None if nothing was ingested yet.
+    """
+    for source_state in state.values():
+        return source_state["shift_us"]
+    return None
+
+def record_load(client, table, path, shift_us):
+    """
+    Records a full load of the dataset at path into a freshly created table.
+    """
+    reset_state(client, table)
+    save_state(client, table, os.path.abspath(path), os.path.getsize(path), shift_us)
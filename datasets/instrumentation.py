@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Instrumentation of the load_*.py loaders and the process_*.py converters.
+
+A Metrics object collects, for one run of a script:
+  • the wall and CPU time, number of calls and rows of every stage, e.g.
+      loaders:    max_timestamp, gunzip (reading and decompressing lines),
+                  json_decode, build_columns (to_columns: timestamps, dates,
+                  enrichment), insert; or upload and insert_select with --server-side,
+      converters: parse (reading and parsing lines, in parallel with --jobs),
+                  write (encoding and compressing, or buffering Parquet row groups).
+    Stages are timed per block of rows rather than per row, so that measuring
+    doesn't change what is measured,
+  • date_rewrite, the time spent in the DateRewriters, as part of build_columns.
+    It has to be timed per call, so it's only measured when a report is requested,
+  • the number of rows and rows/s,
+  • bytes in (the input file), decompressed (the JSON lines read from it) and
+    out (sent to ClickHouse, or the output file of a converter),
+  • the peak RSS of the process (and of its finished children, e.g. --jobs parsers),
+  • the hit rates of the caches (DateRewriters, IP parsing).
+
+At the end of the run, a short summary is printed with --verbose or when a
+report is requested, and with:
+  --metrics PATH     the JSON report is written to PATH (- for stdout, in which
+                     case everything else the script prints goes to stderr),
+  --prometheus PATH  the metrics are written to a Prometheus textfile, atomically,
+                     e.g. into the directory of node_exporter's textfile collector,
+  --profile PATH     every stage is profiled with cProfile and the stats of the hot
+                     stage (the one with the most wall time) are dumped to PATH, for
+                     python -m pstats or snakeviz. Its top functions are printed.
+"{name}" in the paths is replaced by the script name, e.g. metrics/{name}.json,
+which keeps the reports of load_all.py's datasets apart (it can't write the
+reports of several datasets to stdout).
+
+The peak RSS is the process's: a load_all.py worker loading several datasets
+reports the peak of all of them so far.
+
+The worker processes of a load with --workers (see common.py) time their stages
+in a Metrics of their own and send what they measured with every result (take());
+the loader merges it into its Metrics (merge()). The wall time of these stages is
+then summed over the workers, and can exceed the wall time of the run.
+"""
+
+import contextlib
+import cProfile
+import datetime
+import itertools
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+
+# Number of rows per timed block
+BLOCK_ROWS = 10000
+
+# Number of functions printed from the profile of the hot stage
+PROFILE_TOP = 20
+
+# Prefix of the Prometheus metric names
+PROMETHEUS_PREFIX = "oql_dataset"
+
+# The original stdout, once report_stdout() has sent the prints to stderr
+_report_stream = None
+
+class Stage:
+    """
+    Time and rows accumulated by a stage. cpu is None for stages timed per call.
+    parent is the stage this one is part of, if any.
+    """
+
+    def __init__(self, parent=None):
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.calls = 0
+        self.rows = 0
+        self.parent = parent
+        self.profile = None
+
+    def report(self, total_wall):
+        return {
+            "wall_seconds": round(self.wall, 6),
+            "cpu_seconds": None if self.cpu is None else round(self.cpu, 6),
+            "calls": self.calls,
+            "rows": self.rows,
+            "rows_per_second": round(self.rows / self.wall, 1) if self.rows and self.wall else None,
+            "share": round(self.wall / total_wall, 4) if total_wall else None,
+            "part_of": self.parent,
+        }
+
+def max_rss_bytes(who=resource.RUSAGE_SELF):
+    """
+    Returns the peak resident set size of the process (or of its largest finished child).
+    """
+    maxrss = resource.getrusage(who).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+def children_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+class Metrics:
+    """
+    Metrics of one run of a script (see the module docstring).
+    A disabled Metrics (NO_METRICS) measures nothing, for callers that don't pass one.
+    """
+
+    def __init__(self, name, args=None, enabled=True, detailed=None):
+        self.name = name
+        self.enabled = enabled
+        self.metrics_path = self._path(getattr(args, "metrics", None))
+        self.prometheus_path = self._path(getattr(args, "prometheus", None))
+        self.profile_path = self._path(getattr(args, "profile", None))
+        # Per-call timing only pays off when someone reads the report
+        if detailed is None:
+            detailed = bool(self.metrics_path or self.prometheus_path or self.profile_path)
+        self.detailed = enabled and detailed
+        # Whether the summary and the progress of the run are printed
+        self.verbose = enabled and bool(getattr(args, "verbose", False) or self.metrics_path
+                                        or self.prometheus_path or self.profile_path)
+        if self.enabled and self.metrics_path == "-":
+            report_stdout()
+        self.stages = {}
+        self.caches = {}
+        # Cache hits and misses merged from workers, and those already taken from this process
+        self.merged_caches = {}
+        self._taken_caches = {}
+        self.bytes = {"in": 0, "decompressed": 0, "out": 0}
+        self.rows = 0
+        self._depth = 0
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self._start_children_cpu = children_cpu_seconds()
+
+    def _path(self, path):
+        return path.replace("{name}", self.name) if path else None
+
+    def _stage(self, name, parent=None):
+        if name not in self.stages:
+            self.stages[name] = Stage(parent)
+        return self.stages[name]
+
+    def stage(self, name, rows=0):
+        """
+        Returns a context manager timing a block of work as part of a stage.
+        Stages opened within another stage are timed but not profiled.
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timed(self._stage(name), rows)
+
+    @contextlib.contextmanager
+    def _timed(self, stage, rows):
+        profile = None
+        if self.profile_path and self._depth == 0:
+            if stage.profile is None:
+                stage.profile = cProfile.Profile()
+            profile = stage.profile
+        self._depth += 1
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            stage.cpu += time.process_time() - cpu
+            stage.wall += time.perf_counter() - wall
+            stage.calls += 1
+            stage.rows += rows
+            self._depth -= 1
+
+    def blocks(self, name, iterable, size=BLOCK_ROWS):
+        """
+        Yields the items of iterable in lists of at most size items, timing how
+        long producing every list takes as part of the stage name.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                block = list(itertools.islice(iterator, size))
+            if not block:
+                return
+            self.add_rows(name, len(block))
+            yield block
+
+    def add_rows(self, stage, rows):
+        """
+        Adds rows to the rows processed by a stage.
+        """
+        if self.enabled:
+            self._stage(stage).rows += rows
+
+    def add_bytes(self, kind, count):
+        """
+        Adds count bytes to bytes "in", "decompressed" or "out".
+        """
+        if self.enabled:
+            self.bytes[kind] += count
+
+    def add_cache(self, name, cache):
+        """
+        Reports the hit rate of cache, anything with a functools-style cache_info().
+        """
+        if self.enabled:
+            self.caches[name] = cache
+
+    def add_rewriter(self, name, rewriter, stage="date_rewrite", parent="build_columns"):
+        """
+        Reports the cache of a timeshift.DateRewriter and, when a report is
+        requested, the time spent in it as a stage that is part of parent.
+        """
+        self.add_cache(name, rewriter)
+        if not self.detailed:
+            return
+        timed = self._stage(stage, parent)
+        timed.cpu = None
+
+        def timed_call(method):
+            def call(*args):
+                start = time.perf_counter()
+                try:
+                    return method(*args)
+                finally:
+                    timed.wall += time.perf_counter() - start
+                    timed.calls += 1
+            return call
+
+        # Instance attributes shadow the methods of the class
+        for method in ("replace_first", "replace_prefix", "replace_all"):
+            setattr(rewriter, method, timed_call(getattr(rewriter, method)))
+
+    def take(self):
+        """
+        Returns what was measured since the last call as a picklable snapshot,
+        for a worker process to send to the loader, and resets the stages.
+        """
+        snapshot = {"stages": {}, "bytes": dict(self.bytes), "caches": {}}
+        if not self.enabled:
+            return snapshot
+        for name, stage in self.stages.items():
+            snapshot["stages"][name] = (stage.wall, stage.cpu, stage.calls, stage.rows, stage.parent)
+            # Reset in place: the rewriter timers hold on to their stage
+            stage.wall = 0.0
+            stage.cpu = None if stage.cpu is None else 0.0
+            stage.calls = stage.rows = 0
+        for name, cache in self.caches.items():
+            info = cache.cache_info()
+            hits, misses = self._taken_caches.get(name, (0, 0))
+            snapshot["caches"][name] = (info.hits - hits, info.misses - misses)
+            self._taken_caches[name] = (info.hits, info.misses)
+        self.bytes = dict.fromkeys(self.bytes, 0)
+        return snapshot
+
+    def merge(self, snapshot):
+        """
+        Adds a snapshot returned by the take() of a worker to the metrics.
+        """
+        if not self.enabled:
+            return
+        for name, (wall, cpu, calls, rows, parent) in snapshot["stages"].items():
+            stage = self._stage(name, parent)
+            stage.wall += wall
+            stage.cpu = None if cpu is None or stage.cpu is None else stage.cpu + cpu
+            stage.calls += calls
+            stage.rows += rows
+        for kind, count in snapshot["bytes"].items():
+            self.bytes[kind] += count
+        for name, (hits, misses) in snapshot["caches"].items():
+            merged = self.merged_caches.setdefault(name, [0, 0])
+            merged[0] += hits
+            merged[1] += misses
+
+    def hot_stage(self):
+        """
+        Returns the name of the top-level stage with the most wall time, or None.
+        """
+        top = [(stage.wall, name) for name, stage in self.stages.items() if stage.parent is None]
+        return max(top)[1] if top else None
+
+    def report(self, rows=None):
+        """
+        Returns the metrics as a JSON-serializable dict.
+        """
+        wall = time.perf_counter() - self._start_wall
+        rows = self.rows if rows is None else rows
+        caches = {}
+        for name, cache in self.caches.items():
+            info = cache.cache_info()
+            caches[name] = {"hits": info.hits, "misses": info.misses, "size": info.currsize,
+                            "maxsize": info.maxsize}
+        for name, (hits, misses) in self.merged_caches.items():
+            # The sizes of the workers' caches aren't merged
+            cache = caches.setdefault(name, {"hits": 0, "misses": 0, "size": None, "maxsize": None})
+            cache["hits"] += hits
+            cache["misses"] += misses
+        for cache in caches.values():
+            lookups = cache["hits"] + cache["misses"]
+            cache["hit_rate"] = round(cache["hits"] / lookups, 4) if lookups else None
+        return {
+            "script": self.name,
+            "started_at": self.started_at.isoformat(),
+            "wall_seconds": round(wall, 6),
+            "cpu_seconds": round(time.process_time() - self._start_cpu, 6),
+            "children_cpu_seconds": round(children_cpu_seconds() - self._start_children_cpu, 6),
+            "rows": rows,
+            "rows_per_second": round(rows / wall, 1) if wall else None,
+            "bytes": dict(self.bytes),
+            "peak_rss_bytes": max_rss_bytes(),
+            "children_peak_rss_bytes": max_rss_bytes(resource.RUSAGE_CHILDREN),
+            "hot_stage": self.hot_stage(),
+            "stages": {name: stage.report(wall) for name, stage in self.stages.items()},
+            "caches": caches,
+        }
+
+    def finish(self, rows):
+        """
+        Ends the run of a script that processed rows: prints the summary if
+        verbose and writes the requested report, textfile and profile.
+        """
+        if not self.enabled:
+            return None
+        self.rows = rows
+        report = self.report()
+        if self.verbose:
+            print_summary(report)
+        if self.metrics_path:
+            text = json.dumps(report, indent=2) + "\n"
+            if self.metrics_path == "-":
+                report_stdout().write(text)
+            else:
+                write_atomically(self.metrics_path, text)
+        if self.prometheus_path:
+            write_atomically(self.prometheus_path, prometheus_text(report))
+        if self.profile_path and report["hot_stage"]:
+            self.dump_profile(report["hot_stage"])
+        return report
+
+    def dump_profile(self, name):
+        profile = self.stages[name].profile
+        if profile is None:
+            return
+        profile.dump_stats(self.profile_path)
+        print(f"Profile of the {name} stage written to {self.profile_path}, top functions:")
+        pstats.Stats(profile, stream=sys.stdout).sort_stats("cumulative").print_stats(PROFILE_TOP)
+
+NO_METRICS = Metrics("none", enabled=False)
+
+def report_stdout():
+    """
+    Returns the stdout of the process for a report written to it (--metrics -),
+    and sends everything the script prints from then on to stderr, so that stdout
+    holds nothing but the JSON report.
+    """
+    global _report_stream
+    if _report_stream is None:
+        _report_stream = sys.stdout
+        sys.stdout = sys.stderr
+    return _report_stream
+
+def print_summary(report):
+    """
+    Prints the time per stage, the throughput, the peak RSS and the cache hit rates.
+    """
+    stages = []
+    for name, stage in report["stages"].items():
+        if stage["part_of"] is None:
+            parts = [f"{part} {sub['wall_seconds']:.2f}s" for part, sub in report["stages"].items()
+                     if sub["part_of"] == name]
+            stages.append(f"{name} {stage['wall_seconds']:.2f}s" + (f" ({', '.join(parts)})" if parts else ""))
+    if stages:
+        print(f"Stages: {', '.join(stages)}")
+    rate = report["rows_per_second"] or 0
+    print(f"{report['rows']} rows in {report['wall_seconds']:.2f}s ({rate:,.0f} rows/s), "
+          f"peak RSS {report['peak_rss_bytes'] / (1 << 20):.1f} MiB")
+    for name, cache in report["caches"].items():
+        if cache["hit_rate"] is not None:
+            print(f"{name} cache hit rate: {cache['hit_rate']:.1%}")
+
+def prometheus_text(report):
+    """
+    Formats a report in the Prometheus text exposition format.
+    """
+    script = report["script"]
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} {kind}")
+        for labels, value in samples:
+            labels = ",".join(f'{key}="{value}"' for key, value in [("script", script)] + labels)
+            lines.append(f"{PROMETHEUS_PREFIX}_{name}{{{labels}}} {value}")
+
+    stages = report["stages"].items()
+    metric("wall_seconds", "gauge", "Wall time of the run.", [([], report["wall_seconds"])])
+    metric("cpu_seconds", "gauge", "CPU time of the run.", [([], report["cpu_seconds"])])
+    metric("rows", "gauge", "Rows processed by the run.", [([], report["rows"])])
+    metric("rows_per_second", "gauge", "Rows processed per second of wall time.",
+           [([], report["rows_per_second"] or 0)])
+    metric("bytes", "gauge", "Bytes read, decompressed and written.",
+           [([("direction", kind)], count) for kind, count in report["bytes"].items()])
+    metric("peak_rss_bytes", "gauge", "Peak resident set size of the process.", [([], report["peak_rss_bytes"])])
+    metric("stage_wall_seconds", "gauge", "Wall time spent in a stage.",
+           [([("stage", name)], stage["wall_seconds"]) for name, stage in stages])
+    metric("stage_cpu_seconds", "gauge", "CPU time spent in a stage.",
+           [([("stage", name)], stage["cpu_seconds"]) for name, stage in stages if stage["cpu_seconds"] is not None])
+    metric("stage_rows", "gauge", "Rows processed by a stage.",
+           [([("stage", name)], stage["rows"]) for name, stage in stages])
+    metric("cache_hit_ratio", "gauge", "Fraction of the cache lookups that were hits.",
+           [([("cache", name)], cache["hit_rate"]) for name, cache in report["caches"].items()
+            if cache["hit_rate"] is not None])
+    metric("last_run_timestamp_seconds", "gauge", "Time the run started at.",
+           [([], datetime.datetime.fromisoformat(report["started_at"]).timestamp())])
+    return "\n".join(lines) + "\n"
+
+def write_atomically(path, text):
+    """
+    Writes text to path through a temporary file renamed over it, so that readers
+    (e.g. node_exporter) never see a partial file.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as f:
+        f.write(text)
+    os.replace(temporary, path)
+
+def add_metrics_args(parser):
+    """
+    Adds the --verbose, --metrics, --prometheus and --profile options.
+    """
+    group = parser.add_argument_group("instrumentation")
+    group.add_argument("-v", "--verbose", action="store_true",
+                       help="Print the time per stage, throughput, memory and cache hit rates at the end "
+                            "(also with any of the options below), and the chunks read by a partial load")
+    group.add_argument("--metrics", metavar="PATH",
+                       help="Write a JSON report of the stages, throughput, memory and caches (- for stdout)")
+    group.add_argument("--prometheus", metavar="PATH",
+                       help="Write the metrics to a Prometheus textfile (.prom)")
+    group.add_argument("--profile", metavar="PATH",
+                       help="Profile the stages with cProfile and dump the stats of the slowest one to PATH")
+
+def uses_name(args):
+    """
+    Returns whether every output path of the instrumentation options contains {name}.
+    """
+    paths = [args.metrics, args.prometheus, args.profile]
+    return all("{name}" in path for path in paths if path)
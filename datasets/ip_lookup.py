@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Ingest-time IP enrichment for the loaders.
+
+The IP geolocation dataset (ips.jsonl.gz, see load_ips.py) is read once into a
+compact lookup structure:
+  • the IPv4 addresses as a sorted NumPy uint32 array,
+  • for every enrichment column, one int32 code per address pointing into the
+    column's distinct values (most of them repeat: countries, ASNs).
+
+A batch of IPs is then enriched at once: the addresses are converted to uint32
+and located with a single np.searchsorted, instead of a dict lookup (or a
+ClickHouse query) per row. Addresses that are missing, invalid or IPv6 (the
+dataset has none) get NULL enrichment columns.
+
+--server-side loads can't use the lookup, as the rows never reach Python: they
+look the IPs up in the ip_dict dictionary instead, so load_ips.py has to run first.
+"""
+
+import functools
+import ipaddress
+
+import numpy as np
+
+from common import iter_records
+
+IPS_DATASET = "ips.jsonl.gz"
+
+# Columns of ips.jsonl.gz materialized into the log tables, in table order
+ENRICHMENT_FIELDS = ["country_short", "country_long", "asn", "hostname"]
+
+# Code of a NULL value
+NULL_CODE = -1
+
+@functools.lru_cache(maxsize=65536)
+def ipv4_to_int(ip):
+    """
+    Returns an IPv4 address as an integer, or None if it's not a valid IPv4 address.
+    Cached, as the same few addresses show up in many log lines.
+    """
+    try:
+        return int(ipaddress.IPv4Address(ip))
+    except (ipaddress.AddressValueError, TypeError, ValueError):
+        return None
+
+class IpLookup:
+    """
+    Enrichment columns of the IPv4 addresses of the IP dataset, for batches of IPs.
+    """
+
+    def __init__(self, addresses, codes, values):
+        self.addresses = addresses  # sorted uint32 array
+        self.codes = codes          # field -> int32 array aligned with addresses
+        self.values = values        # field -> object array of distinct values
+
+    @classmethod
+    def from_file(cls, path=IPS_DATASET):
+        """
+        Builds the lookup from the IP dataset. When an address appears more than
+        once, its last record wins (like a ClickHouse dictionary).
+        """
+        latest = {}
+        for record in iter_records(path):
+            address = ipv4_to_int(record.get("ip"))
+            if address is not None:
+                latest[address] = record
+
+        addresses = np.array(sorted(latest), dtype=np.uint32)
+        codes = {}
+        values = {}
+        for field in ENRICHMENT_FIELDS:
+            # Dictionary-encode the field: distinct values and one code per address
+            distinct = {}
+            field_codes = np.empty(len(addresses), dtype=np.int32)
+            for i, address in enumerate(addresses.tolist()):
+                value = latest[address].get(field)
+                field_codes[i] = NULL_CODE if value is None else distinct.setdefault(value, len(distinct))
+            codes[field] = field_codes
+            values[field] = np.array(list(distinct), dtype=object)
+        return cls(addresses, codes, values)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def columns(self, ips):
+        """
+        Returns the enrichment columns (lists in ENRICHMENT_FIELDS order) of a batch of IPs.
+        """
+        if not len(self.addresses):
+            return empty_columns(len(ips))
+        parsed = [ipv4_to_int(ip) for ip in ips]
+        wanted = np.array([NULL_CODE if address is None else address for address in parsed], dtype=np.int64)
+        # Position of every wanted address in the sorted array, and whether it's really there
+        positions = np.searchsorted(self.addresses, wanted).clip(max=len(self.addresses) - 1)
+        found = self.addresses[positions] == wanted
+
+        columns = []
+        for field in ENRICHMENT_FIELDS:
+            field_codes = np.where(found, self.codes[field][positions], NULL_CODE)
+            column = np.full(len(wanted), None, dtype=object)
+            known = field_codes != NULL_CODE
+            column[known] = self.values[field][field_codes[known]]
+            columns.append(column.tolist())
+        return columns
+
+def empty_columns(rows):
+    """
+    Returns NULL enrichment columns for a batch of rows that isn't enriched.
+    """
+    return [[None] * rows for _ in ENRICHMENT_FIELDS]
+
+def add_enrich_args(parser):
+    """
+    Adds the --enrich-ips and --ips options.
+    """
+    parser.add_argument("--enrich-ips", action="store_true",
+                        help="Fill the country, ASN and hostname columns of openssh_logs from the IP dataset")
+    parser.add_argument("--ips", default=IPS_DATASET,
+                        help=f"IP dataset used by --enrich-ips (default: {IPS_DATASET})")
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+This script:
+  • Runs all the load_*.py loaders concurrently in a process pool, once
+    load_ips.py has created the IP dictionary the others may enrich IPs with.
+  • Limits the number of loads running at the same time with --jobs.
+  • Isolates failures: an error in one dataset doesn't stop the others.
+  • Passes the connection options (see connection.py) to every loader; a worker
+    process that loads several datasets reuses its connection.
+  • Prints a summary table with the number of rows and elapsed time per dataset.
+  • Passes the instrumentation options (see instrumentation.py) to every loader:
+    their paths must contain {name}, replaced by the loader's name, so that the
+    reports of the datasets don't overwrite each other.
+  • Restarts in seconds when nothing changed: every loader keeps the table that
+    already holds its dataset, shifting it again in ClickHouse if needed (see
+    fingerprints.py), or only moving its views with --virtual-shift (see
+    virtual_shift.py); --reload reloads everything.
+  • Exits with a non-zero status if any of the loads failed.
+"""
+
+import argparse
+import importlib
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from common import add_common_args
+from instrumentation import report_stdout, uses_name
+from ip_lookup import add_enrich_args
+
+# Loader modules, in the order they used to be run one after another.
+LOADERS = ["load_ips", "load_apache", "load_hadoop", "load_linux", "load_openssh"]
+
+# Loaders whose tables the others may read, run before them.
+FIRST_LOADERS = ["load_ips"]
+
+def run_loader(name, args):
+    """
+    Runs a single loader in a worker process.
+    Returns (rows, elapsed seconds, error message or None).
+    """
+    start = time.monotonic()
+    try:
+        rows = importlib.import_module(name).load(args)
+        return rows, time.monotonic() - start, None
+    except Exception as e:
+        traceback.print_exc()
+        return None, time.monotonic() - start, f"{type(e).__name__}: {e}"
+
+def run_loaders(executor, names, args, results, start):
+    """
+    Runs the loaders of names concurrently in executor and waits for all of them,
+    storing their outcome (see run_loader) in results.
+    """
+    futures = {executor.submit(run_loader, name, args): name for name in names}
+    for future in as_completed(futures):
+        name = futures[future]
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            # The worker process itself died (e.g. it was killed by the OOM killer).
+            results[name] = (None, time.monotonic() - start, f"{type(e).__name__}: {e}")
+        rows, seconds, error = results[name]
+        print(f"{name} {'failed' if error else 'finished'} after {seconds:.1f}s")
+
+def print_summary(results, elapsed):
+    """
+    Prints a table with the outcome of every load.
+    """
+    print()
+    print(f"{'dataset':<14} {'status':<8} {'rows':>12} {'elapsed':>10}")
+    for name in LOADERS:
+        if name not in results:
+            continue
+        rows, seconds, error = results[name]
+        status = "FAILED" if error else "ok"
+        rows_str = "-" if rows is None else str(rows)
+        print(f"{name:<14} {status:<8} {rows_str:>12} {seconds:>9.1f}s")
+        if error:
+            print(f"    {error}")
+    print(f"Total wall time: {elapsed:.1f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load all datasets into ClickHouse concurrently.")
+    parser.add_argument("--jobs", type=int, default=len(LOADERS),
+                        help=f"Maximum number of datasets loaded at the same time (default: {len(LOADERS)})")
+    parser.add_argument("--only", nargs="+", choices=LOADERS, default=LOADERS,
+                        help="Load only the given datasets")
+    add_common_args(parser)
+    add_enrich_args(parser)
+    args = parser.parse_args()
+    if len(args.only) > 1 and not uses_name(args):
+        parser.error("the --metrics, --prometheus and --profile paths must contain {name} to load several datasets")
+    if args.metrics == "-":
+        # The report of the dataset is the only output on stdout
+        report_stdout()
+
+    start = time.monotonic()
+    results = {}
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        # load_ips runs to completion first: it recreates the ip_dict dictionary,
+        # which load_openssh reads with --server-side --enrich-ips.
+        for names in ([name for name in args.only if name in FIRST_LOADERS],
+                      [name for name in args.only if name not in FIRST_LOADERS]):
+            run_loaders(executor, names, args, results, start)
+
+    print_summary(results, time.monotonic() - start)
+    if any(error for _, _, error in results.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
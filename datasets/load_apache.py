@@ -1,121 +1,270 @@
 #!/usr/bin/env python3
 """
 This script:
-  • Connects to ClickHouse on clickhouse:9000.
-  • Drops any existing table named "apache_logs" and then creates a new one.
-  • Loads Apache log records from a gzip-compressed JSONL file.
-  • Scans the file to determine the maximum timestamp.
+  • Connects to ClickHouse (clickhouse:9000 unless configured, see connection.py).
+  • Keeps the existing "apache_logs" table if it already holds the same dataset
+    loaded the same way, only shifting it again in ClickHouse once its timestamps
+    drifted (see fingerprints.py).
+  • Otherwise, drops any existing table named "apache_logs" and then creates a new one.
+  • Reads the maximum timestamp from the dataset's metadata sidecar, or scans the
+    gzip-compressed JSONL file once if the sidecar is missing or stale.
   • Computes the delta so that shifting the max timestamp gives the current time.
+  • Streams the Apache log records from the file as compact typed records (see
+    records.py), numbering them in file order
+    (seq), as the table is ordered by (timestamp, seq).
   • Adjusts each record's timestamp by that delta.
   • Also adjusts the date in the logline field to match the shifted timestamp.
-  • Inserts all the adjusted records into the ClickHouse table.
+  • Inserts the adjusted records into the ClickHouse table in fixed-size batches,
+    from --workers processes if the file is made of gzip frames (see frames.py).
+  • With --since, --until and --sample, only loads the rows of a time window,
+    reading only the frames of the file that overlap it (see windows.py).
+  • With --virtual-shift, inserts the records as they are into "apache_logs_raw"
+    instead, and creates "apache_logs" as a view shifting the timestamps and the
+    dates in the logline at query time (see virtual_shift.py).
+  • Reports the time spent in every stage, rows/s, bytes, peak RSS and the date
+    cache hit rates, optionally as a JSON report, a Prometheus textfile and a
+    cProfile dump of the slowest stage (see instrumentation.py).
 """
 
-# FIXME: there can be multiple log lines in a single second - currently we lose
-# the order of loglines within that one second!
-
-import json
-import gzip
+import argparse
 import datetime
-import re
-from clickhouse_driver import Client
+import numpy as np
 
-def main():
-    # Connect to ClickHouse on clickhouse:9000.
-    client = Client(host='clickhouse', port=9000)
+from common import add_common_args, insert_dataset
+from connection import HttpEndpoint, connect
+from formats import CLICKHOUSE_FORMATS, format_of
+from fingerprints import dataset_fingerprint, forget_fingerprint, record_dataset, reuse_table, shifted_end_us
+from instrumentation import NO_METRICS, Metrics
+from metadata import dataset_max_timestamp
+from records import ApacheRecord
+from rollups import create_rollup, drop_rollup
+from schemas import create_table_sql
+from server_shift import FILE_ORDER_SEQ, load_server_side, make_datetime_sql, sql_string
+from timeshift import SECONDS, DateRewriter, UnshiftedDates
+from virtual_shift import drop_raw_table, load_shifters, raw_table
+from windows import Window, window_requested
+
+DATASET = "apache.jsonl.gz"
+
+# Records of the dataset (see records.py)
+RECORD_TYPE = ApacheRecord
+
+# Columns of the converted dataset (also used for the staging table of --server-side loads)
+DATASET_COLUMNS = """
+    timestamp DateTime,
+    severity String,
+    client Nullable(String),
+    function Nullable(String),
+    path Nullable(String),
+    msg String,
+    logline String
+"""
+
+# Columns of the apache_logs table: the dataset's and seq, the position of the record
+# in its file, which keeps the order of lines within the same timestamp
+COLUMNS = DATASET_COLUMNS.rstrip() + """,
+    seq UInt64
+"""
+
+# Names of the columns of the apache_logs table, in order
+TABLE_COLUMNS = ["timestamp", "severity", "client", "function", "path", "msg", "logline", "seq"]
+
+# Columns of the apache_logs table in the optimized schema profile (see schemas.py)
+OPTIMIZED_COLUMNS = """
+    timestamp DateTime CODEC(Delta, ZSTD(1)),
+    severity LowCardinality(String),
+    client Nullable(String),
+    function LowCardinality(Nullable(String)),
+    path Nullable(String) CODEC(ZSTD(1)),
+    msg String CODEC(ZSTD(1)),
+    logline String CODEC(ZSTD(1)),
+    seq UInt64 CODEC(Delta, ZSTD(1)),
+    PROJECTION by_severity (SELECT * ORDER BY severity, timestamp, seq)
+"""
+
+# Columns of the per-minute rollup of the table (see rollups.py)
+ROLLUP_KEYS = ["severity"]
+
+# dateDiff unit of the shifts of the table in ClickHouse (see server_shift.py)
+SHIFT_UNIT = "second"
+
+# NumPy dtypes of the columns, used with --numpy
+COLUMN_DTYPES = [np.int64, object, object, object, object, object, object, np.uint64]
+
+# The date in the logline, including the square brackets, e.g., "[Sun Dec 04 04:47:44 2005]"
+LOGLINE_DATE_PATTERN = r'\[(Mon|Tue|Wed|Thu|Fri|Sat|Sun) (Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) \d{1,2} \d{2}:\d{2}:\d{2} \d{4}\]'
+
+def logline_rewriter(shift):
+    """
+    Returns a DateRewriter that shifts the date in Apache loglines by shift.
+    """
+    if not shift:
+        return UnshiftedDates()
+
+    def shift_date(date_str, year):
+        # Remove brackets for parsing
+        date_inner = date_str[1:-1]
+        # Parse the date
+        orig_logline_date = datetime.datetime.strptime(date_inner, "%a %b %d %H:%M:%S %Y")
+
+        # Apply the time shift
+        new_logline_date = orig_logline_date + shift
+
+        # Format back to the original format with brackets
+        return f"[{new_logline_date.strftime('%a %b %d %H:%M:%S %Y')}]"
+
+    return DateRewriter(LOGLINE_DATE_PATTERN, shift_date)
+
+def to_columns(records, shifter, rewriter):
+    """
+    Builds the columns (in the same order as the table columns) for a batch of records.
+    The timestamps of the whole batch are parsed and shifted at once.
+    """
+    return [
+        shifter.shift_column([record.timestamp for record in records]),
+        [record.severity for record in records],
+        [record.client for record in records],    # client can be null
+        [record.function for record in records],  # function can be null
+        [record.path for record in records],      # path can be null
+        [record.msg for record in records],
+        [rewriter.replace_first(record.logline) for record in records],
+        [record.seq for record in records],
+    ]
+
+def columns_builder(shifter, args, metrics=NO_METRICS):
+    """
+    Returns the function building the columns of a batch of records for a load
+    shifted by shifter, reporting its date caches to metrics.
+    """
+    rewriter = logline_rewriter(shifter.timedelta)
+    metrics.add_rewriter("logline_date", rewriter)
+    return lambda records: to_columns(records, shifter, rewriter)
+
+# LOGLINE_DATE_PATTERN for ClickHouse, capturing the whole date and each of its components
+SERVER_SIDE_DATE_PATTERN = r'(\[(?:Mon|Tue|Wed|Thu|Fri|Sat|Sun) (Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) (\d{1,2}) (\d{2}):(\d{2}):(\d{2}) (\d{4})\])'
+
+def server_side_columns(shift, seq=FILE_ORDER_SEQ):
+    """
+    Returns the SQL expressions of the TABLE_COLUMNS of a row of a staging table,
+    shifting the timestamp and the date in the logline by shift seconds, or
+    keeping them as they are if shift is None. seq is the expression of the seq column.
+    """
+    if shift is None:
+        return ["timestamp", "severity", "client", "function", "path", "msg", "logline", seq]
+    orig_logline_date = make_datetime_sql("d[7]", "d[2]", "d[3]", "d[4]", "d[5]", "d[6]")
+    new_date_str = f"concat('[', formatDateTime({orig_logline_date} + {shift}, '%a %b %d %H:%i:%S %Y'), ']')"
+    return [
+        f"timestamp + {shift}",
+        "severity",
+        "client",
+        "function",
+        "path",
+        "msg",
+        f"""if((extractGroups(logline, {sql_string(SERVER_SIDE_DATE_PATTERN)}) AS d)[1] = '',
+               logline,
+               replaceAll(logline, d[1], {new_date_str}))""",
+        seq,
+    ]
+
+def server_side_insert(staging, shift, table="apache_logs"):
+    """
+    Builds the INSERT ... SELECT copying the staging table into table (apache_logs
+    or its raw table), shifting the rows by shift seconds (see server_side_columns).
+    """
+    return f"""
+        INSERT INTO {table} ({", ".join(TABLE_COLUMNS)})
+        -- The staging table is read in file order (see server_shift.py)
+        SELECT {", ".join(server_side_columns(shift))}
+        FROM {staging}
+    """
+
+def shifted_columns(shift):
+    """
+    Returns the SQL expressions of the TABLE_COLUMNS of a row of apache_logs (or of
+    its raw table) shifted by shift seconds, for shifting the table again (see
+    fingerprints.py) or in a view (see virtual_shift.py).
+    """
+    return server_side_columns(shift, seq="seq")
+
+def load(args):
+    """
+    Loads the dataset into ClickHouse and returns the number of inserted rows.
+    """
+    path = args.input or DATASET
+    input_format = format_of(path)
+    metrics = Metrics("load_apache", args)
+    if window_requested(args) and (args.server_side or input_format == "parquet"):
+        raise ValueError("--since, --until and --sample need a JSONL dataset loaded without --server-side")
+
+    # Connect to ClickHouse (see connection.py).
+    client = connect(args)
     
-    # Drop table if it exists.
+    # Keep the table if it already holds the dataset, shifting it again if it
+    # drifted (see fingerprints.py).
+    fingerprint = dataset_fingerprint(path, args)
+    kept = reuse_table(client, args, "apache_logs", fingerprint, "load_apache")
+    if kept is not None:
+        metrics.finish(kept)
+        return kept
+    forget_fingerprint(client, "apache_logs")
+
+    # Drop the table and its rollup if they exist, and the raw table of --virtual-shift.
+    drop_rollup(client, "apache_logs")
     client.execute("DROP TABLE IF EXISTS apache_logs")
+    drop_raw_table(client, "apache_logs")
     
-    # Create the table.
-    # We're using a MergeTree engine and ordering by the timestamp.
-    client.execute("""
-        CREATE TABLE apache_logs (
-            timestamp DateTime,
-            severity String,
-            client Nullable(String),
-            function Nullable(String),
-            path Nullable(String),
-            msg String,
-            logline String
-        ) ENGINE = MergeTree()
-        ORDER BY timestamp
-    """)
-
-    # Load data from the gzip JSONL file.
-    # Also, find the maximum timestamp in the file.
-    rows = []
-    max_dt = None
-
-    with gzip.open("apache.jsonl.gz", "rt", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            record = json.loads(line)
-            # Parse the timestamp assuming ISO-8601 format, e.g., "2005-11-28T18:36:18"
-            dt = datetime.datetime.strptime(record["timestamp"], "%Y-%m-%dT%H:%M:%S")
-            # Update the max timestamp.
-            if (max_dt is None) or (dt > max_dt):
-                max_dt = dt
-            rows.append(record)
-
-    if max_dt is None:
+    # Create the table in the selected schema profile (see schemas.py). With
+    # --virtual-shift, the records go to a raw table as they are, and apache_logs
+    # becomes a view shifting them once they're loaded (see virtual_shift.py).
+    table = raw_table("apache_logs") if args.virtual_shift else "apache_logs"
+    client.execute(create_table_sql(table, COLUMNS, OPTIMIZED_COLUMNS, args.schema))
+    create_rollup(client, table, ROLLUP_KEYS)
+
+    if args.server_side or input_format == "parquet":
+        # Let ClickHouse decompress, parse and shift the data (see server_shift.py).
+        # Parquet files are always loaded this way, so they are never decoded in Python.
+        total, shift_us = load_server_side(client, path, table, DATASET_COLUMNS,
+                                           lambda staging, shift: server_side_insert(
+                                               staging, None if args.virtual_shift else shift, table),
+                                           input_format=CLICKHOUSE_FORMATS[input_format],
+                                           endpoint=HttpEndpoint.from_args(args), metrics=metrics)
+        # Remember the loaded file and the shift for later appends and restarts
+        # (see append.py and fingerprints.py).
+        record_dataset(client, args, "apache_logs", "load_apache", path, fingerprint, total, shift_us)
+        print(f"Inserted {total} rows into ClickHouse.")
+        metrics.finish(total)
+        return total
+
+    # Find the maximum timestamp in the file (from the metadata sidecar if possible).
+    with metrics.stage("max_timestamp"):
+        max_ts = dataset_max_timestamp(path)
+    if max_ts is None:
         print("No records found in the file!")
-        return
-
-    # Compute the time difference (shift) needed so that the maximum timestamp becomes 'now'
-    now = datetime.datetime.now()
-    shift = now - max_dt
-
-    # Prepare the data to be inserted.
-    # For each record, parse its timestamp and add the computed shift.
-    data_to_insert = []
-    for record in rows:
-        orig_dt = datetime.datetime.strptime(record["timestamp"], "%Y-%m-%dT%H:%M:%S")
-        new_dt = orig_dt + shift
-        
-        # Update the date in the logline field
-        logline = record["logline"]
-        # Extract the date portion with regex
-        date_pattern = r'\[(Mon|Tue|Wed|Thu|Fri|Sat|Sun) (Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) \d{1,2} \d{2}:\d{2}:\d{2} \d{4}\]'
-        date_match = re.search(date_pattern, logline)
-        if date_match:
-            date_str = date_match.group(0)  # Including the square brackets
-            # Remove brackets for parsing
-            date_inner = date_str[1:-1]
-            # Parse the date
-            orig_logline_date = datetime.datetime.strptime(date_inner, "%a %b %d %H:%M:%S %Y")
-            
-            # Apply the time shift
-            new_logline_date = orig_logline_date + shift
-            
-            # Format back to the original format with brackets
-            new_date_str = f"[{new_logline_date.strftime('%a %b %d %H:%M:%S %Y')}]"
-            
-            # Replace in the logline
-            updated_logline = logline.replace(date_str, new_date_str)
-        else:
-            updated_logline = logline
-        
-        # Build a tuple with the values in the same order as the table columns.
-        data_tuple = (
-            new_dt,
-            record["severity"],
-            record.get("client"),    # client can be null
-            record.get("function"),  # function can be null
-            record.get("path"),      # path can be null
-            record["msg"],
-            updated_logline
-        )
-        data_to_insert.append(data_tuple)
-
-    # Insert the adjusted data into the ClickHouse table.
-    client.execute(
-        "INSERT INTO apache_logs (timestamp, severity, client, function, path, msg, logline) VALUES", 
-        data_to_insert
-    )
-    print(f"Inserted {len(data_to_insert)} rows into ClickHouse.")
+        metrics.finish(0)
+        return 0
+
+    # Compute the time difference (shift) needed so that the maximum timestamp becomes 'now',
+    # and the one applied to the records, none with --virtual-shift.
+    shifter, record_shifter = load_shifters(args, max_ts, SECONDS)
+    # Only the rows of the time window of a partial load (see windows.py).
+    window = Window.from_args(args, max_ts, shifter.timedelta)
+
+    # Stream the shifted columns into the ClickHouse table batch by batch.
+    total = insert_dataset(client, args, "load_apache", path,
+                           f"INSERT INTO {table} ({', '.join(TABLE_COLUMNS)}) VALUES",
+                           record_shifter, metrics, window)
+    # Remember the loaded file and the shift for later appends and restarts
+    # (see append.py and fingerprints.py).
+    record_dataset(client, args, "apache_logs", "load_apache", path, fingerprint, total, shifter.microseconds,
+                   shifted_end_us(max_ts, shifter.microseconds))
+    print(f"Inserted {total} rows into ClickHouse.")
+    metrics.finish(total)
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the Apache dataset into ClickHouse.")
+    add_common_args(parser)
+    load(parser.parse_args())
 
 if __name__ == "__main__":
     main()
@@ -1,114 +1,264 @@
 #!/usr/bin/env python3
 """
 This script:
-  • Connects to ClickHouse on clickhouse:9000.
-  • Drops any existing table named "hadoop_logs" and then creates a new one.
-  • Loads Hadoop log records from a gzip-compressed JSONL file.
-  • Scans the file to determine the maximum timestamp.
+  • Connects to ClickHouse (clickhouse:9000 unless configured, see connection.py).
+  • Keeps the existing "hadoop_logs" table if it already holds the same dataset
+    loaded the same way, only shifting it again in ClickHouse once its timestamps
+    drifted (see fingerprints.py).
+  • Otherwise, drops any existing table named "hadoop_logs" and then creates a new one.
+  • Reads the maximum timestamp from the dataset's metadata sidecar, or scans the
+    gzip-compressed JSONL file once if the sidecar is missing or stale.
   • Computes the delta so that shifting the max timestamp gives the current time.
+  • Streams the Hadoop log records from the file as compact typed records (see
+    records.py), numbering them in file order
+    (seq), as the table is ordered by (timestamp, seq).
   • Adjusts each record's timestamp by that delta.
   • Also adjusts the date in the logline field to match the shifted timestamp.
-  • Inserts all the adjusted records into the ClickHouse table.
+  • Inserts the adjusted records into the ClickHouse table in fixed-size batches,
+    from --workers processes if the file is made of gzip frames (see frames.py).
+  • With --since, --until and --sample, only loads the rows of a time window,
+    reading only the frames of the file that overlap it (see windows.py).
+  • With --virtual-shift, inserts the records as they are into "hadoop_logs_raw"
+    instead, and creates "hadoop_logs" as a view shifting the timestamps and the
+    dates in the logline at query time (see virtual_shift.py).
+  • Reports the time spent in every stage, rows/s, bytes, peak RSS and the date
+    cache hit rates, optionally as a JSON report, a Prometheus textfile and a
+    cProfile dump of the slowest stage (see instrumentation.py).
 """
 
-import json
-import gzip
+import argparse
 import datetime
-import re
-from clickhouse_driver import Client
+import numpy as np
 
-def main():
-    # Connect to ClickHouse on clickhouse:9000.
-    client = Client(host='clickhouse', port=9000)
+from common import add_common_args, insert_dataset
+from connection import HttpEndpoint, connect
+from formats import CLICKHOUSE_FORMATS, format_of
+from fingerprints import dataset_fingerprint, forget_fingerprint, record_dataset, reuse_table, shifted_end_us
+from instrumentation import NO_METRICS, Metrics
+from metadata import dataset_max_timestamp
+from records import HadoopRecord
+from rollups import create_rollup, drop_rollup
+from schemas import create_table_sql
+from server_shift import FILE_ORDER_SEQ, load_server_side, sql_string
+from timeshift import MICROSECONDS, DateRewriter, UnshiftedDates
+from virtual_shift import drop_raw_table, load_shifters, raw_table
+from windows import Window, window_requested
+
+DATASET = "hadoop.jsonl.gz"
+
+# Records of the dataset (see records.py)
+RECORD_TYPE = HadoopRecord
+
+# Columns of the converted dataset (also used for the staging table of --server-side loads)
+DATASET_COLUMNS = """
+    timestamp DateTime64(6),
+    severity String,
+    thread String,
+    source String,
+    msg String,
+    logline String
+"""
+
+# Columns of the hadoop_logs table: the dataset's and seq, the position of the record
+# in its file, which keeps the order of lines within the same timestamp
+COLUMNS = DATASET_COLUMNS.rstrip() + """,
+    seq UInt64
+"""
+
+# Names of the columns of the hadoop_logs table, in order
+TABLE_COLUMNS = ["timestamp", "severity", "thread", "source", "msg", "logline", "seq"]
+
+# Columns of the hadoop_logs table in the optimized schema profile (see schemas.py)
+OPTIMIZED_COLUMNS = """
+    timestamp DateTime64(6) CODEC(Delta, ZSTD(1)),
+    severity LowCardinality(String),
+    thread LowCardinality(String),
+    source LowCardinality(String),
+    msg String CODEC(ZSTD(1)),
+    logline String CODEC(ZSTD(1)),
+    seq UInt64 CODEC(Delta, ZSTD(1)),
+    PROJECTION by_source (SELECT * ORDER BY source, timestamp, seq)
+"""
+
+# Columns of the per-minute rollup of the table (see rollups.py)
+ROLLUP_KEYS = ["severity", "source"]
+
+# dateDiff unit of the shifts of the table in ClickHouse (see server_shift.py)
+SHIFT_UNIT = "microsecond"
+
+# NumPy dtypes of the columns, used with --numpy
+COLUMN_DTYPES = [np.int64, object, object, object, object, object, np.uint64]
+
+# The date in the logline, e.g., "2015-10-17 21:48:16,337"
+LOGLINE_DATE_PATTERN = r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3})'
+
+def logline_rewriter(shift):
+    """
+    Returns a DateRewriter that shifts the date in Hadoop loglines by shift.
+    """
+    if not shift:
+        return UnshiftedDates()
+
+    def shift_date(date_str, year):
+        # Parse the date
+        orig_logline_date = datetime.datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S,%f")
+
+        # Apply the time shift
+        new_logline_date = orig_logline_date + shift
+
+        # Format back to the original format
+        return new_logline_date.strftime("%Y-%m-%d %H:%M:%S,%f")[:-3]  # Only keep 3 digits of microseconds
+
+    return DateRewriter(LOGLINE_DATE_PATTERN, shift_date)
+
+def to_columns(records, shifter, rewriter):
+    """
+    Builds the columns (in the same order as the table columns) for a batch of records.
+    The timestamps of the whole batch are parsed and shifted at once.
+    """
+    return [
+        shifter.shift_column([record.timestamp for record in records]),
+        [record.severity for record in records],
+        [record.thread for record in records],
+        [record.source for record in records],
+        [record.msg for record in records],
+        [rewriter.replace_first(record.logline) for record in records],
+        [record.seq for record in records],
+    ]
+
+def columns_builder(shifter, args, metrics=NO_METRICS):
+    """
+    Returns the function building the columns of a batch of records for a load
+    shifted by shifter, reporting its date caches to metrics.
+    """
+    rewriter = logline_rewriter(shifter.timedelta)
+    metrics.add_rewriter("logline_date", rewriter)
+    return lambda records: to_columns(records, shifter, rewriter)
+
+def server_side_columns(shift, seq=FILE_ORDER_SEQ):
+    """
+    Returns the SQL expressions of the TABLE_COLUMNS of a row of a staging table,
+    shifting the timestamp and the date in the logline by shift microseconds, or
+    keeping them as they are if shift is None. seq is the expression of the seq column.
+    """
+    if shift is None:
+        return ["timestamp", "severity", "thread", "source", "msg", "logline", seq]
+    # Only keep 3 digits of microseconds in the logline, e.g., "2015-10-17 21:48:16,337"
+    new_logline_date = f"toDateTime64(replaceOne(d, ',', '.'), 6) + toIntervalMicrosecond({shift})"
+    new_date_str = f"replaceOne(substring(toString({new_logline_date}), 1, 23), '.', ',')"
+    return [
+        f"timestamp + toIntervalMicrosecond({shift})",
+        "severity",
+        "thread",
+        "source",
+        "msg",
+        f"""if((extract(logline, {sql_string(LOGLINE_DATE_PATTERN)}) AS d) = '',
+               logline,
+               replaceAll(logline, d, {new_date_str}))""",
+        seq,
+    ]
+
+def server_side_insert(staging, shift, table="hadoop_logs"):
+    """
+    Builds the INSERT ... SELECT copying the staging table into table (hadoop_logs
+    or its raw table), shifting the rows by shift microseconds (see server_side_columns).
+    """
+    return f"""
+        INSERT INTO {table} ({", ".join(TABLE_COLUMNS)})
+        -- The staging table is read in file order (see server_shift.py)
+        SELECT {", ".join(server_side_columns(shift))}
+        FROM {staging}
+    """
+
+def shifted_columns(shift):
+    """
+    Returns the SQL expressions of the TABLE_COLUMNS of a row of hadoop_logs (or of
+    its raw table) shifted by shift microseconds, for shifting the table again (see
+    fingerprints.py) or in a view (see virtual_shift.py).
+    """
+    return server_side_columns(shift, seq="seq")
+
+def load(args):
+    """
+    Loads the dataset into ClickHouse and returns the number of inserted rows.
+    """
+    path = args.input or DATASET
+    input_format = format_of(path)
+    metrics = Metrics("load_hadoop", args)
+    if window_requested(args) and (args.server_side or input_format == "parquet"):
+        raise ValueError("--since, --until and --sample need a JSONL dataset loaded without --server-side")
+
+    # Connect to ClickHouse (see connection.py).
+    client = connect(args)
     
-    # Drop table if it exists.
+    # Keep the table if it already holds the dataset, shifting it again if it
+    # drifted (see fingerprints.py).
+    fingerprint = dataset_fingerprint(path, args)
+    kept = reuse_table(client, args, "hadoop_logs", fingerprint, "load_hadoop")
+    if kept is not None:
+        metrics.finish(kept)
+        return kept
+    forget_fingerprint(client, "hadoop_logs")
+
+    # Drop the table and its rollup if they exist, and the raw table of --virtual-shift.
+    drop_rollup(client, "hadoop_logs")
     client.execute("DROP TABLE IF EXISTS hadoop_logs")
+    drop_raw_table(client, "hadoop_logs")
     
-    # Create the table.
-    # We're using a MergeTree engine and ordering by the timestamp.
-    client.execute("""
-        CREATE TABLE hadoop_logs (
-            timestamp DateTime64(6),
-            severity String,
-            thread String,
-            source String,
-            msg String,
-            logline String
-        ) ENGINE = MergeTree()
-        ORDER BY timestamp
-    """)
-
-    # Load data from the gzip JSONL file.
-    # Also, find the maximum timestamp in the file.
-    rows = []
-    max_dt = None
-
-    with gzip.open("hadoop.jsonl.gz", "rt", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            record = json.loads(line)
-            # Parse the timestamp with microseconds, e.g., "2015-10-17T21:48:16.337000"
-            dt = datetime.datetime.strptime(record["timestamp"], "%Y-%m-%dT%H:%M:%S.%f")
-            # Update the max timestamp.
-            if (max_dt is None) or (dt > max_dt):
-                max_dt = dt
-            rows.append(record)
-
-    if max_dt is None:
+    # Create the table in the selected schema profile (see schemas.py). With
+    # --virtual-shift, the records go to a raw table as they are, and hadoop_logs
+    # becomes a view shifting them once they're loaded (see virtual_shift.py).
+    table = raw_table("hadoop_logs") if args.virtual_shift else "hadoop_logs"
+    client.execute(create_table_sql(table, COLUMNS, OPTIMIZED_COLUMNS, args.schema))
+    create_rollup(client, table, ROLLUP_KEYS)
+
+    if args.server_side or input_format == "parquet":
+        # Let ClickHouse decompress, parse and shift the data (see server_shift.py).
+        # Parquet files are always loaded this way, so they are never decoded in Python.
+        total, shift_us = load_server_side(client, path, table, DATASET_COLUMNS,
+                                           lambda staging, shift: server_side_insert(
+                                               staging, None if args.virtual_shift else shift, table),
+                                           SHIFT_UNIT,
+                                           input_format=CLICKHOUSE_FORMATS[input_format],
+                                           endpoint=HttpEndpoint.from_args(args), metrics=metrics)
+        # Remember the loaded file and the shift for later appends and restarts
+        # (see append.py and fingerprints.py).
+        record_dataset(client, args, "hadoop_logs", "load_hadoop", path, fingerprint, total, shift_us)
+        print(f"Inserted {total} rows into ClickHouse.")
+        metrics.finish(total)
+        return total
+
+    # Find the maximum timestamp in the file (from the metadata sidecar if possible).
+    with metrics.stage("max_timestamp"):
+        max_ts = dataset_max_timestamp(path)
+    if max_ts is None:
         print("No records found in the file!")
-        return
-
-    # Compute the time difference (shift) needed so that the maximum timestamp becomes 'now'
-    now = datetime.datetime.now()
-    shift = now - max_dt
-
-    # Prepare the data to be inserted.
-    # For each record, parse its timestamp and add the computed shift.
-    data_to_insert = []
-    for record in rows:
-        orig_dt = datetime.datetime.strptime(record["timestamp"], "%Y-%m-%dT%H:%M:%S.%f")
-        new_dt = orig_dt + shift
-        
-        # Update the date in the logline field
-        logline = record["logline"]
-        # Extract the date portion with regex
-        date_pattern = r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3})'
-        date_match = re.search(date_pattern, logline)
-        if date_match:
-            orig_date_str = date_match.group(0)
-            # Parse the date
-            orig_logline_date = datetime.datetime.strptime(orig_date_str, "%Y-%m-%d %H:%M:%S,%f")
-            
-            # Apply the time shift
-            new_logline_date = orig_logline_date + shift
-            
-            # Format back to the original format
-            new_date_str = new_logline_date.strftime("%Y-%m-%d %H:%M:%S,%f")[:-3]  # Only keep 3 digits of microseconds
-            
-            # Replace in the logline
-            updated_logline = logline.replace(orig_date_str, new_date_str)
-        else:
-            updated_logline = logline
-        
-        # Build a tuple with the values in the same order as the table columns.
-        data_tuple = (
-            new_dt,
-            record["severity"],
-            record["thread"],
-            record["source"],
-            record["msg"],
-            updated_logline
-        )
-        data_to_insert.append(data_tuple)
-
-    # Insert the adjusted data into the ClickHouse table.
-    client.execute(
-        "INSERT INTO hadoop_logs (timestamp, severity, thread, source, msg, logline) VALUES", 
-        data_to_insert
-    )
-    print(f"Inserted {len(data_to_insert)} rows into ClickHouse.")
+        metrics.finish(0)
+        return 0
+
+    # Compute the time difference (shift) needed so that the maximum timestamp becomes 'now'.
+    # Timestamps have microseconds, e.g., "2015-10-17T21:48:16.337000", to match DateTime64(6).
+    # With --virtual-shift, the records aren't shifted, the views are.
+    shifter, record_shifter = load_shifters(args, max_ts, MICROSECONDS)
+    # Only the rows of the time window of a partial load (see windows.py).
+    window = Window.from_args(args, max_ts, shifter.timedelta)
+
+    # Stream the shifted columns into the ClickHouse table batch by batch.
+    total = insert_dataset(client, args, "load_hadoop", path,
+                           f"INSERT INTO {table} ({', '.join(TABLE_COLUMNS)}) VALUES",
+                           record_shifter, metrics, window)
+    # Remember the loaded file and the shift for later appends and restarts
+    # (see append.py and fingerprints.py).
+    record_dataset(client, args, "hadoop_logs", "load_hadoop", path, fingerprint, total, shifter.microseconds,
+                   shifted_end_us(max_ts, shifter.microseconds))
+    print(f"Inserted {total} rows into ClickHouse.")
+    metrics.finish(total)
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the Hadoop dataset into ClickHouse.")
+    add_common_args(parser)
+    load(parser.parse_args())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,49 +1,73 @@
 #!/usr/bin/env python3
 """
 This script:
-  • Connects to ClickHouse on clickhouse:9000
-  • Drops any existing table named "ip_data" and creates a new one
-  • Loads IP geolocation data from a gzip-compressed JSONL file
-  • Inserts all records into the ClickHouse table
+  • Connects to ClickHouse (clickhouse:9000 unless configured, see connection.py)
+  • Keeps the existing "ip_data" table and "ip_dict" dictionary if the table
+    already holds the same dataset (see fingerprints.py)
+  • Otherwise, drops any existing table named "ip_data" and creates a new one
+  • Streams IP geolocation data from a gzip-compressed JSONL file
+  • Inserts the records into the ClickHouse table in fixed-size columnar batches
+  • Stores every address as typed IPv4/IPv6 columns too (ip_v4 and ip_v6),
+    computed by ClickHouse from the ip string
+  • Creates the in-memory dictionary "ip_dict" over the table, keyed by ip_v6
+    (IPv4 addresses are mapped to ::ffff:a.b.c.d), so that enriching any number
+    of IPs is a dictGet in a single query instead of one query per IP:
+      SELECT dictGet('ip_dict', 'country_short', tuple(toIPv6OrDefault(ip)))
+  • Reports the time spent in every stage, rows/s, bytes and peak RSS, optionally
+    as a JSON report, a Prometheus textfile and a cProfile dump of the slowest
+    stage (see instrumentation.py)
 """
 
+import argparse
+import itertools
 import json
 import gzip
-from clickhouse_driver import Client
 import datetime
+import os
 
-def main():
-    # Connect to ClickHouse on clickhouse:9000
-    client = Client(host='clickhouse', port=9000)
+from common import add_common_args, insert_columnar_batches
+from connection import connect
+from fingerprints import dataset_fingerprint, forget_fingerprint, reuse_table, save_fingerprint
+from instrumentation import Metrics
 
-    # Drop table if it exists
-    client.execute("DROP TABLE IF EXISTS ip_data")
+DATASET = "ips.jsonl.gz"
 
-    # Create the table with all string fields as Nullable(String)
-    client.execute("""
-        CREATE TABLE ip_data (
-            allocated_at Nullable(DateTime),
-            asn Nullable(String),
-            asn_country Nullable(String),
-            city Nullable(String),
-            country_long Nullable(String),
-            country_short Nullable(String),
-            hostname Nullable(String),
-            ip String,
-            isp Nullable(String),
-            latitude Nullable(Float64),
-            longitude Nullable(Float64),
-            region Nullable(String),
-            registry Nullable(String),
-            timezone Nullable(String),
-            zipcode Nullable(String)
-        ) ENGINE = MergeTree()
-        ORDER BY ip
-    """)
+DICTIONARY = "ip_dict"
 
-    # Load data from the gzip JSONL file
-    rows = []
-    with gzip.open("ips.jsonl.gz", "rt", encoding="utf-8") as f:
+# Attributes of the dictionary, looked up by the ip_v6 key
+DICTIONARY_ATTRIBUTES = """
+    allocated_at Nullable(DateTime),
+    asn Nullable(String),
+    asn_country Nullable(String),
+    city Nullable(String),
+    country_long Nullable(String),
+    country_short Nullable(String),
+    hostname Nullable(String),
+    ip String,
+    isp Nullable(String),
+    latitude Nullable(Float64),
+    longitude Nullable(Float64),
+    region Nullable(String),
+    registry Nullable(String),
+    timezone Nullable(String),
+    zipcode Nullable(String)
+"""
+
+# NumPy dtypes of the columns, used with --numpy.
+# A NULL allocated_at is sent as NaT. clickhouse_driver only treats None as NULL
+# in Float64 columns (NaN is a regular value there), so latitude and longitude
+# are object arrays which the driver converts to float64 in one go.
+COLUMN_DTYPES = [
+    "datetime64[s]", object, object, object, object, object, object, object,
+    object, object, object, object, object, object, object
+]
+
+def iter_rows(path):
+    """
+    Yields one row tuple per valid record of the file, skipping (and reporting)
+    the lines that cannot be parsed.
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
         for line_number, line in enumerate(f, 1):
             line = line.strip()
             if not line:
@@ -72,7 +96,7 @@ def main():
                     lon = None
 
                 # Build a tuple with the values in the same order as the table columns
-                data_tuple = (
+                yield (
                     dt,
                     record.get("asn"),
                     record.get("asn_country"),
@@ -89,21 +113,106 @@ def main():
                     record.get("timezone"),
                     record.get("zipcode")
                 )
-                rows.append(data_tuple)
             except json.JSONDecodeError:
                 print(f"Warning: Invalid JSON on line {line_number}")
             except Exception as e:
                 print(f"Error processing line {line_number}: {str(e)}")
 
-    # Insert all data in a single operation
-    client.execute(
+def create_dictionary(client):
+    """
+    Creates the ip_dict dictionary over ip_data and loads it into memory.
+    The addresses are exact (no ranges), so a hashed layout fits better than
+    ip_trie. Rows whose ip isn't a valid address are left out, and LIFETIME(0)
+    means the dictionary is only reloaded when the loader recreates it.
+    """
+    client.execute(f"""
+        CREATE DICTIONARY {DICTIONARY} (
+            ip_v6 IPv6,
+            {DICTIONARY_ATTRIBUTES}
+        )
+        PRIMARY KEY ip_v6
+        SOURCE(CLICKHOUSE(TABLE 'ip_data' WHERE 'isIPv4String(ip) OR isIPv6String(ip)'))
+        LAYOUT(COMPLEX_KEY_HASHED())
+        LIFETIME(0)
+    """)
+    client.execute(f"SYSTEM RELOAD DICTIONARY {DICTIONARY}")
+
+def load(args):
+    """
+    Loads the dataset into ClickHouse and returns the number of inserted rows.
+    """
+    path = args.input or DATASET
+    metrics = Metrics("load_ips", args)
+
+    # Connect to ClickHouse (see connection.py).
+    client = connect(args)
+
+    # Keep the table and the dictionary if the table already holds the dataset (see fingerprints.py).
+    fingerprint = dataset_fingerprint(path)
+    kept = reuse_table(client, args, "ip_data", fingerprint)
+    if kept is not None and client.execute(f"EXISTS DICTIONARY {DICTIONARY}")[0][0]:
+        metrics.finish(kept)
+        return kept
+    forget_fingerprint(client, "ip_data")
+
+    # Drop the dictionary and the table if they exist (the dictionary depends on the table)
+    client.execute(f"DROP DICTIONARY IF EXISTS {DICTIONARY}")
+    client.execute("DROP TABLE IF EXISTS ip_data")
+
+    # Create the table with all string fields as Nullable(String).
+    # ip_v4 is NULL for IPv6 addresses, ip_v6 holds both (IPv4-mapped) and is :: for invalid ones.
+    client.execute("""
+        CREATE TABLE ip_data (
+            allocated_at Nullable(DateTime),
+            asn Nullable(String),
+            asn_country Nullable(String),
+            city Nullable(String),
+            country_long Nullable(String),
+            country_short Nullable(String),
+            hostname Nullable(String),
+            ip String,
+            isp Nullable(String),
+            latitude Nullable(Float64),
+            longitude Nullable(Float64),
+            region Nullable(String),
+            registry Nullable(String),
+            timezone Nullable(String),
+            zipcode Nullable(String),
+            ip_v4 Nullable(IPv4) MATERIALIZED toIPv4OrNull(ip),
+            ip_v6 IPv6 MATERIALIZED toIPv6OrDefault(ip)
+        ) ENGINE = MergeTree()
+        ORDER BY ip
+    """)
+
+    # Stream the data into the table batch by batch, transposing the rows into columns.
+    # Decompressing, decoding and converting the records are timed together as "decode".
+    metrics.add_bytes("in", os.path.getsize(path))
+    rows = itertools.chain.from_iterable(metrics.blocks("decode", iter_rows(path)))
+    total = insert_columnar_batches(
+        client,
         """INSERT INTO ip_data (
             allocated_at, asn, asn_country, city, country_long, country_short, 
             hostname, ip, isp, latitude, longitude, region, registry, timezone, zipcode
         ) VALUES""",
-        rows
+        rows,
+        lambda rows: list(zip(*rows)),
+        args.batch_size,
+        COLUMN_DTYPES if args.numpy else None,
+        metrics=metrics
     )
-    print(f"Inserted {len(rows)} rows into ClickHouse.")
+    print(f"Inserted {total} rows into ClickHouse.")
+
+    with metrics.stage("create_dictionary"):
+        create_dictionary(client)
+    print(f"Created the {DICTIONARY} dictionary.")
+    save_fingerprint(client, "ip_data", fingerprint, total)
+    metrics.finish(total)
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the IP geolocation dataset into ClickHouse.")
+    add_common_args(parser, log_table=False)
+    load(parser.parse_args())
 
 if __name__ == "__main__":
     main()
@@ -1,42 +1,116 @@
 #!/usr/bin/env python3
 """
 This script:
-  • Connects to ClickHouse on clickhouse:9000.
-  • Drops any existing table named "linux_logs" and then creates a new one.
-  • Loads Linux log records from a gzip-compressed JSONL file.
-  • Scans the file to determine the maximum timestamp.
+  • Connects to ClickHouse (clickhouse:9000 unless configured, see connection.py).
+  • Keeps the existing "linux_logs" table if it already holds the same dataset
+    loaded the same way, only shifting it again in ClickHouse once its timestamps
+    drifted (see fingerprints.py).
+  • Otherwise, drops any existing table named "linux_logs" and then creates a new one.
+  • Reads the maximum timestamp from the dataset's metadata sidecar, or scans the
+    gzip-compressed JSONL file once if the sidecar is missing or stale.
   • Computes the delta so that shifting the max timestamp gives the current time.
+  • Streams the Linux log records from the file as compact typed records (see
+    records.py), numbering them in file order
+    (seq), as the table is ordered by (timestamp, seq).
   • Adjusts each record's timestamp by that delta.
   • Also adjusts the date in the logline and msg fields to match the shifted timestamp.
-  • Inserts all the adjusted records into the ClickHouse table.
+  • Inserts the adjusted records into the ClickHouse table in fixed-size batches,
+    from --workers processes if the file is made of gzip frames (see frames.py).
+  • With --since, --until and --sample, only loads the rows of a time window,
+    reading only the frames of the file that overlap it (see windows.py).
+  • With --virtual-shift, inserts the records as they are into "linux_logs_raw"
+    instead, and creates "linux_logs" as a view shifting the timestamps and the
+    dates in msg and logline at query time (see virtual_shift.py).
+  • Reports the time spent in every stage, rows/s, bytes, peak RSS and the date
+    cache hit rates, optionally as a JSON report, a Prometheus textfile and a
+    cProfile dump of the slowest stage (see instrumentation.py).
 """
 
-# FIXME: there can be multiple log lines in a single second - currently we lose
-# the order of loglines within that one second!
-
-import json
-import gzip
+import argparse
 import datetime
 import re
-from clickhouse_driver import Client
+import numpy as np
+
+from common import add_common_args, insert_dataset
+from connection import HttpEndpoint, connect
+from formats import CLICKHOUSE_FORMATS, format_of
+from fingerprints import dataset_fingerprint, forget_fingerprint, record_dataset, reuse_table, shifted_end_us
+from instrumentation import NO_METRICS, Metrics
+from metadata import dataset_max_timestamp
+from records import LinuxRecord
+from rollups import create_rollup, drop_rollup
+from schemas import create_table_sql
+from server_shift import FILE_ORDER_SEQ, load_server_side, make_datetime_sql, padded_day_sql, sql_string
+from timeshift import SECONDS, DateRewriter, UnshiftedDates
+from virtual_shift import drop_raw_table, load_shifters, raw_table
+from windows import Window, window_requested
+
+DATASET = "linux.jsonl.gz"
+
+# Records of the dataset (see records.py)
+RECORD_TYPE = LinuxRecord
+
+# Columns of the converted dataset (also used for the staging table of --server-side loads)
+DATASET_COLUMNS = """
+    timestamp DateTime,
+    source String,
+    pid Nullable(Int32),
+    msg String,
+    logline String
+"""
+
+# Columns of the linux_logs table: the dataset's and seq, the position of the record
+# in its file, which keeps the order of lines within the same timestamp
+COLUMNS = DATASET_COLUMNS.rstrip() + """,
+    seq UInt64
+"""
+
+# Names of the columns of the linux_logs table, in order
+TABLE_COLUMNS = ["timestamp", "source", "pid", "msg", "logline", "seq"]
+
+# Columns of the linux_logs table in the optimized schema profile (see schemas.py)
+OPTIMIZED_COLUMNS = """
+    timestamp DateTime CODEC(Delta, ZSTD(1)),
+    source LowCardinality(String),
+    pid Nullable(Int32),
+    msg String CODEC(ZSTD(1)),
+    logline String CODEC(ZSTD(1)),
+    seq UInt64 CODEC(Delta, ZSTD(1)),
+    PROJECTION by_source (SELECT * ORDER BY source, timestamp, seq)
+"""
+
+# Columns of the per-minute rollup of the table (see rollups.py)
+ROLLUP_KEYS = ["source"]
+
+# dateDiff unit of the shifts of the table in ClickHouse (see server_shift.py)
+SHIFT_UNIT = "second"
+
+# NumPy dtypes of the columns, used with --numpy.
+# pid is nullable, so it's sent as floats with NaN standing for NULL.
+COLUMN_DTYPES = [np.int64, object, np.float64, object, object, np.uint64]
+
+# A Unix log timestamp (MMM DD HH:MM:SS) with the whitespace that follows it
+UNIX_LOG_DATE_PATTERN = r'(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)(\s+)(\d{1,2})\s+(\d{2}:\d{2}:\d{2})\s+'
+
+# Embedded dates like "Sun Feb 12 19:42:12 2006"
+EMBEDDED_DATE_PATTERN = r'(Mon|Tue|Wed|Thu|Fri|Sat|Sun) (Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)(\s+)(\d{1,2}) (\d{2}:\d{2}:\d{2}) (\d{4})'
+
+# Month mapping
+MONTH_NAMES = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
 
-def shift_dates_in_text(text, time_shift, orig_year):
+def date_rewriters(time_shift):
     """
-    Shifts all dates in the given text by the specified time_shift.
-    Handles both Unix log format dates and embedded full dates.
+    Returns the (unix_log, embedded) pair of DateRewriters shifting dates by time_shift.
     """
-    result = text
-    
-    # First, check if the text begins with a Unix log timestamp (MMM DD HH:MM:SS)
-    unix_log_pattern = r'^(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)(\s+)(\d{1,2})\s+(\d{2}:\d{2}:\d{2})\s+(.+)$'
-    match = re.match(unix_log_pattern, result)
-    
-    if match:
-        month_name, spaces, day_num, time_str, rest = match.groups()
-        
-        # Month mapping
-        month_names = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
-        month_num = month_names.index(month_name) + 1
+    if not time_shift:
+        return UnshiftedDates(), UnshiftedDates()
+    unix_log_pattern = re.compile(UNIX_LOG_DATE_PATTERN)
+    embedded_date_pattern = re.compile(EMBEDDED_DATE_PATTERN)
+
+    def shift_unix_log_date(date_str, orig_year):
+        month_name, spaces, day_num, time_str = unix_log_pattern.match(date_str).groups()
+
+        month_num = MONTH_NAMES.index(month_name) + 1
         
         # Convert day to integer
         day = int(day_num)
@@ -62,25 +136,18 @@ def shift_dates_in_text(text, time_shift, orig_year):
         
         new_time_str = new_logline_dt.strftime("%H:%M:%S")
         
-        # Reconstruct the logline
-        result = f"{new_month_name}{new_day_spaces}{new_day} {new_time_str} {rest}"
-    
-    # Pattern for embedded dates like "Sun Feb 12 19:42:12 2006"
-    embedded_date_pattern = r'(Mon|Tue|Wed|Thu|Fri|Sat|Sun) (Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)(\s+)(\d{1,2}) (\d{2}:\d{2}:\d{2}) (\d{4})'
-    
-    # Find all embedded dates and update them
-    for match in re.finditer(embedded_date_pattern, result):
-        embedded_date_str = match.group(0)
-        weekday = match.group(1)
+        # Reconstruct the beginning of the logline
+        return f"{new_month_name}{new_day_spaces}{new_day} {new_time_str} "
+
+    def shift_embedded_date(date_str, orig_year):
+        match = embedded_date_pattern.match(date_str)
         month = match.group(2)
-        spaces = match.group(3)
         day = int(match.group(4))
         time_str = match.group(5)
         year = int(match.group(6))
         
         # Create datetime for embedded date
-        month_names = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
-        month_num = month_names.index(month) + 1
+        month_num = MONTH_NAMES.index(month) + 1
         
         # Parse the time
         hour, minute, second = map(int, time_str.split(':'))
@@ -105,88 +172,198 @@ def shift_dates_in_text(text, time_shift, orig_year):
             new_day_spaces = " "   # One space for double digit
         
         # Create new embedded date string
-        new_embedded_date_str = f"{new_weekday} {new_month}{new_day_spaces}{new_day} {new_time} {new_year}"
+        return f"{new_weekday} {new_month}{new_day_spaces}{new_day} {new_time} {new_year}"
 
-        # Replace in the text
-        result = result.replace(embedded_date_str, new_embedded_date_str)
-    
-    return result
+    return (
+        # Only rewrite the timestamp at the beginning of the text, when it is followed by something
+        DateRewriter(UNIX_LOG_DATE_PATTERN + r'(?=.)', shift_unix_log_date),
+        DateRewriter(EMBEDDED_DATE_PATTERN, shift_embedded_date),
+    )
 
-def main():
-    # Connect to ClickHouse on clickhouse:9000.
-    client = Client(host='clickhouse', port=9000)
+def shift_dates_in_text(text, rewriters, orig_year):
+    """
+    Shifts all dates in the given text using the DateRewriters from date_rewriters().
+    Handles both Unix log format dates and embedded full dates.
+    """
+    unix_log, embedded = rewriters
+
+    # First, shift the Unix log timestamp the text may begin with, using the passed year
+    result = unix_log.replace_prefix(text, orig_year)
+
+    # Then find all embedded dates (which carry their own year) and update them
+    return embedded.replace_all(result)
+
+def to_columns(records, shifter, rewriters):
+    """
+    Builds the columns (in the same order as the table columns) for a batch of records.
+    The timestamps of the whole batch are parsed and shifted at once.
+    """
+    # Get the original year for date shifting from the ISO-8601 timestamp
+    years = [int(record.timestamp[:4]) for record in records]
+    return [
+        shifter.shift_column([record.timestamp for record in records]),
+        [record.source for record in records],
+        [record.pid for record in records],  # pid can be null
+        # Update both the msg and logline fields with the same function
+        [shift_dates_in_text(record.msg, rewriters, year) for record, year in zip(records, years)],
+        [shift_dates_in_text(record.logline, rewriters, year) for record, year in zip(records, years)],
+        [record.seq for record in records],
+    ]
+
+def columns_builder(shifter, args, metrics=NO_METRICS):
+    """
+    Returns the function building the columns of a batch of records for a load
+    shifted by shifter, reporting its date caches to metrics.
+    """
+    rewriters = date_rewriters(shifter.timedelta)
+    for name, rewriter in zip(("unix_log_date", "embedded_date"), rewriters):
+        metrics.add_rewriter(name, rewriter)
+    return lambda records: to_columns(records, shifter, rewriters)
+
+# UNIX_LOG_DATE_PATTERN and EMBEDDED_DATE_PATTERN for ClickHouse, capturing the whole
+# date and each of its components. RE2 has no lookahead, so the leading date pattern
+# consumes the first character that follows it; only the first group gets replaced.
+SERVER_SIDE_UNIX_LOG_DATE_PATTERN = r'^((Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+(\d{1,2})\s+(\d{2}):(\d{2}):(\d{2})\s+).'
+SERVER_SIDE_EMBEDDED_DATE_PATTERN = r'((?:Mon|Tue|Wed|Thu|Fri|Sat|Sun) (Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+(\d{1,2}) (\d{2}):(\d{2}):(\d{2}) (\d{4}))'
+
+def server_side_shift_text(column, shift):
+    """
+    Builds the SQL expression shifting all dates in column by shift seconds,
+    the same way shift_dates_in_text does.
+    """
+    # First, the Unix log timestamp the text may begin with, using the year of the original timestamp
+    u = f"u_{column}"
+    new_unix_log_dt = "(" + make_datetime_sql("toYear(timestamp)", f"{u}[2]", f"{u}[3]", f"{u}[4]", f"{u}[5]", f"{u}[6]") + f" + {shift})"
+    unix_log_shifted = f"""if((extractGroups({column}, {sql_string(SERVER_SIDE_UNIX_LOG_DATE_PATTERN)}) AS {u})[1] = '',
+               {column},
+               concat({padded_day_sql(new_unix_log_dt)}, formatDateTime({new_unix_log_dt}, ' %H:%i:%S '),
+                      substring({column}, length({u}[1]) + 1)))"""
+
+    # Then all embedded dates, which carry their own year
+    e = f"extractGroups(m, {sql_string(SERVER_SIDE_EMBEDDED_DATE_PATTERN)})"
+    new_embedded_dt = "(" + make_datetime_sql(f"{e}[7]", f"{e}[2]", f"{e}[3]", f"{e}[4]", f"{e}[5]", f"{e}[6]") + f" + {shift})"
+    new_embedded_date_str = (f"concat(formatDateTime({new_embedded_dt}, '%a '), {padded_day_sql(new_embedded_dt)}, "
+                             f"formatDateTime({new_embedded_dt}, ' %H:%i:%S %Y'))")
+    return f"""arrayFold((acc, m) -> replaceAll(acc, m, {new_embedded_date_str}),
+                extractAll({unix_log_shifted}, {sql_string(SERVER_SIDE_EMBEDDED_DATE_PATTERN)}),
+                {unix_log_shifted})"""
+
+def server_side_columns(shift, seq=FILE_ORDER_SEQ):
+    """
+    Returns the SQL expressions of the TABLE_COLUMNS of a row of a staging table,
+    shifting the timestamp and the dates in msg and logline by shift seconds, or
+    keeping them as they are if shift is None. seq is the expression of the seq column.
+    """
+    if shift is None:
+        return ["timestamp", "source", "pid", "msg", "logline", seq]
+    return [
+        f"timestamp + {shift}",
+        "source",
+        "pid",
+        server_side_shift_text("msg", shift),
+        server_side_shift_text("logline", shift),
+        seq,
+    ]
+
+def server_side_insert(staging, shift, table="linux_logs"):
+    """
+    Builds the INSERT ... SELECT copying the staging table into table (linux_logs
+    or its raw table), shifting the rows by shift seconds (see server_side_columns).
+    """
+    return f"""
+        INSERT INTO {table} ({", ".join(TABLE_COLUMNS)})
+        -- The staging table is read in file order (see server_shift.py)
+        SELECT {", ".join(server_side_columns(shift))}
+        FROM {staging}
+    """
+
+def shifted_columns(shift):
+    """
+    Returns the SQL expressions of the TABLE_COLUMNS of a row of linux_logs (or of
+    its raw table) shifted by shift seconds, for shifting the table again (see
+    fingerprints.py) or in a view (see virtual_shift.py).
+    """
+    return server_side_columns(shift, seq="seq")
+
+def load(args):
+    """
+    Loads the dataset into ClickHouse and returns the number of inserted rows.
+    """
+    path = args.input or DATASET
+    input_format = format_of(path)
+    metrics = Metrics("load_linux", args)
+    if window_requested(args) and (args.server_side or input_format == "parquet"):
+        raise ValueError("--since, --until and --sample need a JSONL dataset loaded without --server-side")
+
+    # Connect to ClickHouse (see connection.py).
+    client = connect(args)
     
-    # Drop table if it exists.
+    # Keep the table if it already holds the dataset, shifting it again if it
+    # drifted (see fingerprints.py).
+    fingerprint = dataset_fingerprint(path, args)
+    kept = reuse_table(client, args, "linux_logs", fingerprint, "load_linux")
+    if kept is not None:
+        metrics.finish(kept)
+        return kept
+    forget_fingerprint(client, "linux_logs")
+
+    # Drop the table and its rollup if they exist, and the raw table of --virtual-shift.
+    drop_rollup(client, "linux_logs")
     client.execute("DROP TABLE IF EXISTS linux_logs")
+    drop_raw_table(client, "linux_logs")
     
-    # Create the table.
-    # We're using a MergeTree engine and ordering by the timestamp.
-    client.execute("""
-        CREATE TABLE linux_logs (
-            timestamp DateTime,
-            source String,
-            pid Nullable(Int32),
-            msg String,
-            logline String
-        ) ENGINE = MergeTree()
-        ORDER BY timestamp
-    """)
-
-    # Load data from the gzip JSONL file.
-    # Also, find the maximum timestamp in the file.
-    rows = []
-    max_dt = None
-
-    with gzip.open("linux.jsonl.gz", "rt", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            record = json.loads(line)
-            # Parse the timestamp assuming ISO-8601 format
-            dt = datetime.datetime.strptime(record["timestamp"], "%Y-%m-%dT%H:%M:%S")
-            # Update the max timestamp.
-            if (max_dt is None) or (dt > max_dt):
-                max_dt = dt
-            rows.append(record)
-
-    if max_dt is None:
+    # Create the table in the selected schema profile (see schemas.py). With
+    # --virtual-shift, the records go to a raw table as they are, and linux_logs
+    # becomes a view shifting them once they're loaded (see virtual_shift.py).
+    table = raw_table("linux_logs") if args.virtual_shift else "linux_logs"
+    client.execute(create_table_sql(table, COLUMNS, OPTIMIZED_COLUMNS, args.schema))
+    create_rollup(client, table, ROLLUP_KEYS)
+
+    if args.server_side or input_format == "parquet":
+        # Let ClickHouse decompress, parse and shift the data (see server_shift.py).
+        # Parquet files are always loaded this way, so they are never decoded in Python.
+        total, shift_us = load_server_side(client, path, table, DATASET_COLUMNS,
+                                           lambda staging, shift: server_side_insert(
+                                               staging, None if args.virtual_shift else shift, table),
+                                           input_format=CLICKHOUSE_FORMATS[input_format],
+                                           endpoint=HttpEndpoint.from_args(args), metrics=metrics)
+        # Remember the loaded file and the shift for later appends and restarts
+        # (see append.py and fingerprints.py).
+        record_dataset(client, args, "linux_logs", "load_linux", path, fingerprint, total, shift_us)
+        print(f"Inserted {total} rows into ClickHouse.")
+        metrics.finish(total)
+        return total
+
+    # Find the maximum timestamp in the file (from the metadata sidecar if possible).
+    with metrics.stage("max_timestamp"):
+        max_ts = dataset_max_timestamp(path)
+    if max_ts is None:
         print("No records found in the file!")
-        return
+        metrics.finish(0)
+        return 0
 
-    # Compute the time difference (shift) needed so that the maximum timestamp becomes 'now'
-    now = datetime.datetime.now()
-    shift = now - max_dt
+    # Compute the time difference (shift) needed so that the maximum timestamp becomes 'now',
+    # and the one applied to the records, none with --virtual-shift.
+    shifter, record_shifter = load_shifters(args, max_ts, SECONDS)
+    # Only the rows of the time window of a partial load (see windows.py).
+    window = Window.from_args(args, max_ts, shifter.timedelta)
 
-    # Prepare the data to be inserted.
-    data_to_insert = []
-    for record in rows:
-        orig_dt = datetime.datetime.strptime(record["timestamp"], "%Y-%m-%dT%H:%M:%S")
-        new_dt = orig_dt + shift
-        
-        # Get the original year for date shifting
-        orig_year = orig_dt.year
-        
-        # Update both the logline and msg fields with the same function
-        updated_logline = shift_dates_in_text(record["logline"], shift, orig_year)
-        updated_msg = shift_dates_in_text(record["msg"], shift, orig_year)
-        
-        # Build a tuple with the values in the same order as the table columns.
-        data_tuple = (
-            new_dt,
-            record["source"],
-            record["pid"],  # pid can be null
-            updated_msg,
-            updated_logline
-        )
-        data_to_insert.append(data_tuple)
-
-    # Insert the adjusted data into the ClickHouse table.
-    client.execute(
-        "INSERT INTO linux_logs (timestamp, source, pid, msg, logline) VALUES", 
-        data_to_insert
-    )
-    print(f"Inserted {len(data_to_insert)} rows into ClickHouse.")
+    # Stream the shifted columns into the ClickHouse table batch by batch.
+    total = insert_dataset(client, args, "load_linux", path,
+                           f"INSERT INTO {table} ({', '.join(TABLE_COLUMNS)}) VALUES",
+                           record_shifter, metrics, window)
+    # Remember the loaded file and the shift for later appends and restarts
+    # (see append.py and fingerprints.py).
+    record_dataset(client, args, "linux_logs", "load_linux", path, fingerprint, total, shifter.microseconds,
+                   shifted_end_us(max_ts, shifter.microseconds))
+    print(f"Inserted {total} rows into ClickHouse.")
+    metrics.finish(total)
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the Linux dataset into ClickHouse.")
+    add_common_args(parser)
+    load(parser.parse_args())
 
 if __name__ == "__main__":
     main()
@@ -1,140 +1,342 @@
 #!/usr/bin/env python3
 """
 This script:
-  • Connects to ClickHouse on clickhouse:9000.
-  • Drops any existing table named "openssh_logs" and then creates a new one.
-  • Loads OpenSSH log records from a gzip-compressed JSONL file.
-  • Scans the file to determine the maximum timestamp.
+  • Connects to ClickHouse (clickhouse:9000 unless configured, see connection.py).
+  • Keeps the existing "openssh_logs" table if it already holds the same dataset
+    loaded the same way, only shifting it again in ClickHouse once its timestamps
+    drifted (see fingerprints.py).
+  • Otherwise, drops any existing table named "openssh_logs" and then creates a new one.
+  • Reads the maximum timestamp from the dataset's metadata sidecar, or scans the
+    gzip-compressed JSONL file once if the sidecar is missing or stale.
   • Computes the delta so that shifting the max timestamp gives the current time.
+  • Streams the OpenSSH log records from the file as compact typed records (see
+    records.py), numbering them in file order
+    (seq), as the table is ordered by (timestamp, seq).
   • Adjusts each record's timestamp by that delta.
   • Also adjusts the date in the logline field to match the shifted timestamp.
-  • Inserts all the adjusted records into the ClickHouse table.
+  • With --enrich-ips, fills the country_short, country_long, asn and hostname
+    columns from the IP dataset (see ip_lookup.py), so that queries can group by
+    country without enriching every row. They are NULL otherwise.
+  • Inserts the adjusted records into the ClickHouse table in fixed-size batches,
+    from --workers processes if the file is made of gzip frames (see frames.py).
+  • With --since, --until and --sample, only loads the rows of a time window,
+    reading only the frames of the file that overlap it (see windows.py).
+  • With --virtual-shift, inserts the records (enriched) as they are into
+    "openssh_logs_raw" instead, and creates "openssh_logs" as a view shifting the
+    timestamps and the dates in the logline at query time (see virtual_shift.py).
+  • Reports the time spent in every stage, rows/s, bytes, peak RSS and the date
+    cache hit rates, optionally as a JSON report, a Prometheus textfile and a
+    cProfile dump of the slowest stage (see instrumentation.py).
 """
 
-import json
-import gzip
+import argparse
 import datetime
 import re
-from clickhouse_driver import Client
+import numpy as np
 
-def main():
-    # Connect to ClickHouse on clickhouse:9000.
-    client = Client(host='clickhouse', port=9000)
+from common import add_common_args, insert_dataset
+from connection import HttpEndpoint, connect
+from formats import CLICKHOUSE_FORMATS, format_of
+from fingerprints import dataset_fingerprint, forget_fingerprint, record_dataset, reuse_table, shifted_end_us
+from instrumentation import NO_METRICS, Metrics
+from ip_lookup import ENRICHMENT_FIELDS, IpLookup, add_enrich_args, empty_columns, ipv4_to_int
+from metadata import dataset_max_timestamp
+from records import OpensshRecord
+from rollups import create_rollup, drop_rollup
+from schemas import create_table_sql
+from server_shift import FILE_ORDER_SEQ, load_server_side, make_datetime_sql, padded_day_sql, sql_string
+from timeshift import SECONDS, DateRewriter, UnshiftedDates
+from virtual_shift import drop_raw_table, load_shifters, raw_table
+from windows import Window, window_requested
+
+DATASET = "openssh.jsonl.gz"
+
+# Records of the dataset (see records.py)
+RECORD_TYPE = OpensshRecord
+
+# Columns of the converted dataset (also used for the staging table of --server-side loads)
+DATASET_COLUMNS = """
+    timestamp DateTime,
+    source String,
+    pid Int32,
+    msg String,
+    logline String,
+    ip Nullable(String),
+    user Nullable(String)
+"""
+
+# Columns of the openssh_logs table: the dataset's, the IP enrichment and seq, the
+# position of the record in its file, which keeps the order of lines within the same timestamp
+COLUMNS = DATASET_COLUMNS.rstrip() + """,
+    country_short Nullable(String),
+    country_long Nullable(String),
+    asn Nullable(String),
+    hostname Nullable(String),
+    seq UInt64
+"""
+
+# Names of the columns of the openssh_logs table, in order
+TABLE_COLUMNS = ["timestamp", "source", "pid", "msg", "logline", "ip", "user",
+                 "country_short", "country_long", "asn", "hostname", "seq"]
+
+# Columns of the openssh_logs table in the optimized schema profile (see schemas.py)
+OPTIMIZED_COLUMNS = """
+    timestamp DateTime CODEC(Delta, ZSTD(1)),
+    source LowCardinality(String),
+    pid Int32,
+    msg String CODEC(ZSTD(1)),
+    logline String CODEC(ZSTD(1)),
+    ip Nullable(String),
+    user LowCardinality(Nullable(String)),
+    country_short LowCardinality(Nullable(String)),
+    country_long LowCardinality(Nullable(String)),
+    asn LowCardinality(Nullable(String)),
+    hostname Nullable(String) CODEC(ZSTD(1)),
+    seq UInt64 CODEC(Delta, ZSTD(1)),
+    PROJECTION by_source (SELECT * ORDER BY source, timestamp, seq)
+"""
+
+# Columns of the per-minute rollup of the table (see rollups.py)
+ROLLUP_KEYS = ["source"]
+
+# dateDiff unit of the shifts of the table in ClickHouse (see server_shift.py)
+SHIFT_UNIT = "second"
+
+# NumPy dtypes of the columns, used with --numpy
+COLUMN_DTYPES = [np.int64, object, np.int32, object, object, object, object, object, object, object, object, np.uint64]
+
+# The syslog date in the logline, e.g., "Dec 17 01:25:11" or "Jan  3 21:20:56"
+LOGLINE_DATE_PATTERN = r'(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+(\d{1,2})\s+(\d{2}:\d{2}:\d{2})'
+
+def logline_rewriter(shift):
+    """
+    Returns a DateRewriter that shifts the syslog date in OpenSSH loglines by shift.
+    The logline carries no year, so the year of the record's timestamp has to be passed along.
+    """
+    if not shift:
+        return UnshiftedDates()
+
+    date_pattern = re.compile(LOGLINE_DATE_PATTERN)
+
+    def shift_date(date_str, year):
+        # Extract the matched date components
+        date_match = date_pattern.match(date_str)
+        month_name = date_match.group(1)  # e.g., "Jan"
+        day = int(date_match.group(2))    # e.g., 3 or 17
+        time_str = date_match.group(3)    # e.g., "21:20:56"
+
+        # Parse the original date by combining the extracted components
+        month_num = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6, 
+                     "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12}[month_name]
+        hours, minutes, seconds = map(int, time_str.split(':'))
+
+        orig_logline_date = datetime.datetime(year, month_num, day, hours, minutes, seconds)
+
+        # Apply the time shift
+        new_logline_date = orig_logline_date + shift
+
+        # Format the new date components
+        new_month_name = new_logline_date.strftime("%b")  # This will be like "Jan", "Feb", etc.
+        new_day = new_logline_date.day
+        new_time_str = new_logline_date.strftime("%H:%M:%S")
+
+        # Format the new date with the same spacing as the original
+        # For single-digit days, add an extra space to align with the original format
+        if new_day < 10:
+            return f"{new_month_name}  {new_day} {new_time_str}"  # Double space for single-digit days
+        else:
+            return f"{new_month_name} {new_day} {new_time_str}"   # Single space for double-digit days
+
+    return DateRewriter(LOGLINE_DATE_PATTERN, shift_date)
+
+def to_columns(records, shifter, rewriter, ip_lookup=None):
+    """
+    Builds the columns (in the same order as the table columns) for a batch of records.
+    The timestamps of the whole batch are parsed and shifted at once, and so are
+    the IPs enriched with ip_lookup (an IpLookup) if given.
+    """
+    ips = [record.ip for record in records]  # ip can be null
+    enrichment = ip_lookup.columns(ips) if ip_lookup is not None else empty_columns(len(records))
+    return [
+        shifter.shift_column([record.timestamp for record in records]),
+        [record.source for record in records],
+        [record.pid for record in records],
+        [record.msg for record in records],
+        # The year is taken straight from the ISO-8601 timestamp, e.g., "2023-12-17T01:25:11"
+        [rewriter.replace_first(record.logline, int(record.timestamp[:4])) for record in records],
+        ips,
+        [record.user for record in records],  # user can be null
+        *enrichment,
+        [record.seq for record in records],
+    ]
+
+def columns_builder(shifter, args, metrics=NO_METRICS):
+    """
+    Returns the function building the columns of a batch of records for a load
+    shifted by shifter, reporting its caches to metrics. The IP lookup is built
+    once per load (or worker process) with --enrich-ips.
+    """
+    rewriter = logline_rewriter(shifter.timedelta)
+    metrics.add_rewriter("logline_date", rewriter)
+    ip_lookup = None
+    if args.enrich_ips:
+        with metrics.stage("ip_lookup"):
+            ip_lookup = IpLookup.from_file(args.ips)
+        metrics.add_cache("ipv4", ipv4_to_int)
+    return lambda records: to_columns(records, shifter, rewriter, ip_lookup)
+
+# LOGLINE_DATE_PATTERN for ClickHouse, capturing the whole date and each of its components
+SERVER_SIDE_DATE_PATTERN = r'((Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+(\d{1,2})\s+(\d{2}):(\d{2}):(\d{2}))'
+
+# Enrichment columns looked up in the ip_dict dictionary of load_ips.py, for --server-side loads
+SERVER_SIDE_ENRICHMENT = [
+    f"dictGetOrNull('ip_dict', '{field}', tuple(toIPv6OrDefault(ip)))" for field in ENRICHMENT_FIELDS
+]
+
+def server_side_columns(shift, enrich_ips=False, seq=FILE_ORDER_SEQ, keep_enrichment=False):
+    """
+    Returns the SQL expressions of the TABLE_COLUMNS of a row of a staging table,
+    shifting the timestamp and the date in the logline by shift seconds, or
+    keeping them as they are if shift is None.
+    The logline carries no year, so the year of the original timestamp is used.
+    With enrich_ips, the IPs are enriched through the ip_dict dictionary; with
+    keep_enrichment, the enrichment columns of the staging table are copied.
+    seq is the expression of the seq column.
+    """
+    if keep_enrichment:
+        enrichment = list(ENRICHMENT_FIELDS)
+    elif enrich_ips:
+        enrichment = SERVER_SIDE_ENRICHMENT
+    else:
+        enrichment = ["NULL", "NULL", "NULL", "NULL"]
+    if shift is None:
+        return ["timestamp", "source", "pid", "msg", "logline", "ip", "user", *enrichment, seq]
+    new_logline_date = "(" + make_datetime_sql("toYear(timestamp)", "d[2]", "d[3]", "d[4]", "d[5]", "d[6]") + f" + {shift})"
+    new_date_str = f"concat({padded_day_sql(new_logline_date)}, formatDateTime({new_logline_date}, ' %H:%i:%S'))"
+    return [
+        f"timestamp + {shift}",
+        "source",
+        "pid",
+        "msg",
+        f"""if((extractGroups(logline, {sql_string(SERVER_SIDE_DATE_PATTERN)}) AS d)[1] = '',
+               logline,
+               replaceAll(logline, d[1], {new_date_str}))""",
+        "ip",
+        "user",
+        *enrichment,
+        seq,
+    ]
+
+def server_side_insert(staging, shift, enrich_ips=False, table="openssh_logs"):
+    """
+    Builds the INSERT ... SELECT copying the staging table into table (openssh_logs
+    or its raw table), shifting the rows by shift seconds and enriching the IPs
+    with enrich_ips (see server_side_columns).
+    """
+    return f"""
+        INSERT INTO {table} ({", ".join(TABLE_COLUMNS)})
+        -- The staging table is read in file order (see server_shift.py)
+        SELECT {", ".join(server_side_columns(shift, enrich_ips))}
+        FROM {staging}
+    """
+
+def shifted_columns(shift):
+    """
+    Returns the SQL expressions of the TABLE_COLUMNS of a row of openssh_logs (or of
+    its raw table) shifted by shift seconds, for shifting the table again (see
+    fingerprints.py) or in a view (see virtual_shift.py).
+    """
+    return server_side_columns(shift, seq="seq", keep_enrichment=True)
+
+def load(args):
+    """
+    Loads the dataset into ClickHouse and returns the number of inserted rows.
+    """
+    path = args.input or DATASET
+    input_format = format_of(path)
+    metrics = Metrics("load_openssh", args)
+    if window_requested(args) and (args.server_side or input_format == "parquet"):
+        raise ValueError("--since, --until and --sample need a JSONL dataset loaded without --server-side")
+
+    # Connect to ClickHouse (see connection.py).
+    client = connect(args)
     
-    # Drop table if it exists.
+    # Keep the table if it already holds the dataset, shifting it again if it
+    # drifted (see fingerprints.py).
+    fingerprint = dataset_fingerprint(path, args, args.enrich_ips)
+    kept = reuse_table(client, args, "openssh_logs", fingerprint, "load_openssh")
+    if kept is not None:
+        metrics.finish(kept)
+        return kept
+    forget_fingerprint(client, "openssh_logs")
+
+    # Server-side loads enrich the IPs through the ip_dict dictionary of load_ips.py
+    # (see server_side_columns): check that it exists before dropping the table.
+    server_side = args.server_side or input_format == "parquet"
+    if server_side and args.enrich_ips and not client.execute("EXISTS DICTIONARY ip_dict")[0][0]:
+        raise RuntimeError("--enrich-ips with --server-side or a Parquet dataset needs the ip_dict dictionary: "
+                           "run load_ips.py first")
+
+    # Drop the table and its rollup if they exist, and the raw table of --virtual-shift.
+    drop_rollup(client, "openssh_logs")
     client.execute("DROP TABLE IF EXISTS openssh_logs")
+    drop_raw_table(client, "openssh_logs")
     
-    # Create the table.
-    # We're using a MergeTree engine and ordering by the timestamp.
-    client.execute("""
-        CREATE TABLE openssh_logs (
-            timestamp DateTime,
-            source String,
-            pid Int32,
-            msg String,
-            logline String,
-            ip Nullable(String),
-            user Nullable(String)
-        ) ENGINE = MergeTree()
-        ORDER BY timestamp
-    """)
-
-    # Load data from the gzip JSONL file.
-    # Also, find the maximum timestamp in the file.
-    rows = []
-    max_dt = None
-
-    with gzip.open("openssh.jsonl.gz", "rt", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            record = json.loads(line)
-            # Parse the timestamp assuming ISO-8601 format, e.g., "2023-12-17T01:25:11"
-            dt = datetime.datetime.strptime(record["timestamp"], "%Y-%m-%dT%H:%M:%S")
-            # Update the max timestamp.
-            if (max_dt is None) or (dt > max_dt):
-                max_dt = dt
-            rows.append(record)
-
-    if max_dt is None:
+    # Create the table in the selected schema profile (see schemas.py). With
+    # --virtual-shift, the records go to a raw table as they are, and openssh_logs
+    # becomes a view shifting them once they're loaded (see virtual_shift.py).
+    table = raw_table("openssh_logs") if args.virtual_shift else "openssh_logs"
+    client.execute(create_table_sql(table, COLUMNS, OPTIMIZED_COLUMNS, args.schema))
+    create_rollup(client, table, ROLLUP_KEYS)
+
+    if server_side:
+        # Let ClickHouse decompress, parse and shift the data (see server_shift.py).
+        # Parquet files are always loaded this way, so they are never decoded in Python.
+        total, shift_us = load_server_side(client, path, table, DATASET_COLUMNS,
+                                           lambda staging, shift: server_side_insert(
+                                               staging, None if args.virtual_shift else shift, args.enrich_ips, table),
+                                           input_format=CLICKHOUSE_FORMATS[input_format],
+                                           endpoint=HttpEndpoint.from_args(args), metrics=metrics)
+        # Remember the loaded file and the shift for later appends and restarts
+        # (see append.py and fingerprints.py).
+        record_dataset(client, args, "openssh_logs", "load_openssh", path, fingerprint, total, shift_us)
+        print(f"Inserted {total} rows into ClickHouse.")
+        metrics.finish(total)
+        return total
+
+    # Find the maximum timestamp in the file (from the metadata sidecar if possible).
+    with metrics.stage("max_timestamp"):
+        max_ts = dataset_max_timestamp(path)
+    if max_ts is None:
         print("No records found in the file!")
-        return
-
-    # Compute the time difference (shift) needed so that the maximum timestamp becomes 'now'
-    now = datetime.datetime.now()
-    shift = now - max_dt
-
-    # Prepare the data to be inserted.
-    # For each record, parse its timestamp and add the computed shift.
-    data_to_insert = []
-    for record in rows:
-        orig_dt = datetime.datetime.strptime(record["timestamp"], "%Y-%m-%dT%H:%M:%S")
-        new_dt = orig_dt + shift
-        
-        # Update the date in the logline field
-        logline = record["logline"]
-        
-        # Extract the date components with regex
-        # The format will look like "Dec 17 01:25:11" or "Jan  3 21:20:56"
-        date_pattern = r'(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+(\d{1,2})\s+(\d{2}:\d{2}:\d{2})'
-        date_match = re.search(date_pattern, logline)
-        
-        if date_match:
-            # Extract the matched date components
-            month_name = date_match.group(1)  # e.g., "Jan"
-            day = int(date_match.group(2))    # e.g., 3 or 17
-            time_str = date_match.group(3)    # e.g., "21:20:56"
-            full_match = date_match.group(0)  # The full matched string
-            
-            # Extract the year from the original timestamp
-            year = orig_dt.year
-            
-            # Parse the original date by combining the extracted components
-            month_num = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6, 
-                         "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12}[month_name]
-            hours, minutes, seconds = map(int, time_str.split(':'))
-            
-            orig_logline_date = datetime.datetime(year, month_num, day, hours, minutes, seconds)
-            
-            # Apply the time shift
-            new_logline_date = orig_logline_date + shift
-            
-            # Format the new date components
-            new_month_name = new_logline_date.strftime("%b")  # This will be like "Jan", "Feb", etc.
-            new_day = new_logline_date.day
-            new_time_str = new_logline_date.strftime("%H:%M:%S")
-            
-            # Format the new date with the same spacing as the original
-            # For single-digit days, add an extra space to align with the original format
-            if new_day < 10:
-                new_date_str = f"{new_month_name}  {new_day} {new_time_str}"  # Double space for single-digit days
-            else:
-                new_date_str = f"{new_month_name} {new_day} {new_time_str}"   # Single space for double-digit days
-            
-            # Replace the original date string in the logline
-            updated_logline = logline.replace(full_match, new_date_str)
-        else:
-            updated_logline = logline
-        
-        # Build a tuple with the values in the same order as the table columns.
-        data_tuple = (
-            new_dt,
-            record["source"],
-            record["pid"],
-            record["msg"],
-            updated_logline,
-            record.get("ip"),    # ip can be null
-            record.get("user")   # user can be null
-        )
-        data_to_insert.append(data_tuple)
-
-    # Insert the adjusted data into the ClickHouse table.
-    client.execute(
-        "INSERT INTO openssh_logs (timestamp, source, pid, msg, logline, ip, user) VALUES", 
-        data_to_insert
-    )
-    print(f"Inserted {len(data_to_insert)} rows into ClickHouse.")
+        metrics.finish(0)
+        return 0
+
+    # Compute the time difference (shift) needed so that the maximum timestamp becomes 'now',
+    # and the one applied to the records, none with --virtual-shift.
+    shifter, record_shifter = load_shifters(args, max_ts, SECONDS)
+    # Only the rows of the time window of a partial load (see windows.py).
+    window = Window.from_args(args, max_ts, shifter.timedelta)
+    if args.enrich_ips:
+        print(f"Enriching IPs with the addresses from {args.ips}.")
+
+    # Stream the shifted columns into the ClickHouse table batch by batch.
+    total = insert_dataset(client, args, "load_openssh", path,
+                           f"INSERT INTO {table} ({', '.join(TABLE_COLUMNS)}) VALUES",
+                           record_shifter, metrics, window)
+    # Remember the loaded file and the shift for later appends and restarts
+    # (see append.py and fingerprints.py).
+    record_dataset(client, args, "openssh_logs", "load_openssh", path, fingerprint, total, shifter.microseconds,
+                   shifted_end_us(max_ts, shifter.microseconds))
+    print(f"Inserted {total} rows into ClickHouse.")
+    metrics.finish(total)
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the OpenSSH dataset into ClickHouse.")
+    add_common_args(parser)
+    add_enrich_args(parser)
+    load(parser.parse_args())
 
 if __name__ == "__main__":
     main()
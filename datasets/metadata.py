@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Metadata sidecars for the gzip-compressed JSONL datasets.
+
+The process_*.py converters write a small JSON file next to every dataset
+(apache.jsonl.gz -> apache.jsonl.gz.meta.json) with:
+  • the minimum and maximum timestamp,
+  • the number of rows,
+  • the schema version of the records,
+  • the SHA-256 of the compressed file,
+  • the frame index of JSONL datasets written as gzip frames (see frames.py),
+    with the minimum and maximum timestamp of every frame.
+
+Loaders read the maximum timestamp from the sidecar instead of decompressing and
+scanning the whole file, and the frame index to load the frames in parallel or
+only those of a time window (see windows.py).
+The sidecar is ignored when it is missing, was written for another schema
+version or doesn't match the file's content hash.
+
+Run this module on existing datasets to (re)build their sidecars:
+  python metadata.py apache.jsonl.gz hadoop.jsonl.gz
+"""
+
+import argparse
+import functools
+import gzip
+import hashlib
+import json
+import os
+import re
+
+from frames import read_frame, scan_frames
+
+# Bump whenever the record layout written by the converters changes.
+SCHEMA_VERSION = 1
+
+# Matches the timestamp field as written by json.dumps in the process_*.py scripts.
+TIMESTAMP_FIELD_PATTERN = re.compile(r'"timestamp":\s*"([^"]*)"')
+
+class DatasetStats:
+    """
+    Collects the statistics stored in a sidecar while records are written or read.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.min_timestamp = None
+        self.max_timestamp = None
+
+    def add(self, timestamp):
+        """
+        Accounts for one record with the given ISO-8601 timestamp (or None).
+        ISO-8601 timestamps with a fixed format sort lexicographically.
+        """
+        self.rows += 1
+        if timestamp is None:
+            return
+        if (self.min_timestamp is None) or (timestamp < self.min_timestamp):
+            self.min_timestamp = timestamp
+        if (self.max_timestamp is None) or (timestamp > self.max_timestamp):
+            self.max_timestamp = timestamp
+
+def sidecar_path(path):
+    """
+    Returns the path of the metadata sidecar of a dataset.
+    """
+    return path + ".meta.json"
+
+def file_sha256(path):
+    """
+    Returns the hex SHA-256 of a file, read in 1 MiB blocks. The hash is only
+    computed again when the file's size or modification time changes, as a load
+    reads the sidecar more than once.
+    """
+    stat = os.stat(path)
+    return cached_sha256(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+@functools.lru_cache(maxsize=64)
+def cached_sha256(path, size, mtime_ns):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def write_metadata(path, stats, frames=None):
+    """
+    Writes the sidecar of a dataset that has been completely written to path,
+    with its frame index if it's made of frames (see frames.py).
+    """
+    metadata = {
+        "schema_version": SCHEMA_VERSION,
+        "rows": stats.rows,
+        "min_timestamp": stats.min_timestamp,
+        "max_timestamp": stats.max_timestamp,
+        "sha256": file_sha256(path),
+    }
+    if frames is not None:
+        metadata["frames"] = frames
+    with open(sidecar_path(path), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+        f.write("\n")
+    return metadata
+
+def read_metadata(path):
+    """
+    Returns the sidecar of a dataset as a dict, or None if it's missing or stale.
+    """
+    try:
+        with open(sidecar_path(path), "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if metadata.get("schema_version") != SCHEMA_VERSION:
+        return None
+    if metadata.get("sha256") != file_sha256(path):
+        return None
+    return metadata
+
+def scan_stats(path):
+    """
+    Computes the statistics of a dataset by reading the whole file.
+    The timestamp is picked out of the raw line without decoding the whole JSON
+    object, so no datetime parsing is needed.
+    """
+    stats = DatasetStats()
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                stats.add(line_timestamp(line))
+    return stats
+
+def scan_frame_stats(path):
+    """
+    Computes the statistics of a dataset and its frame index, with the bounds of
+    the timestamps of every frame, by reading the whole file frame by frame.
+    The rows of a frame are its records, without blank lines, as in the sidecar's rows.
+    """
+    stats = DatasetStats()
+    frames = scan_frames(path)
+    with open(path, "rb") as f:
+        for frame in frames:
+            frame_stats = DatasetStats()
+            for line in read_frame(f, frame).decode("utf-8").splitlines():
+                if line.strip():
+                    timestamp = line_timestamp(line)
+                    stats.add(timestamp)
+                    frame_stats.add(timestamp)
+            frame["rows"] = frame_stats.rows
+            frame["min_timestamp"] = frame_stats.min_timestamp
+            frame["max_timestamp"] = frame_stats.max_timestamp
+    return stats, frames
+
+def line_timestamp(line):
+    """
+    Returns the "timestamp" of a non-empty JSON line, picked out of the raw line
+    when possible. Raises ValueError if the line isn't a JSON object.
+    """
+    match = TIMESTAMP_FIELD_PATTERN.search(line)
+    if match:
+        return match.group(1)
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError(f"expected a JSON object, got {type(record).__name__}")
+    return record.get("timestamp")
+
+def dataset_max_timestamp(path):
+    """
+    Returns the maximum "timestamp" string of a dataset (or None if it has no records).
+    Uses the sidecar when it's valid and falls back to scanning the file otherwise.
+    """
+    metadata = read_metadata(path)
+    if metadata is not None:
+        return metadata["max_timestamp"]
+
+    print(f"No valid metadata for {path}, scanning the file for the maximum timestamp.")
+    return scan_stats(path).max_timestamp
+
+def dataset_frames(path):
+    """
+    Returns the frame index of a dataset from its sidecar, or None if the
+    sidecar is missing, stale or has no index.
+    """
+    metadata = read_metadata(path)
+    if metadata is None:
+        return None
+    return metadata.get("frames")
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the metadata sidecars of gzip JSONL datasets.")
+    parser.add_argument("datasets", nargs="+", help="Dataset files (.jsonl.gz)")
+    args = parser.parse_args()
+
+    for path in args.datasets:
+        metadata = write_metadata(path, *scan_frame_stats(path))
+        print(f"{sidecar_path(path)}: {metadata['rows']} rows, "
+              f"{metadata['min_timestamp']} .. {metadata['max_timestamp']}")
+
+if __name__ == "__main__":
+    main()
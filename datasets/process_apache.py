@@ -1,9 +1,25 @@
 #!/usr/bin/env python3
 import re
-import json
-import gzip
 from datetime import datetime
 import argparse
+import os
+
+from formats import add_format_arg, open_writer
+from instrumentation import Metrics, add_metrics_args
+from metadata import DatasetStats, write_metadata
+from records import ApacheRecord
+
+# Fields of the records, for the Parquet output
+FIELDS = [
+    ("timestamp", "timestamp"),
+    ("severity", "dictionary"),
+    ("client", "string"),
+    ("function", "dictionary"),
+    ("path", "string"),
+    ("msg", "string"),
+    ("logline", "string"),
+    ("seq", "int64"),
+]
 
 def parse_log_line(line):
     """
@@ -37,34 +53,59 @@ def parse_log_line(line):
     dt = datetime.strptime(timestamp_str, "%a %b %d %H:%M:%S %Y")
     iso_date = dt.isoformat()
 
-    result = {
-        "timestamp": iso_date,
-        "severity": severity,
-        "client": client if client else None,
-        "function": function if function else None,
-        "path": path if path else None,
-        "msg": msg,
-        "logline": line.strip()  # keep the full original logline
-    }
-    return result
+    return ApacheRecord(
+        timestamp=iso_date,
+        severity=severity,
+        client=client if client else None,
+        function=function if function else None,
+        path=path if path else None,
+        msg=msg,
+        logline=line.strip()  # keep the full original logline
+    )
+
+def parse_lines(lines):
+    """
+    Yields the parsed records of lines, skipping empty lines and reporting the
+    ones that can't be parsed.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue  # skip empty lines
+        parsed_log = parse_log_line(line)
+        if parsed_log:
+            yield parsed_log
+        else:
+            print("Parsing error:", line)
 
 def main():
-    parser = argparse.ArgumentParser(description="Convert a log file into JSON Lines (jsonl) format compressed with gzip.")
+    parser = argparse.ArgumentParser(description="Convert a log file into gzip-compressed JSON Lines (jsonl) or Parquet.")
     parser.add_argument("infile", help="Input log file")
-    parser.add_argument("outfile", help="Output JSONL GZIP file (.jsonl.gz)")
+    parser.add_argument("outfile", help="Output JSONL GZIP file (.jsonl.gz) or Parquet file (.parquet)")
+    add_format_arg(parser)
+    add_metrics_args(parser)
     args = parser.parse_args()
 
-    with open(args.infile, "r") as inf, gzip.open(args.outfile, "wt", encoding="utf-8") as outf:
-        for line in inf:
-            line = line.strip()
-            if not line:
-                continue  # skip empty lines
-            parsed_log = parse_log_line(line)
-            if parsed_log:
-                # Write one JSON object per line.
-                outf.write(json.dumps(parsed_log) + "\n")
-            else:
-                print("Parsing error:", line)
+    # Statistics for the metadata sidecar written next to the output file
+    stats = DatasetStats()
+    # Time spent parsing and writing, see instrumentation.py
+    metrics = Metrics("process_apache", args)
+    metrics.add_bytes("in", os.path.getsize(args.infile))
+
+    with open(args.infile, "r") as inf, open_writer(args.outfile, args.format, FIELDS, args.frame_rows, args.level) as outf:
+        # Parse and write the records in blocks, so that both stages can be timed
+        for block in metrics.blocks("parse", parse_lines(inf)):
+            with metrics.stage("write", len(block)):
+                for parsed_log in block:
+                    # Position of the record in the file (the records written so far),
+                    # keeping the order of lines within a second
+                    parsed_log.seq = stats.rows
+                    outf.write(parsed_log)
+                    stats.add(parsed_log.timestamp)
+
+    write_metadata(args.outfile, stats, outf.frames)
+    metrics.add_bytes("out", os.path.getsize(args.outfile))
+    metrics.finish(stats.rows)
 
 if __name__ == '__main__':
     main()
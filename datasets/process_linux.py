@@ -1,10 +1,25 @@
 #!/usr/bin/env python3
 import re
-import json
-import gzip
 import argparse
+import os
 from datetime import datetime
 
+from formats import add_format_arg, open_writer
+from instrumentation import Metrics, add_metrics_args
+from metadata import DatasetStats, write_metadata
+from records import LinuxRecord
+from syslog_chunks import add_jobs_arg, parse_file
+
+# Fields of the records, for the Parquet output
+FIELDS = [
+    ("timestamp", "timestamp"),
+    ("source", "dictionary"),
+    ("pid", "int32"),
+    ("msg", "string"),
+    ("logline", "string"),
+    ("seq", "int64"),
+]
+
 def parse_log_line(line, year):
     """
     Parses a single log line from linux.log.
@@ -46,43 +61,47 @@ def parse_log_line(line, year):
     dt = datetime.strptime(date_str, "%b %d %H:%M:%S %Y")
     iso_date = dt.isoformat()
     
-    result = {
-        "timestamp": iso_date,
-        "source": source,
-        "pid": pid,
-        "msg": msg,
-        "logline": line.strip()
-    }
+    result = LinuxRecord(
+        timestamp=iso_date,
+        source=source,
+        pid=pid,
+        msg=msg,
+        logline=line.strip()
+    )
     return result, month
 
 def main():
-    parser = argparse.ArgumentParser(description="Convert a linux log file into JSON Lines (jsonl) format compressed with gzip.")
+    parser = argparse.ArgumentParser(description="Convert a linux log file into gzip-compressed JSON Lines (jsonl) or Parquet.")
     parser.add_argument("infile", help="Input log file")
-    parser.add_argument("outfile", help="Output JSONL GZIP file (.jsonl.gz)")
+    parser.add_argument("outfile", help="Output JSONL GZIP file (.jsonl.gz) or Parquet file (.parquet)")
+    add_format_arg(parser)
+    add_jobs_arg(parser)
+    add_metrics_args(parser)
     args = parser.parse_args()
 
     current_year = 2005  # Start with 2005 as specified
-    prev_month = None
 
-    with open(args.infile, "r") as inf, gzip.open(args.outfile, "wt", encoding="utf-8") as outf:
-        for line in inf:
-            line = line.strip()
-            if not line:
-                continue  # skip empty lines
-            
-            parsed_log, current_month = parse_log_line(line, current_year)
-            if parsed_log and current_month:
-                # Check for year transition (Dec to Jan indicates year change)
-                if prev_month == "Dec" and current_month == "Jan":
-                    current_year += 1
-                    # Re-parse the log with the updated year
-                    parsed_log, _ = parse_log_line(line, current_year)
-                
-                # Write one JSON object per line
-                outf.write(json.dumps(parsed_log) + "\n")
-                prev_month = current_month
-            else:
-                print("Parsing error:", line)
+    # Statistics for the metadata sidecar written next to the output file
+    stats = DatasetStats()
+    # Time spent parsing and writing, see instrumentation.py
+    metrics = Metrics("process_linux", args)
+    metrics.add_bytes("in", os.path.getsize(args.infile))
+
+    with open_writer(args.outfile, args.format, FIELDS, args.frame_rows, args.level) as outf:
+        # Parse the lines (in parallel with --jobs), tracking the year across Dec to Jan transitions.
+        # Records are written in blocks, so that both stages can be timed.
+        records = parse_file(parse_log_line, args.infile, current_year, args.jobs)
+        for block in metrics.blocks("parse", records):
+            with metrics.stage("write", len(block)):
+                for parsed_log in block:
+                    # Position of the record in the file, keeping the order of lines within a second
+                    parsed_log.seq = stats.rows
+                    outf.write(parsed_log)
+                    stats.add(parsed_log.timestamp)
+
+    write_metadata(args.outfile, stats, outf.frames)
+    metrics.add_bytes("out", os.path.getsize(args.outfile))
+    metrics.finish(stats.rows)
 
 if __name__ == '__main__':
     main()
@@ -1,2 +1,3 @@
 #!/bin/bash
-head -n 300000 "$1" | gzip -9 > "$2"
+# Compressed as gzip frames in parallel (see frames.py)
+head -n 300000 "$1" | python "$(dirname "$0")/frames.py" - "$2"
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Typed records of the log datasets, shared by the process_*.py converters (which
+create them when parsing lines) and the loaders (which decode them from JSONL).
+
+Every dataset has a record class with __slots__ instead of a dict per record:
+  • a record takes a fixed, small amount of memory (no hash table, no per-record
+    keys), which matters for the batches the loaders keep in memory and the
+    chunks the parallel converters send between processes,
+  • attribute access (record.msg) is faster than a dict lookup in the loops
+    building the columns,
+  • the fields with few distinct values (source, severity, thread, ...; the
+    LowCardinality columns of the optimized schema) are interned as they're
+    parsed or decoded: every record points to one shared string instead of
+    holding its own copy.
+
+Records are written to JSONL as the dict returned by to_dict(), with every field
+in class order: fields a line doesn't have (e.g. the ip of an OpenSSH line without
+one) are written as null.
+"""
+
+import operator
+
+# Maximum number of distinct values interned, in case a field turns out not to
+# have few distinct values after all
+MAX_INTERNED = 100000
+
+_interned = {}
+
+def intern(value):
+    """
+    Returns the shared copy of a low-cardinality value (None stays None).
+    Unlike sys.intern, it takes any hashable value and stops growing at MAX_INTERNED.
+    """
+    try:
+        return _interned[value]
+    except KeyError:
+        if len(_interned) < MAX_INTERNED:
+            _interned[value] = value
+        return value
+
+class Record:
+    """
+    Base class of the record classes. Subclasses list their fields in __slots__,
+    in the order of the table columns, and intern their low-cardinality fields
+    in __init__.
+    """
+
+    __slots__ = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Returns the values of all the fields at once
+        cls._values = operator.attrgetter(*cls.__slots__)
+
+    @classmethod
+    def from_dict(cls, values):
+        """
+        Builds a record from a decoded JSON object. Missing fields are None and
+        unknown fields are ignored.
+        """
+        return cls(*map(values.get, cls.__slots__))
+
+    def to_dict(self):
+        return dict(zip(self.__slots__, self._values(self)))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._values(self) == other._values(other)
+
+    def __repr__(self):
+        fields = ", ".join(f"{field}={value!r}" for field, value in zip(self.__slots__, self._values(self)))
+        return f"{type(self).__name__}({fields})"
+
+class ApacheRecord(Record):
+    __slots__ = ("timestamp", "severity", "client", "function", "path", "msg", "logline", "seq")
+
+    def __init__(self, timestamp, severity, client=None, function=None, path=None, msg="", logline="", seq=None):
+        self.timestamp = timestamp
+        self.severity = intern(severity)
+        self.client = client
+        self.function = intern(function)
+        self.path = path
+        self.msg = msg
+        self.logline = logline
+        self.seq = seq
+
+class HadoopRecord(Record):
+    __slots__ = ("timestamp", "severity", "thread", "source", "msg", "logline", "seq")
+
+    def __init__(self, timestamp, severity, thread, source, msg="", logline="", seq=None):
+        self.timestamp = timestamp
+        self.severity = intern(severity)
+        self.thread = intern(thread)
+        self.source = intern(source)
+        self.msg = msg
+        self.logline = logline
+        self.seq = seq
+
+class LinuxRecord(Record):
+    __slots__ = ("timestamp", "source", "pid", "msg", "logline", "seq")
+
+    def __init__(self, timestamp, source, pid=None, msg="", logline="", seq=None):
+        self.timestamp = timestamp
+        self.source = intern(source)
+        self.pid = pid
+        self.msg = msg
+        self.logline = logline
+        self.seq = seq
+
+class OpensshRecord(Record):
+    __slots__ = ("timestamp", "source", "pid", "msg", "logline", "ip", "user", "seq")
+
+    def __init__(self, timestamp, source, pid=None, msg="", logline="", ip=None, user=None, seq=None):
+        self.timestamp = timestamp
+        self.source = intern(source)
+        self.pid = pid
+        self.msg = msg
+        self.logline = logline
+        self.ip = ip
+        self.user = intern(user)
+        self.seq = seq
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+This script:
+  • Drops and recreates a log table, like the loaders do.
+  • Replays a gzip-compressed JSONL dataset into it in real time: every record
+    is inserted when its original inter-arrival time, divided by --speed, has
+    elapsed since the start of the replay (or as fast as possible with --speed max).
+  • Inserts small batches every --interval seconds, optionally as ClickHouse
+    async inserts.
+  • Shifts the records so that the table looks like a live, growing log: the
+    first record is given the start time of the replay and every other record
+    the time it's due at, start + (timestamp - first timestamp) / --speed. All
+    the batches are shifted the same way with the loader's to_columns, so their
+    time ranges follow each other without overlaps or gaps, and the dates in the
+    text are moved to the same schedule as the timestamps (see ScaledShifter).
+    With --speed max, the dataset is shifted as a whole so that its newest record
+    is 'now', like a regular load.
+  • Reads and inserts in separate threads connected by a bounded queue: when
+    ClickHouse can't keep up, the reader blocks (backpressure) instead of
+    buffering without limit, and the replay falls behind schedule.
+  • Reports the achieved vs the target rows/s and how far behind schedule the
+    replay is every --report-every seconds.
+
+Example:
+  python replay.py linux --speed 10
+"""
+
+import argparse
+import datetime
+import queue
+import threading
+import time
+
+import numpy as np
+
+from append import SOURCES, Source
+from common import batched, iter_records, list_columns, with_seq
+from connection import add_connection_args, connect
+from fingerprints import forget_fingerprint
+from ingest_state import reset_state
+from metadata import dataset_max_timestamp
+from rollups import drop_rollup
+from schemas import add_schema_arg, create_table
+from timeshift import MICROSECONDS, SECONDS, TimeShifter, parse_timestamps
+from virtual_shift import drop_raw_table
+
+# Maximum number of batches waiting to be inserted
+QUEUE_SIZE = 8
+
+# Marks the end of the replay in the queue
+DONE = None
+
+def parse_speed(value):
+    if value == "max":
+        return None
+    speed = float(value)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("the speed must be positive")
+    return speed
+
+class ScaledShift:
+    """
+    The shift of a replay at a speed other than 1, for the loaders' date rewriters,
+    which add their shift to the dates they find: date + ScaledShift moves a date
+    to start + (date - first) / speed, like the timestamps of ScaledShifter.
+    """
+
+    def __init__(self, first, start, speed):
+        self.first = first
+        self.start = start
+        self.speed = speed
+
+    def __radd__(self, date):
+        return self.start + (date - self.first) / self.speed
+
+class ScaledShifter:
+    """
+    Moves the timestamps of a replay at a speed other than 1 from the first one
+    (a datetime) to start + (timestamp - first) / speed, for the loaders' to_columns
+    like a TimeShifter. timedelta is the ScaledShift of the dates in the text, so
+    the text and the timestamps stay on the same schedule.
+    """
+
+    def __init__(self, first, start, speed, unit=SECONDS):
+        self.unit = unit
+        if unit == SECONDS:
+            # A DateTime column has no fractions of a second
+            start = start.replace(microsecond=0)
+        self.first = first
+        self.start = start
+        self.speed = speed
+
+    @property
+    def timedelta(self):
+        return ScaledShift(self.first, self.start, self.speed)
+
+    def shift_column(self, values):
+        """
+        Parses and moves a sequence of ISO-8601 strings, returning an int64 array of
+        epoch values (seconds or microseconds, depending on the unit).
+        """
+        first, start = parse_timestamps([self.first.isoformat(), self.start.isoformat()], MICROSECONDS).astype(np.int64)
+        elapsed = parse_timestamps(values, MICROSECONDS).astype(np.int64) - first
+        # Rounded to the microsecond like the timedelta division of ScaledShift
+        scaled = np.rint(elapsed / self.speed).astype(np.int64) + start
+        return scaled if self.unit == MICROSECONDS else scaled // 1000000
+
+class Schedule:
+    """
+    Maps the (original) timestamps of the records to the wall clock time they're due
+    at, and to the time they're given in the table.
+    """
+
+    def __init__(self, speed, unit=SECONDS):
+        self.speed = speed
+        self.unit = unit
+        self.start = time.monotonic()
+        self.start_utc = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        self.first = None
+        self.latest = None
+        # Shifts the records to their replay time, set by the first record
+        self.shifter = None
+
+    def due(self, timestamp):
+        """
+        Returns the monotonic clock time a record is due at. Records that are
+        out of order are due with the latest record seen so far.
+        """
+        timestamp = datetime.datetime.fromisoformat(timestamp)
+        if self.first is None:
+            self.first = self.latest = timestamp
+            if self.speed == 1:
+                self.shifter = TimeShifter.from_microseconds(
+                    (self.start_utc - self.first) // datetime.timedelta(microseconds=1), self.unit)
+            else:
+                self.shifter = ScaledShifter(self.first, self.start_utc, self.speed, self.unit)
+        self.latest = max(self.latest, timestamp)
+        if self.speed is None:
+            return self.start
+        return self.start + (self.latest - self.first).total_seconds() / self.speed
+
+def read_batches(records, schedule, args, batches):
+    """
+    Groups the records into one batch per --interval seconds of replay time and
+    puts every batch in the queue when it's due, along with the time its last
+    record was due at. Blocks while the queue is full.
+    """
+    try:
+        if schedule.speed is None:
+            # As fast as possible: fixed-size batches
+            for batch in batched(records, args.max_batch):
+                batches.put((batch, time.monotonic()))
+            return
+
+        batch = []
+        first_due = last_due = None
+        for record in records:
+            due = schedule.due(record.timestamp)
+            if batch and (due - first_due >= args.interval or len(batch) >= args.max_batch):
+                # Wait until the batch is due, then hand it over
+                time.sleep(max(0.0, last_due - time.monotonic()))
+                batches.put((batch, last_due))
+                batch = []
+            if not batch:
+                first_due = due
+            batch.append(record)
+            last_due = due
+        if batch:
+            time.sleep(max(0.0, last_due - time.monotonic()))
+            batches.put((batch, last_due))
+    finally:
+        # Also stops the inserts if reading fails
+        batches.put(DONE)
+
+class Stats:
+    """
+    Counts the inserted rows and reports the achieved vs the target rate.
+    The target rate of a period is the number of rows inserted in it divided by
+    how long they took in the (scaled) original log.
+    """
+
+    def __init__(self, schedule, report_every):
+        self.schedule = schedule
+        self.report_every = report_every
+        self.rows = 0
+        self.lag = 0.0
+        self.last_due = schedule.start
+        self.last_report = time.monotonic()
+        self.report_rows = 0
+        self.report_due = schedule.start
+
+    def add(self, rows, due):
+        now = time.monotonic()
+        self.rows += rows
+        self.last_due = max(self.last_due, due)
+        self.lag = max(0.0, now - due)
+        if now - self.last_report >= self.report_every:
+            self.report(now - self.last_report, self.rows - self.report_rows, self.last_due - self.report_due)
+            self.last_report = now
+            self.report_rows = self.rows
+            self.report_due = self.last_due
+
+    def report(self, seconds, rows, due_seconds):
+        achieved = rows / seconds if seconds > 0 else 0.0
+        if self.schedule.speed is None:
+            target = "max"
+        elif due_seconds > 0:
+            target = f"{rows / due_seconds:,.0f}"
+        else:
+            target = "-"
+        print(f"{self.rows:>12,} rows  achieved {achieved:>10,.0f} rows/s  "
+              f"target {target:>10} rows/s  behind schedule {self.lag:.1f}s", flush=True)
+
+def insert_batches(client, source, batches, stats, shifter):
+    """
+    Inserts the batches from the queue until the end of the replay, all shifted
+    by shifter with the same rewriters, which keep their caches across batches.
+    """
+    query = f"INSERT INTO {source.table} ({', '.join(source.loader.TABLE_COLUMNS)}) VALUES"
+    rewriters = None
+    while True:
+        item = batches.get()
+        if item is DONE:
+            return
+        batch, due = item
+        if rewriters is None:
+            # The first record of a timed replay sets the shift
+            shifter = shifter or stats.schedule.shifter
+            rewriters = source.rewriters(shifter.timedelta)
+        columns = source.loader.to_columns(batch, shifter, rewriters)
+        client.execute(query, list_columns(columns), columnar=True)
+        stats.add(len(batch), due)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a dataset into ClickHouse in real time.")
+    parser.add_argument("source", choices=SOURCES, help="Log source to replay")
+    parser.add_argument("--input", help="Dataset file to replay instead of the bundled one (.jsonl.gz)")
+    parser.add_argument("--speed", type=parse_speed, default=1.0,
+                        help="Replay speed factor, e.g. 1, 10 or max (default: 1)")
+    parser.add_argument("--interval", type=float, default=1.0,
+                        help="Seconds of replay time per inserted batch (default: 1)")
+    parser.add_argument("--max-batch", type=int, default=10000,
+                        help="Maximum number of rows per inserted batch (default: 10000)")
+    parser.add_argument("--report-every", type=float, default=10.0,
+                        help="Seconds between progress reports (default: 10)")
+    add_schema_arg(parser)
+    # --async-insert lets the server batch the rows
+    add_connection_args(parser)
+    args = parser.parse_args()
+
+    source = Source(args.source, None)
+    path = args.input or source.loader.DATASET
+
+    # Connect to ClickHouse (see connection.py)
+    client = connect(args)
+    # The table won't hold the dataset as loaded (see fingerprints.py)
+    forget_fingerprint(client, source.table)
+    drop_rollup(client, source.table)
+    client.execute(f"DROP TABLE IF EXISTS {source.table}")
+    drop_raw_table(client, source.table)
+    create_table(client, source.table, source.loader, args.schema)
+    # The table's timestamps don't follow the shift of a regular load
+    reset_state(client, source.table)
+
+    # As fast as possible, the dataset is shifted as a whole like in a regular load
+    shifter = None
+    max_ts = dataset_max_timestamp(path) if args.speed is None else None
+    if max_ts is not None:
+        shifter = TimeShifter(max_ts, source.unit)
+
+    schedule = Schedule(args.speed, source.unit)
+    stats = Stats(schedule, args.report_every)
+    batches = queue.Queue(maxsize=QUEUE_SIZE)
+
+    reader = threading.Thread(target=read_batches, args=(with_seq(iter_records(path, record_type=source.loader.RECORD_TYPE)), schedule, args, batches), daemon=True)
+    reader.start()
+    start = time.monotonic()
+    insert_batches(client, source, batches, stats, shifter)
+    reader.join()
+
+    elapsed = time.monotonic() - start
+    print(f"Replayed {stats.rows} rows in {elapsed:.1f}s.")
+    stats.report(elapsed, stats.rows, stats.last_due - schedule.start)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Per-minute rollups of the log tables, for histogram queries.
+
+Every log table <table> gets:
+  • <table>_per_minute, a SummingMergeTree with the number of rows per minute and
+    per value of the loader's ROLLUP_KEYS (e.g. source or severity),
+  • <table>_per_minute_mv, a materialized view that adds every block inserted
+    into <table> to the rollup, whichever script inserts it (loaders, --server-side
+    INSERT ... SELECT, append.py, replay.py, synthetic.py).
+
+SummingMergeTree only adds the counts up when parts are merged, so the rollup can
+hold several rows per minute and key: queries have to use sum(count), e.g.
+  SELECT toStartOfHour(minute), sum(count) FROM linux_logs_per_minute GROUP BY 1
+A histogram over weeks of data then reads thousands of rows instead of millions.
+"""
+
+def rollup_table(table):
+    return f"{table}_per_minute"
+
+def rollup_view(table):
+    return f"{table}_per_minute_mv"
+
+def drop_rollup(client, table):
+    """
+    Drops the rollup of table and its materialized view, e.g. before the table is recreated.
+    """
+    client.execute(f"DROP VIEW IF EXISTS {rollup_view(table)}")
+    client.execute(f"DROP TABLE IF EXISTS {rollup_table(table)}")
+
+def create_rollup(client, table, keys):
+    """
+    Creates the rollup of table and the materialized view filling it.
+    If the rollup doesn't exist yet but the table already has rows (e.g. append.py
+    on a table loaded before rollups existed), they are added to it right away.
+    Assumes nothing is inserted into table meanwhile.
+    """
+    rollup = rollup_table(table)
+    if client.execute(f"EXISTS TABLE {rollup}")[0][0]:
+        return
+
+    key_columns = "".join(f"{key} LowCardinality(String),\n" for key in keys)
+    group_by = ", ".join(["minute"] + keys)
+    select = f"SELECT toStartOfMinute(timestamp) AS minute, {', '.join(keys)}, count() AS count FROM {table} GROUP BY {group_by}"
+
+    client.execute(f"""
+        CREATE TABLE {rollup} (
+            minute DateTime,
+            {key_columns}
+            count UInt64
+        ) ENGINE = SummingMergeTree(count)
+        ORDER BY ({group_by})
+    """)
+    client.execute(f"CREATE MATERIALIZED VIEW IF NOT EXISTS {rollup_view(table)} TO {rollup} AS {select}")
+    # Rows inserted before the view existed
+    client.execute(f"INSERT INTO {rollup} {select}")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Schema profiles of the log tables, selected with --schema:
+  • plain     - the original schema: String columns without codecs, ordered by
+                (timestamp, seq) (the default).
+  • optimized - a schema tuned for the OQL queries:
+      - LowCardinality(String) for columns with few distinct values (source,
+        severity, thread, ...),
+      - Delta + ZSTD codec on the timestamp and ZSTD on the text columns,
+      - monthly partitions: the datasets span up to 9 months, and daily partitions
+        would exceed the 100 partitions ClickHouse allows per INSERT block and
+        create a part per day for every batch,
+      - bloom filter skip indexes on msg (ngrams, as is and lowercased) and on
+        logline (tokens), so that substring searches skip most granules,
+      - a projection ordered by the column queries filter on most (e.g. source),
+        used by ClickHouse for scans like source = 'sshd'.
+
+Both profiles order the rows by (timestamp, seq), seq being the position of the
+record in its file. The key is unique per file, so the newest rows can be paged
+through with a cursor instead of an OFFSET scan, reading a range of the index:
+  WHERE (timestamp, seq) < (<last timestamp>, <last seq>)
+  ORDER BY timestamp DESC, seq DESC LIMIT 100
+
+ClickHouse doesn't use skip indexes for ILIKE. Case-sensitive LIKE uses the msg
+index and lower(msg) LIKE '%break-in attempt!%' uses the lowercased one.
+
+Every loader defines its COLUMNS (plain profile, also used for staging tables)
+and OPTIMIZED_COLUMNS (with the projection); the text indexes are shared.
+"""
+
+from rollups import create_rollup
+
+PROFILES = ["plain", "optimized"]
+DEFAULT_PROFILE = "plain"
+
+# Skip indexes of the optimized profile, on the msg and logline columns every log table has.
+# ngrambf_v1(ngram size, bloom filter bytes, hash functions, seed), tokenbf_v1(bytes, hash functions, seed)
+TEXT_INDEXES = """
+    INDEX msg_ngram msg TYPE ngrambf_v1(3, 65536, 3, 0) GRANULARITY 1,
+    INDEX msg_lower_ngram lower(msg) TYPE ngrambf_v1(3, 65536, 3, 0) GRANULARITY 1,
+    INDEX logline_token logline TYPE tokenbf_v1(65536, 3, 0) GRANULARITY 1
+"""
+
+def create_table_sql(table, columns, optimized_columns, profile=DEFAULT_PROFILE, if_not_exists=False):
+    """
+    Returns the CREATE TABLE statement of a log table in the given schema profile.
+    """
+    create = "CREATE TABLE IF NOT EXISTS" if if_not_exists else "CREATE TABLE"
+    if profile == "plain":
+        # We're using a MergeTree engine and ordering by the timestamp, then the
+        # position of the record in its file, to keep the order of lines within a second.
+        return f"""
+            {create} {table} (
+                {columns}
+            ) ENGINE = MergeTree()
+            ORDER BY (timestamp, seq)
+        """
+    return f"""
+        {create} {table} (
+            {optimized_columns.rstrip().rstrip(",")},
+            {TEXT_INDEXES}
+        ) ENGINE = MergeTree()
+        PARTITION BY toYYYYMM(timestamp)
+        ORDER BY (timestamp, seq)
+    """
+
+def create_table(client, table, loader, profile=DEFAULT_PROFILE, if_not_exists=False):
+    """
+    Creates the table of a load_*.py loader module in the given schema profile,
+    along with its per-minute rollup (see rollups.py).
+    """
+    client.execute(create_table_sql(table, loader.COLUMNS, loader.OPTIMIZED_COLUMNS, profile, if_not_exists))
+    create_rollup(client, table, loader.ROLLUP_KEYS)
+
+def add_schema_arg(parser):
+    """
+    Adds the --schema option.
+    """
+    parser.add_argument("--schema", choices=PROFILES, default=DEFAULT_PROFILE,
+                        help=f"Schema profile of the created table (default: {DEFAULT_PROFILE})")
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Server-side time shifting for the log loaders.
+
+Instead of decoding and rewriting every record in Python:
+  • The gzip-compressed JSONL (or Parquet) file is streamed as-is to ClickHouse's
+    HTTP interface as an INSERT ... FORMAT JSONEachRow (or Parquet) into a staging
+    table. ClickHouse decompresses and parses it. The staging table uses the Log
+    engine, which keeps the rows in file order.
+  • The shift needed to move the maximum timestamp to 'now' is computed from
+    the staging table.
+  • A single INSERT ... SELECT copies the staging table into the final table,
+    adding the shift to the timestamps and rewriting the dates embedded in
+    logline/msg with ClickHouse string and date functions. It runs in a single
+    thread so that rowNumberInAllBlocks() numbers the rows in file order (seq).
+  • The staging table is dropped.
+
+The helpers below build the SQL expressions shared by the loaders.
+"""
+
+import os
+import urllib.error
+import urllib.request
+
+from connection import DEFAULT_HTTP
+from instrumentation import NO_METRICS
+
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+MONTH_PATTERN = "|".join(MONTHS)
+WEEKDAY_PATTERN = "Mon|Tue|Wed|Thu|Fri|Sat|Sun"
+
+# Microseconds in the dateDiff units used for the shift
+UNIT_MICROSECONDS = {"second": 1000000, "microsecond": 1}
+
+# seq of the rows copied from a staging table, which is read in file order
+FILE_ORDER_SEQ = "rowNumberInAllBlocks()"
+
+def sql_string(value):
+    """
+    Quotes a Python string as a ClickHouse string literal.
+    """
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+def make_datetime_sql(year, month_name, day, hour, minute, second):
+    """
+    Builds a DateTime from string SQL expressions; month_name is "Jan".."Dec".
+    """
+    months = "[" + ", ".join(sql_string(month) for month in MONTHS) + "]"
+    return (f"makeDateTime(toUInt16({year}), indexOf({months}, {month_name}), toUInt8({day}), "
+            f"toUInt8({hour}), toUInt8({minute}), toUInt8({second}))")
+
+def padded_day_sql(dt):
+    """
+    Formats the day of a DateTime SQL expression like syslog does: "Jan  3", "Jan 13".
+    Returns the month name, the padding and the day.
+    """
+    return f"concat(formatDateTime({dt}, '%b'), if(toDayOfMonth({dt}) < 10, '  ', ' '), toString(toDayOfMonth({dt})))"
+
+def http_insert_file(path, table, input_format="JSONEachRow", endpoint=DEFAULT_HTTP):
+    """
+    Streams a dataset file into table through endpoint (a connection.HttpEndpoint)
+    without decoding it locally.
+    Files ending with .gz are sent with Content-Encoding: gzip for ClickHouse to decompress.
+    """
+    url = endpoint.query_url(f"INSERT INTO {table} FORMAT {input_format}", {
+        "date_time_input_format": "best_effort",
+        "input_format_skip_unknown_fields": 1,
+    })
+    headers = {
+        "Content-Length": str(os.path.getsize(path)),
+        "Content-Type": "application/octet-stream",
+        **endpoint.headers(),
+    }
+    if path.endswith(".gz"):
+        headers["Content-Encoding"] = "gzip"
+    with open(path, "rb") as f:
+        request = urllib.request.Request(url, data=f, method="POST", headers=headers)
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f"Inserting {path} into {table} failed: {e.read().decode('utf-8', 'replace')}") from e
+
+def load_server_side(client, path, table, columns, build_insert, unit="second", input_format="JSONEachRow",
+                     endpoint=DEFAULT_HTTP, metrics=NO_METRICS):
+    """
+    Loads a dataset into table (already created) through a staging table with the
+    given column definitions, streaming the file to endpoint (a connection.HttpEndpoint).
+    build_insert(staging, shift) must return the INSERT ... SELECT statement copying
+    the staging table into table, where shift is the number of units (a dateDiff
+    unit, e.g. "second") to add to the timestamps. metrics times the upload and
+    insert_select stages.
+    Returns the number of inserted rows and the shift in microseconds.
+    """
+    staging = f"{table}_staging"
+    client.execute(f"DROP TABLE IF EXISTS {staging}")
+    client.execute(f"CREATE TABLE {staging} ({columns}) ENGINE = Log")
+    try:
+        size = os.path.getsize(path)
+        metrics.add_bytes("in", size)
+        with metrics.stage("upload"):
+            http_insert_file(path, staging, input_format, endpoint)
+        metrics.add_bytes("out", size)
+
+        rows, shift = client.execute(
+            f"SELECT count(), dateDiff('{unit}', max(timestamp), now64(6)) FROM {staging}"
+        )[0]
+        if rows == 0:
+            print("No records found in the file!")
+            return 0, 0
+
+        with metrics.stage("insert_select", rows):
+            client.execute(build_insert(staging, shift), settings={"max_threads": 1})
+        return rows, shift * UNIT_MICROSECONDS[unit]
+    finally:
+        client.execute(f"DROP TABLE IF EXISTS {staging}")
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+This script:
+  • Learns a model of a log source from its bundled gzip-compressed JSONL dataset:
+      - message templates: the loglines without their date, with IP addresses,
+        numbers, user names and embedded dates replaced by placeholders,
+        weighted by how often they occur,
+      - the frequencies of IP addresses and user names,
+      - the inter-arrival times between consecutive records.
+    Sources, severities, threads and hostnames are part of the templates, so they
+    keep their joint distribution with the messages.
+  • Generates arbitrarily many realistic log lines from the model and parses them
+    with the process_*.py converter, so the records are exactly what the
+    converter would have produced.
+  • Splits the rows into units of --batch-size rows. Every unit is generated from
+    its own random generator seeded with (--seed, unit number) and starts at a
+    fixed time, so the output only depends on the seed, not on --jobs.
+  • Streams the units in parallel straight into ClickHouse with the loader's
+    to_columns (shifting the dates so that the last row is 'now'), or writes them
+    in order to a gzip-compressed JSONL file with --output.
+
+Example:
+  python synthetic.py apache --rows 100000000 --jobs 16 --seed 42
+"""
+
+import argparse
+import collections
+import datetime
+import gzip
+import importlib
+import itertools
+import json
+import os
+import random
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from common import DEFAULT_BATCH_SIZE, iter_records, list_columns, numpy_columns
+from connection import add_connection_args, connect
+from fingerprints import forget_fingerprint
+from rollups import drop_rollup
+from schemas import add_schema_arg, create_table
+from timeshift import MICROSECONDS, SECONDS, TimeShifter
+from virtual_shift import drop_raw_table
+
+SOURCES = ["apache", "hadoop", "linux", "openssh"]
+
+# The date each logline starts with, per source
+LOGLINE_DATE_PATTERNS = {
+    "apache": re.compile(r'^\[[^\]]+\]'),
+    "hadoop": re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}'),
+    "linux": re.compile(r'^(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+\d{1,2} \d{2}:\d{2}:\d{2}'),
+    "openssh": re.compile(r'^(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+\d{1,2} \d{2}:\d{2}:\d{2}'),
+}
+
+# Parts of the loglines replaced by placeholders, in this order
+EMBEDDED_DATE_PATTERN = re.compile(r'(Mon|Tue|Wed|Thu|Fri|Sat|Sun) (Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+\d{1,2} \d{2}:\d{2}:\d{2} \d{4}')
+IP_PATTERN = re.compile(r'\b(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\b')
+NUMBER_PATTERN = re.compile(r'\b\d+\b')
+
+# Placeholders are delimited with NUL characters, which never occur in the logs
+PLACEHOLDER_PATTERN = re.compile(r'\x00(\w+)\x00')
+
+# Maximum number of inter-arrival times kept in a model
+MAX_GAPS = 100000
+
+def format_logline_date(source, dt):
+    """
+    Formats the date a logline of the given source starts with.
+    """
+    if source == "apache":
+        return f"[{dt.strftime('%a %b %d %H:%M:%S %Y')}]"
+    if source == "hadoop":
+        return dt.strftime("%Y-%m-%d %H:%M:%S,%f")[:-3]
+    # Syslog pads the day with a space, e.g., "Jun  9 06:06:20"
+    return f"{dt.strftime('%b')} {dt.day:2d} {dt.strftime('%H:%M:%S')}"
+
+def make_template(text, user=None):
+    """
+    Replaces the variable parts of a logline (without its date) with placeholders.
+    """
+    text = EMBEDDED_DATE_PATTERN.sub("\x00date\x00", text)
+    text = IP_PATTERN.sub("\x00ip\x00", text)
+    if user:
+        text = re.sub(r'(?<=\s|=)' + re.escape(user) + r'\b', "\x00user\x00", text)
+    return NUMBER_PATTERN.sub(lambda match: f"\x00n{len(match.group(0))}\x00", text)
+
+def learn(source, path):
+    """
+    Learns the model of a source from a gzip-compressed JSONL dataset.
+    Returns a JSON-serializable dict.
+    """
+    date_pattern = LOGLINE_DATE_PATTERNS[source]
+    templates = collections.Counter()
+    ips = collections.Counter()
+    users = collections.Counter()
+    gaps = []
+    # Reservoir sampling of the inter-arrival times, with a fixed seed
+    rng = random.Random(0)
+    prev = min_timestamp = None
+    gap_count = 0
+
+    for record in iter_records(path):
+        timestamp = datetime.datetime.fromisoformat(record["timestamp"])
+        if prev is not None:
+            # Out of order records count as simultaneous
+            gap = max((timestamp - prev).total_seconds(), 0.0)
+            gap_count += 1
+            if len(gaps) < MAX_GAPS:
+                gaps.append(gap)
+            else:
+                index = rng.randrange(gap_count)
+                if index < MAX_GAPS:
+                    gaps[index] = gap
+        prev = timestamp
+        if (min_timestamp is None) or (timestamp < min_timestamp):
+            min_timestamp = timestamp
+
+        logline = record["logline"]
+        match = date_pattern.match(logline)
+        if not match:
+            continue
+        templates[make_template(logline[match.end():], record.get("user"))] += 1
+        ips.update(IP_PATTERN.findall(logline))
+        if record.get("user"):
+            users[record["user"]] += 1
+
+    if not templates:
+        raise ValueError(f"No records found in {path}")
+    return {
+        "source": source,
+        "start": min_timestamp.isoformat(),
+        "templates": templates.most_common(),
+        "ips": ips.most_common() or [["127.0.0.1", 1]],
+        "users": users.most_common() or [["root", 1]],
+        "gaps": sorted(gaps) or [1.0],
+    }
+
+class Generator:
+    """
+    Generates log lines and records from a model learnt by learn().
+    """
+
+    def __init__(self, model):
+        self.source = model["source"]
+        self.converter = importlib.import_module(f"process_{self.source}")
+        self.start = datetime.datetime.fromisoformat(model["start"])
+        self.templates, self.template_weights = self.cumulative(model["templates"])
+        self.ips, self.ip_weights = self.cumulative(model["ips"])
+        self.users, self.user_weights = self.cumulative(model["users"])
+        self.gaps = model["gaps"]
+        self.mean_gap = sum(self.gaps) / len(self.gaps)
+
+    @staticmethod
+    def cumulative(counts):
+        values = [value for value, _ in counts]
+        return values, list(itertools.accumulate(count for _, count in counts))
+
+    def render(self, template, rng, dt):
+        """
+        Fills the placeholders of a template.
+        """
+        def fill(match):
+            name = match.group(1)
+            if name == "ip":
+                return rng.choices(self.ips, cum_weights=self.ip_weights)[0]
+            if name == "user":
+                return rng.choices(self.users, cum_weights=self.user_weights)[0]
+            if name == "date":
+                return f"{dt.strftime('%a %b')} {dt.day:2d} {dt.strftime('%H:%M:%S %Y')}"
+            # A number with the same number of digits as the original one
+            digits = int(name[1:])
+            return str(rng.randrange(10 ** (digits - 1) if digits > 1 else 0, 10 ** digits))
+
+        return PLACEHOLDER_PATTERN.sub(fill, template)
+
+    def unit_start(self, unit, unit_size):
+        """
+        Returns the time the given unit starts at, spacing the units by the mean inter-arrival time.
+        """
+        return self.start + datetime.timedelta(seconds=unit * unit_size * self.mean_gap)
+
+    def end(self, rows):
+        """
+        Returns the (approximate) time of the last of rows generated rows.
+        """
+        return self.start + datetime.timedelta(seconds=rows * self.mean_gap)
+
+    def records(self, seed, unit, unit_size, rows):
+        """
+        Generates the records of a unit of rows rows. They are numbered (seq) by
+        their position in the whole generated log, like the converters do.
+        """
+        rng = random.Random(f"{self.source}:{seed}:{unit}")
+        dt = self.unit_start(unit, unit_size)
+        templates = rng.choices(self.templates, cum_weights=self.template_weights, k=rows)
+        gaps = rng.choices(self.gaps, k=rows)
+
+        records = []
+        for i, (template, gap) in enumerate(zip(templates, gaps)):
+            dt += datetime.timedelta(seconds=gap)
+            line = format_logline_date(self.source, dt) + self.render(template, rng, dt)
+            if self.source in ("linux", "openssh"):
+                record, _ = self.converter.parse_log_line(line, dt.year)
+            else:
+                record = self.converter.parse_log_line(line)
+            if record:
+                record.seq = unit * unit_size + i
+                records.append(record)
+        return records
+
+# Per-process state of the pool workers
+worker = {}
+
+def init_worker(model, args, shifter):
+    worker["generator"] = Generator(model)
+    worker["args"] = args
+    if shifter is not None:
+        loader = importlib.import_module(f"load_{model['source']}")
+        worker["loader"] = loader
+        worker["shifter"] = shifter
+        if model["source"] == "linux":
+            worker["rewriter"] = loader.date_rewriters(shifter.timedelta)
+        else:
+            worker["rewriter"] = loader.logline_rewriter(shifter.timedelta)
+        worker["client"] = connect(args)
+
+def unit_rows(unit, args):
+    return min(args.batch_size, args.rows - unit * args.batch_size)
+
+def generate_unit(unit):
+    """
+    Generates the records of a unit in a worker.
+    """
+    args = worker["args"]
+    return worker["generator"].records(args.seed, unit, args.batch_size, unit_rows(unit, args))
+
+def insert_unit(unit):
+    """
+    Generates a unit in a worker and inserts it into ClickHouse. Returns the number of rows.
+    """
+    args = worker["args"]
+    records = generate_unit(unit)
+    loader = worker["loader"]
+    columns = loader.to_columns(records, worker["shifter"], worker["rewriter"])
+    query = f"INSERT INTO {args.table} VALUES"
+    if args.numpy:
+        worker["client"].execute(query, numpy_columns(columns, loader.COLUMN_DTYPES), columnar=True,
+                                 settings={"use_numpy": True})
+    else:
+        worker["client"].execute(query, list_columns(columns), columnar=True)
+    return len(records)
+
+def ordered_map(executor, function, items, window):
+    """
+    Like executor.map, but with at most window items in flight, so that results
+    don't pile up in memory when they're consumed slower than they're produced.
+    """
+    items = iter(items)
+    pending = collections.deque(executor.submit(function, item) for item in itertools.islice(items, window))
+    while pending:
+        result = pending.popleft().result()
+        for item in itertools.islice(items, 1):
+            pending.append(executor.submit(function, item))
+        yield result
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic logs learnt from a bundled dataset.")
+    parser.add_argument("source", choices=SOURCES, help="Log source to generate")
+    parser.add_argument("--rows", type=int, required=True, help="Number of rows to generate")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated data (default: 0)")
+    parser.add_argument("--jobs", type=int, default=None, help="Number of generator processes (default: one per CPU core)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Number of rows per generated unit and INSERT (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--learn-from", help="Dataset to learn from instead of the bundled one")
+    parser.add_argument("--output", help="Write a gzip-compressed JSONL file instead of inserting into ClickHouse")
+    parser.add_argument("--table", help="Table to insert into (default: <source>_logs), dropped and recreated")
+    parser.add_argument("--numpy", action="store_true", help="Insert columns as NumPy arrays")
+    add_schema_arg(parser)
+    add_connection_args(parser)
+    args = parser.parse_args()
+
+    loader = importlib.import_module(f"load_{args.source}")
+    args.table = args.table or f"{args.source}_logs"
+    model = learn(args.source, args.learn_from or loader.DATASET)
+    print(f"Learnt {len(model['templates'])} templates from {args.learn_from or loader.DATASET}.")
+
+    jobs = args.jobs or os.cpu_count()
+    units = range((args.rows + args.batch_size - 1) // args.batch_size)
+    if args.output:
+        with ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(model, args, None)) as executor, \
+                gzip.open(args.output, "wt", encoding="utf-8") as outf:
+            total = 0
+            # Write the units in their original order
+            for records in ordered_map(executor, generate_unit, units, 2 * jobs):
+                for record in records:
+                    outf.write(json.dumps(record.to_dict()) + "\n")
+                total += len(records)
+        print(f"Wrote {total} rows to {args.output}.")
+        return
+
+    client = connect(args)
+    # The table won't hold the dataset as loaded (see fingerprints.py)
+    forget_fingerprint(client, args.table)
+    drop_rollup(client, args.table)
+    client.execute(f"DROP TABLE IF EXISTS {args.table}")
+    drop_raw_table(client, args.table)
+    create_table(client, args.table, loader, args.schema)
+
+    # Shift the dates so that the (approximate) last generated row becomes 'now'
+    end = Generator(model).end(args.rows)
+    if args.source == "hadoop":
+        shifter = TimeShifter(end.isoformat(), MICROSECONDS)
+    else:
+        shifter = TimeShifter(end.replace(microsecond=0).isoformat(), SECONDS)
+
+    with ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(model, args, shifter)) as executor:
+        total = sum(executor.map(insert_unit, units))
+    print(f"Inserted {total} rows into ClickHouse.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Parsing of syslog-style logs (process_linux.py, process_openssh.py), sequentially
+or in parallel chunks.
+
+Syslog timestamps have no year: the converters start from a given year and bump
+it whenever the month goes from Dec to Jan. This is sequential state, so the
+parallel mode works in two passes:
+  • The input file is split into byte ranges aligned to line boundaries and the
+    chunks are parsed in a process pool. The year of a chunk isn't known yet, so
+    its records are parsed in PARSE_YEAR, a leap year (Feb 29 parses whatever
+    the real year), and the worker returns where its Dec to Jan transitions are.
+  • The chunks are collected in their original order. The real year of each
+    chunk is known from the year and month of the previous chunk's last record
+    and the month of its first record, and the years of its timestamps are set
+    from it.
+"""
+
+import calendar
+import collections
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Size of the byte ranges parsed by the workers.
+DEFAULT_CHUNK_SIZE = 64 << 20
+
+# Leap year in which the workers parse the records, before their year is known
+PARSE_YEAR = 2000
+
+def print_parse_error(line):
+    print("Parsing error:", line)
+
+def parse_lines(parse_log_line, lines, year, on_error=print_parse_error, prev_month=None):
+    """
+    Parses log lines with parse_log_line(line, year) starting in the given year,
+    bumping the year on every Dec to Jan transition.
+    prev_month is the month of the line preceding lines, when resuming a log.
+    Yields the parsed records and calls on_error for the lines that don't parse.
+    """
+    current_year = year
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue  # skip empty lines
+
+        parsed_log, current_month = parse_log_line(line, current_year)
+        if parsed_log and current_month:
+            # Check for year transition (Dec to Jan indicates year change)
+            if prev_month == "Dec" and current_month == "Jan":
+                current_year += 1
+                # Re-parse the log with the updated year
+                parsed_log, _ = parse_log_line(line, current_year)
+
+            yield parsed_log
+            prev_month = current_month
+        else:
+            on_error(line)
+
+def chunk_ranges(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Splits a file into (start, end) byte ranges of about chunk_size bytes,
+    every range starting at the beginning of a line.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_size, size))
+            # Move the end of the chunk to the end of the line it falls in
+            f.readline()
+            end = min(f.tell(), size)
+            yield start, end
+            start = end
+
+def read_lines(path, start, end):
+    """
+    Yields the decoded lines of a byte range of a file.
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        position = start
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line.decode("utf-8")
+
+def parse_chunk(parse_log_line, path, start, end):
+    """
+    Parses a byte range of a file in a worker process, in PARSE_YEAR.
+    Returns the records, the indexes of the records following a Dec to Jan
+    transition (which start a new year) and the lines that couldn't be parsed.
+    """
+    records, year_starts, errors = [], [], []
+    prev_month = None
+    for line in read_lines(path, start, end):
+        line = line.strip()
+        if not line:
+            continue  # skip empty lines
+
+        parsed_log, current_month = parse_log_line(line, PARSE_YEAR)
+        if parsed_log and current_month:
+            if prev_month == "Dec" and current_month == "Jan":
+                year_starts.append(len(records))
+            records.append(parsed_log)
+            prev_month = current_month
+        else:
+            errors.append(line)
+    return records, year_starts, errors
+
+def record_month(record):
+    """
+    Returns the month number of a parsed record's ISO-8601 timestamp.
+    """
+    return int(record.timestamp[5:7])
+
+def set_years(records, year_starts, year):
+    """
+    Sets the year of the timestamps of records parsed by parse_chunk, in place:
+    year up to the first of year_starts, the next year up to the second, etc.
+    Raises ValueError for Feb 29 of a year that isn't a leap year, as parsing the
+    line in that year does.
+    """
+    bounds = [0, *year_starts, len(records)]
+    for record_year, begin, end in zip(range(year, year + len(bounds)), bounds, bounds[1:]):
+        prefix = f"{record_year:04d}"
+        leap = calendar.isleap(record_year)
+        for record in records[begin:end]:
+            timestamp = record.timestamp
+            if not leap and timestamp[5:10] == "02-29":
+                raise ValueError(f"day is out of range for month: {prefix}{timestamp[4:]}")
+            record.timestamp = prefix + timestamp[4:]
+
+def parse_parallel(parse_log_line, path, year, jobs, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Parses a log file in chunks with a pool of jobs processes.
+    Yields the records in the original order with the same years as parse_lines.
+    """
+    ranges = chunk_ranges(path, chunk_size)
+    # Year and month of the last record of the previous chunk
+    prev_year, prev_month = year, None
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        # Keep a bounded number of chunks in flight so that memory use doesn't
+        # depend on the size of the input.
+        pending = collections.deque()
+
+        def submit_next():
+            chunk = next(ranges, None)
+            if chunk is not None:
+                pending.append(executor.submit(parse_chunk, parse_log_line, path, *chunk))
+
+        for _ in range(2 * jobs):
+            submit_next()
+
+        while pending:
+            records, year_starts, errors = pending.popleft().result()
+            submit_next()
+
+            for line in errors:
+                print_parse_error(line)
+            if not records:
+                continue
+
+            # Reconcile the year: the chunk starts in the previous chunk's last
+            # year, or in the next one if it crosses a Dec to Jan transition.
+            start_year = prev_year + (1 if (prev_month == 12 and record_month(records[0]) == 1) else 0)
+            set_years(records, year_starts, start_year)
+
+            prev_year, prev_month = start_year + len(year_starts), record_month(records[-1])
+            yield from records
+
+def parse_file(parse_log_line, path, year, jobs=1):
+    """
+    Parses a log file sequentially (jobs == 1) or in parallel, starting in year.
+    jobs == 0 uses one process per CPU core.
+    """
+    jobs = jobs or os.cpu_count()
+    if jobs == 1:
+        with open(path, "r") as inf:
+            yield from parse_lines(parse_log_line, inf, year)
+    else:
+        yield from parse_parallel(parse_log_line, path, year, jobs)
+
+def add_jobs_arg(parser):
+    """
+    Adds the --jobs option to a converter.
+    """
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Number of parser processes (default: 1, 0 for one per CPU core)")
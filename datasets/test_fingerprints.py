@@ -0,0 +1,42 @@
+import argparse
+import json
+import os
+import unittest
+
+from fingerprints import dataset_fingerprint
+from windows import parse_duration
+
+DATASETS = os.path.dirname(os.path.abspath(__file__))
+
+def load_args(**options):
+    values = dict(schema="plain", since=None, until=None, sample=1.0, virtual_shift=False,
+                  enrich_ips=False, ips=os.path.join(DATASETS, "ips.jsonl.gz"))
+    values.update(options)
+    return argparse.Namespace(**values)
+
+class DatasetFingerprintTest(unittest.TestCase):
+    path = os.path.join(DATASETS, "linux.jsonl.gz")
+
+    def options(self, args, enrich_ips=False):
+        return json.loads(dataset_fingerprint(self.path, args, enrich_ips)["options"])
+
+    def test_options(self):
+        self.assertEqual(self.options(load_args()), {"schema": "plain"})
+        self.assertEqual(self.options(load_args(schema="optimized", since=parse_duration("3d"), sample=0.5,
+                                                virtual_shift=True)),
+                         {"schema": "optimized", "since": "3 days, 0:00:00", "sample": 0.5, "virtual_shift": True})
+
+    def test_ip_enrichment(self):
+        # load_all.py passes --enrich-ips to every loader, only openssh_logs depends on it
+        args = load_args(enrich_ips=True)
+        self.assertNotIn("ips", self.options(args))
+        self.assertEqual(len(self.options(args, enrich_ips=True)["ips"]), 64)
+
+    def test_without_options(self):
+        fingerprint = dataset_fingerprint(self.path)
+        self.assertEqual(fingerprint["source"], self.path)
+        self.assertEqual(json.loads(fingerprint["options"]), {})
+        self.assertEqual(fingerprint["sha256"], dataset_fingerprint(self.path, load_args())["sha256"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import frames as frames_module
+from frames import FrameWriter, read_frame, scan_frames
+from metadata import read_metadata, scan_frame_stats
+
+DATASETS = os.path.dirname(os.path.abspath(__file__))
+
+def lines(count):
+    return [f'{{"n": {n}, "msg": "line {n}"}}\n'.encode("utf-8") for n in range(count)]
+
+class FramesTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".jsonl.gz")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write(self, data, frame_rows, threads=2):
+        writer = FrameWriter(self.path, frame_rows=frame_rows, threads=threads)
+        for line in data:
+            writer.write_line(line)
+        writer.close()
+        return writer.frames
+
+    def test_round_trip(self):
+        data = lines(1050)
+        frames = self.write(data, 100)
+        self.assertEqual([frame["rows"] for frame in frames], [100] * 10 + [50])
+        with open(self.path, "rb") as f:
+            content = b"".join(read_frame(f, frame) for frame in frames)
+        self.assertEqual(content, b"".join(data))
+
+    def test_read_as_single_gzip_file(self):
+        data = lines(1050)
+        self.write(data, 100, threads=4)
+        with gzip.open(self.path, "rb") as f:
+            self.assertEqual(f.read(), b"".join(data))
+
+    def test_index_covers_file(self):
+        frames = self.write(lines(1050), 100)
+        offset = 0
+        for frame in frames:
+            self.assertEqual(frame["offset"], offset)
+            offset += frame["size"]
+        self.assertEqual(offset, os.path.getsize(self.path))
+
+    def test_scan_frames(self):
+        frames = self.write(lines(1050), 100)
+        scanned = scan_frames(self.path)
+        self.assertEqual(scanned, [{key: frame[key] for key in ("offset", "size", "rows")} for frame in frames])
+
+    def test_scan_small_blocks(self):
+        # Frames spanning several blocks, and blocks holding the end of one frame and the start of the next
+        frames = self.write(lines(1050), 100)
+        expected = scan_frames(self.path)
+        for block_size in (1, 7, 1000):
+            with mock.patch.object(frames_module, "SCAN_BLOCK_SIZE", block_size):
+                self.assertEqual(scan_frames(self.path), expected, block_size)
+
+    def test_scan_single_stream(self):
+        data = lines(1050)
+        with gzip.open(self.path, "wb") as f:
+            f.write(b"".join(data))
+        self.assertEqual(scan_frames(self.path), [{"offset": 0, "size": os.path.getsize(self.path), "rows": 1050}])
+
+    def test_empty(self):
+        self.assertEqual(self.write([], 100), [])
+        self.assertEqual(os.path.getsize(self.path), 0)
+        self.assertEqual(scan_frames(self.path), [])
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.directory.name, "input.log")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def frames(self, content, output):
+        with open(self.input, "w") as f:
+            f.write(content)
+        output = os.path.join(self.directory.name, output)
+        result = subprocess.run([sys.executable, os.path.join(DATASETS, "frames.py"), self.input, output,
+                                 "--frame-rows", "3"], capture_output=True, text=True)
+        return result, output
+
+    def test_blank_lines_of_datasets(self):
+        records = [json.dumps({"timestamp": f"2024-03-01T00:00:0{n}", "n": n}) for n in range(7)]
+        content = "\n".join(records[:2]) + "\n\n  \n" + "\n".join(records[2:]) + "\n\n"
+        result, output = self.frames(content, "dataset.jsonl.gz")
+        self.assertEqual(result.returncode, 0, result.stderr)
+        metadata = read_metadata(output)
+        self.assertEqual(metadata["rows"], 7)
+        self.assertEqual([frame["rows"] for frame in metadata["frames"]], [3, 3, 1])
+        self.assertEqual(scan_frame_stats(output)[1], metadata["frames"])
+        with gzip.open(output, "rt") as f:
+            self.assertEqual(f.read(), "\n".join(records) + "\n")
+
+    def test_scan_blank_lines(self):
+        # Datasets written before blank lines were left out of the frames
+        path = os.path.join(self.directory.name, "blank.jsonl.gz")
+        writer = FrameWriter(path, frame_rows=3)
+        for line in ('{"timestamp": "2024-03-01T00:00:00"}\n', "\n", '{"timestamp": "2024-03-01T00:00:01"}\n'):
+            writer.write_line(line.encode("utf-8"))
+        writer.close()
+        stats, frames = scan_frame_stats(path)
+        self.assertEqual(stats.rows, 2)
+        self.assertEqual(sum(frame["rows"] for frame in frames), 2)
+
+    def test_not_json(self):
+        result, output = self.frames('{"timestamp": "2024-03-01T00:00:00"}\nnot json\n', "dataset.jsonl.gz")
+        self.assertEqual(result.returncode, 2)
+        self.assertIn("line 2", result.stderr)
+        self.assertFalse(os.path.exists(output))
+        self.assertFalse(os.path.exists(output + ".meta.json"))
+
+    def test_other_files(self):
+        content = "not json\n\nlast line"
+        result, output = self.frames(content, "mgbench.log.gz")
+        self.assertEqual(result.returncode, 0, result.stderr)
+        with gzip.open(output, "rt") as f:
+            self.assertEqual(f.read(), content + "\n")
+        self.assertFalse(os.path.exists(output + ".meta.json"))
+
+if __name__ == "__main__":
+    unittest.main()
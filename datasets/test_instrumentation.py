@@ -0,0 +1,50 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from instrumentation import uses_name
+
+DATASETS = os.path.dirname(os.path.abspath(__file__))
+
+LOG_LINES = [
+    "[Sun Dec 04 04:47:44 2005] [notice] workerEnv.init() ok /etc/httpd/conf/workers2.properties",
+    "[Sun Dec 04 04:47:44 2005] [error] mod_jk child workerEnv in error state 6",
+    "not an apache log line",
+]
+
+def instrumentation_args(metrics=None, prometheus=None, profile=None):
+    return argparse.Namespace(metrics=metrics, prometheus=prometheus, profile=profile)
+
+class UsesNameTest(unittest.TestCase):
+    def test_uses_name(self):
+        self.assertTrue(uses_name(instrumentation_args()))
+        self.assertTrue(uses_name(instrumentation_args("m/{name}.json", "p/{name}.prom")))
+        self.assertFalse(uses_name(instrumentation_args("m/{name}.json", "p/loads.prom")))
+
+    def test_stdout(self):
+        # The reports of several datasets can't all go to stdout
+        self.assertFalse(uses_name(instrumentation_args("-")))
+
+class ReportToStdoutTest(unittest.TestCase):
+    def test_only_report_on_stdout(self):
+        with tempfile.TemporaryDirectory() as directory:
+            log = os.path.join(directory, "apache.log")
+            with open(log, "w") as f:
+                f.write("\n".join(LOG_LINES) + "\n")
+            result = subprocess.run(
+                [sys.executable, os.path.join(DATASETS, "process_apache.py"), log,
+                 os.path.join(directory, "apache.jsonl.gz"), "--metrics", "-"],
+                capture_output=True, text=True, check=True)
+        report = json.loads(result.stdout)
+        self.assertEqual(report["script"], "process_apache")
+        self.assertEqual(report["rows"], 2)
+        # The parsing error and the summary are printed to stderr
+        self.assertIn("Parsing error: not an apache log line", result.stderr)
+        self.assertIn("2 rows in", result.stderr)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from ip_lookup import ENRICHMENT_FIELDS, IpLookup, empty_columns, ipv4_to_int
+
+RECORDS = [
+    {"ip": "5.36.59.76", "country_short": "OM", "country_long": "Oman", "asn": "28885", "hostname": None},
+    {"ip": "0.0.0.0", "country_short": "ZZ", "country_long": "Unknown", "asn": None, "hostname": None},
+    {"ip": "255.255.255.255", "country_short": "ZZ", "country_long": "Unknown", "asn": None, "hostname": "broadcast"},
+    {"ip": "173.234.31.186", "country_short": "US", "country_long": "United States of America", "asn": "15003", "hostname": None},
+    {"ip": "2001:db8::1", "country_short": "NL", "country_long": "Netherlands", "asn": "1", "hostname": None},
+    {"ip": "not an ip", "country_short": "NL", "country_long": "Netherlands", "asn": "1", "hostname": None},
+    # A later record of the same address wins
+    {"ip": "5.36.59.76", "country_short": "OM", "country_long": "Oman", "asn": "28885", "hostname": "later"},
+]
+
+def enrichment(record):
+    return [record[field] for field in ENRICHMENT_FIELDS]
+
+def rows(columns):
+    return [list(row) for row in zip(*columns)]
+
+class IpLookupTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        fd, cls.path = tempfile.mkstemp(suffix=".jsonl.gz")
+        os.close(fd)
+        with gzip.open(cls.path, "wt", encoding="utf-8") as f:
+            for record in RECORDS:
+                f.write(json.dumps(record) + "\n")
+        cls.lookup = IpLookup.from_file(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+
+    def test_ipv4_to_int(self):
+        self.assertEqual(ipv4_to_int("0.0.0.0"), 0)
+        self.assertEqual(ipv4_to_int("255.255.255.255"), 2 ** 32 - 1)
+        self.assertEqual(ipv4_to_int("1.2.3.4"), 0x01020304)
+        for ip in (None, "", "1.2.3", "256.1.1.1", "::1", "::ffff:1.2.3.4", " 1.2.3.4"):
+            self.assertIsNone(ipv4_to_int(ip), ip)
+
+    def test_only_ipv4_addresses(self):
+        self.assertEqual(len(self.lookup), 4)
+        self.assertEqual(self.lookup.addresses.tolist(), sorted(self.lookup.addresses.tolist()))
+
+    def test_known_addresses(self):
+        ips = ["173.234.31.186", "5.36.59.76", "173.234.31.186"]
+        self.assertEqual(rows(self.lookup.columns(ips)),
+                         [enrichment(RECORDS[3]), enrichment(RECORDS[6]), enrichment(RECORDS[3])])
+
+    def test_first_and_last_addresses(self):
+        self.assertEqual(rows(self.lookup.columns(["0.0.0.0", "255.255.255.255"])),
+                         [enrichment(RECORDS[1]), enrichment(RECORDS[2])])
+
+    def test_missing_addresses(self):
+        # Before, between and after the known addresses, including past the last one
+        ips = ["0.0.0.1", "5.36.59.75", "5.36.59.77", "255.255.255.254"]
+        self.assertEqual(self.lookup.columns(ips), empty_columns(len(ips)))
+
+    def test_null_and_invalid_ips(self):
+        ips = [None, "", "not an ip", "999.1.1.1"]
+        self.assertEqual(self.lookup.columns(ips), empty_columns(len(ips)))
+
+    def test_ipv6(self):
+        ips = ["2001:db8::1", "::", "::ffff:5.36.59.76"]
+        self.assertEqual(self.lookup.columns(ips), empty_columns(len(ips)))
+
+    def test_mixed_batch(self):
+        ips = ["::1", "5.36.59.76", None, "255.255.255.255", "5.36.59.77"]
+        self.assertEqual(rows(self.lookup.columns(ips)),
+                         [[None] * 4, enrichment(RECORDS[6]), [None] * 4, enrichment(RECORDS[2]), [None] * 4])
+
+    def test_empty_batch(self):
+        self.assertEqual(self.lookup.columns([]), empty_columns(0))
+
+    def test_empty_dataset(self):
+        fd, path = tempfile.mkstemp(suffix=".jsonl.gz")
+        os.close(fd)
+        try:
+            with gzip.open(path, "wt", encoding="utf-8") as f:
+                f.write(json.dumps(RECORDS[4]) + "\n")
+            lookup = IpLookup.from_file(path)
+            self.assertEqual(len(lookup), 0)
+            self.assertEqual(lookup.columns(["5.36.59.76", None]), empty_columns(2))
+        finally:
+            os.remove(path)
+
+if __name__ == "__main__":
+    unittest.main()
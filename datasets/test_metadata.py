@@ -0,0 +1,85 @@
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from frames import FrameWriter
+from metadata import dataset_frames, line_timestamp, read_metadata, scan_frame_stats, scan_stats, write_metadata
+
+START = datetime.datetime(2024, 3, 1)
+
+def record_lines(count):
+    """
+    Returns JSON lines one minute apart, with the timestamps of every block of 10
+    lines in reverse order, as in logs whose lines aren't strictly sorted.
+    """
+    lines = []
+    for n in range(count):
+        minute = n - n % 10 + 9 - n % 10
+        timestamp = (START + datetime.timedelta(minutes=minute)).isoformat()
+        lines.append((json.dumps({"timestamp": timestamp, "msg": f"line {n}"}) + "\n").encode("utf-8"))
+    return lines
+
+class FrameStatsTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".jsonl.gz")
+        os.close(fd)
+
+    def tearDown(self):
+        for path in (self.path, self.path + ".meta.json"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def write_frames(self, lines, frame_rows):
+        writer = FrameWriter(self.path, frame_rows=frame_rows)
+        for line in lines:
+            writer.write_line(line, line_timestamp(line.decode("utf-8")))
+        writer.close()
+        return writer.frames
+
+    def test_bounds_of_frames(self):
+        frames = self.write_frames(record_lines(95), 20)
+        self.assertEqual([frame["rows"] for frame in frames], [20, 20, 20, 20, 15])
+        self.assertEqual(frames[0]["min_timestamp"], "2024-03-01T00:00:00")
+        self.assertEqual(frames[0]["max_timestamp"], "2024-03-01T00:19:00")
+        # The last frame has lines 80 to 94, from the blocks of minutes 80-89 and 90-99
+        self.assertEqual(frames[-1]["min_timestamp"], "2024-03-01T01:20:00")
+        self.assertEqual(frames[-1]["max_timestamp"], "2024-03-01T01:39:00")
+
+    def test_scan_matches_writer(self):
+        lines = record_lines(95)
+        frames = self.write_frames(lines, 20)
+        stats, scanned = scan_frame_stats(self.path)
+        self.assertEqual(scanned, frames)
+        self.assertEqual(stats.rows, 95)
+        self.assertEqual(stats.min_timestamp, "2024-03-01T00:00:00")
+        self.assertEqual(stats.max_timestamp, "2024-03-01T01:39:00")
+
+    def test_single_stream(self):
+        with gzip.open(self.path, "wb") as f:
+            f.write(b"".join(record_lines(95)))
+        stats, frames = scan_frame_stats(self.path)
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0]["rows"], 95)
+        self.assertEqual(frames[0]["min_timestamp"], stats.min_timestamp)
+        self.assertEqual(frames[0]["max_timestamp"], stats.max_timestamp)
+        self.assertEqual(vars(scan_stats(self.path)), vars(stats))
+
+    def test_sidecar(self):
+        frames = self.write_frames(record_lines(95), 20)
+        self.assertIsNone(dataset_frames(self.path))
+        write_metadata(self.path, scan_stats(self.path), frames)
+        self.assertEqual(read_metadata(self.path)["max_timestamp"], "2024-03-01T01:39:00")
+        self.assertEqual(dataset_frames(self.path), frames)
+
+    def test_stale_sidecar(self):
+        frames = self.write_frames(record_lines(95), 20)
+        write_metadata(self.path, scan_stats(self.path), frames)
+        self.write_frames(record_lines(50), 20)
+        self.assertIsNone(read_metadata(self.path))
+        self.assertIsNone(dataset_frames(self.path))
+
+if __name__ == "__main__":
+    unittest.main()
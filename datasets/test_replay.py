@@ -0,0 +1,79 @@
+import datetime
+import itertools
+import os
+import unittest
+
+import load_apache
+import load_hadoop
+import load_openssh
+from append import Source
+from common import iter_records
+from records import OpensshRecord
+from replay import ScaledShifter
+from timeshift import MICROSECONDS, SECONDS
+
+DATASETS = os.path.dirname(os.path.abspath(__file__))
+
+START = datetime.datetime(2026, 10, 18, 12, 30, 15, 123456)
+
+def epoch(value, unit):
+    if unit == SECONDS:
+        return datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=int(value))
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(microseconds=int(value))
+
+def dataset_records(loader, count=2000):
+    records = iter_records(os.path.join(DATASETS, loader.DATASET), record_type=loader.RECORD_TYPE)
+    return list(itertools.islice(records, count))
+
+class ScaledShifterTest(unittest.TestCase):
+    def columns(self, name, records, speed):
+        source = Source(name, None)
+        first = datetime.datetime.fromisoformat(records[0].timestamp)
+        shifter = ScaledShifter(first, START, speed, source.unit)
+        return source.loader.to_columns(records, shifter, source.rewriters(shifter.timedelta))
+
+    def test_timestamps(self):
+        first = datetime.datetime(2005, 12, 4, 4, 47, 44)
+        shifter = ScaledShifter(first, START, 10)
+        column = shifter.shift_column(["2005-12-04T04:47:44", "2005-12-04T04:48:44", "2005-12-04T04:49:49"])
+        self.assertEqual([epoch(value, SECONDS) for value in column.tolist()], [
+            datetime.datetime(2026, 10, 18, 12, 30, 15),
+            datetime.datetime(2026, 10, 18, 12, 30, 21),
+            datetime.datetime(2026, 10, 18, 12, 30, 27),
+        ])
+        shifter = ScaledShifter(first, START, 0.5, MICROSECONDS)
+        self.assertEqual(epoch(shifter.shift_column(["2005-12-04T04:47:44.000001"])[0], MICROSECONDS),
+                         START + datetime.timedelta(microseconds=2))
+
+    def test_apache_text_follows_timestamps(self):
+        records = dataset_records(load_apache)
+        for speed in (2.5, 60, 0.5):
+            columns = self.columns("apache", records, speed)
+            timestamps, loglines = columns[0], columns[load_apache.TABLE_COLUMNS.index("logline")]
+            for value, logline in zip(timestamps.tolist(), loglines):
+                self.assertTrue(logline.startswith(epoch(value, SECONDS).strftime("[%a %b %d %H:%M:%S %Y]")), logline)
+
+    def test_hadoop_text_follows_timestamps(self):
+        records = dataset_records(load_hadoop)
+        for speed in (2.5, 60):
+            columns = self.columns("hadoop", records, speed)
+            timestamps, loglines = columns[0], columns[load_hadoop.TABLE_COLUMNS.index("logline")]
+            for value, logline in zip(timestamps.tolist(), loglines):
+                self.assertTrue(logline.startswith(epoch(value, MICROSECONDS).strftime("%Y-%m-%d %H:%M:%S,%f")[:-3]),
+                                logline)
+
+    def test_syslog_year(self):
+        # Across the end of the year and on a leap day, the text keeps the year of its own date
+        records = [
+            OpensshRecord("2023-12-31T23:59:00", "sshd", 1, "a", "Dec 31 23:59:00 LabSZ sshd[1]: a"),
+            OpensshRecord("2024-01-01T00:01:00", "sshd", 1, "b", "Jan  1 00:01:00 LabSZ sshd[1]: b"),
+            OpensshRecord("2024-02-29T00:00:00", "sshd", 1, "c", "Feb 29 00:00:00 LabSZ sshd[1]: c"),
+        ]
+        columns = self.columns("openssh", records, 1000)
+        timestamps, loglines = columns[0], columns[load_openssh.TABLE_COLUMNS.index("logline")]
+        for value, logline in zip(timestamps.tolist(), loglines):
+            date = epoch(value, SECONDS)
+            self.assertTrue(logline.startswith(f"{date:%b} {date.day:2d} {date:%H:%M:%S} "), logline)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+
+from process_linux import parse_log_line
+from syslog_chunks import parse_lines, parse_parallel
+
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+def log_lines():
+    """
+    Returns syslog lines from Nov of the first year to Mar three years later,
+    with a Feb 29 in the last year (2008 when starting in 2005).
+    """
+    lines = []
+    months = ["Nov", "Dec"] + MONTHS * 2 + MONTHS[:3]
+    for month in months:
+        for day in (1, 15, 28):
+            lines.append(f"{month} {day:2d} 10:00:00 combo sshd[42]: line {len(lines)}")
+        if month == "Feb" and len(lines) > len(MONTHS) * 3 * 2:
+            lines.append("Feb 29 11:00:00 combo sshd[42]: leap day")
+    return lines
+
+class ParseParallelTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".log")
+        with os.fdopen(fd, "w") as f:
+            f.write("\n".join(log_lines()) + "\n")
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def parse_sequential(self, year):
+        with open(self.path) as f:
+            return [record.timestamp for record in parse_lines(parse_log_line, f, year)]
+
+    def parse_parallel(self, year, chunk_size):
+        return [record.timestamp for record in parse_parallel(parse_log_line, self.path, year, 2, chunk_size)]
+
+    def test_leap_day_in_later_chunk(self):
+        expected = self.parse_sequential(2005)
+        self.assertIn("2008-02-29T11:00:00", expected)
+        self.assertEqual(expected[0], "2005-11-01T10:00:00")
+        self.assertEqual(expected[-1], "2008-03-28T10:00:00")
+        self.assertEqual(self.parse_parallel(2005, 100), expected)
+
+    def test_chunk_sizes(self):
+        expected = self.parse_sequential(2005)
+        for chunk_size in (1, 50, 333, 1 << 20):
+            self.assertEqual(self.parse_parallel(2005, chunk_size), expected, chunk_size)
+
+    def test_feb_29_of_common_year(self):
+        # Starting in 2004 puts the leap day in 2007, which the sequential parsing rejects
+        with self.assertRaises(ValueError):
+            self.parse_sequential(2004)
+        with self.assertRaises(ValueError):
+            self.parse_parallel(2004, 100)
+
+if __name__ == "__main__":
+    unittest.main()
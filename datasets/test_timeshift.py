@@ -0,0 +1,235 @@
+import datetime
+import itertools
+import os
+import re
+import unittest
+
+import numpy as np
+
+import load_apache
+import load_hadoop
+import load_linux
+import load_openssh
+from common import iter_records
+from timeshift import MICROSECONDS, SECONDS, DateRewriter, TimeShifter, UnshiftedDates, utc_now
+
+DATASETS = os.path.dirname(os.path.abspath(__file__))
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Shifts of the tests: the bundled datasets shifted to the present, across leap days and
+# year ends, and with sub-second parts
+SHIFTS = [
+    datetime.timedelta(days=7617, hours=11, minutes=3, seconds=29),
+    datetime.timedelta(days=1, seconds=-1),
+    datetime.timedelta(days=366 * 3 + 57, microseconds=999999),
+    datetime.timedelta(seconds=1, microseconds=1),
+    datetime.timedelta(0),
+]
+
+MONTH_NAMES = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+# Syslog lines for the OpenSSH rewriter, which has no bundled dataset
+OPENSSH_LINES = [
+    ("2023-12-10T06:55:46", "Dec 10 06:55:46 LabSZ sshd[24200]: reverse mapping checking getaddrinfo for ns.marryaldkfaczcz.com [173.234.31.186] failed"),
+    ("2023-12-31T23:59:58", "Dec 31 23:59:58 LabSZ sshd[24203]: Connection closed by 212.47.254.145 [preauth]"),
+    ("2024-01-03T21:20:56", "Jan  3 21:20:56 LabSZ sshd[24206]: Invalid user test9 from 52.80.34.196"),
+    ("2024-02-29T01:02:03", "Feb 29 01:02:03 LabSZ sshd[24210]: Failed password for root from 5.36.59.76 port 42393 ssh2"),
+    ("2024-03-01T00:00:00", "Mar  1 00:00:00 LabSZ sshd[24213]: message repeated 2 times: [ Dec 10 06:55:46 earlier ]"),
+    ("2024-03-01T00:00:00", "no date in this line"),
+]
+
+def dataset_records(name, count=5000):
+    """
+    Returns the first count records (dicts) of a bundled dataset.
+    """
+    return list(itertools.islice(iter_records(os.path.join(DATASETS, f"{name}.jsonl.gz")), count))
+
+def dataset_timestamps(name, count=5000):
+    """
+    Returns the timestamps of the first count records of a bundled dataset.
+    """
+    return [record["timestamp"] for record in dataset_records(name, count)]
+
+def per_row_epochs(timestamps, shift, timestamp_format, unit):
+    """
+    Shifts the timestamps one by one with datetime, as the loaders did before
+    TimeShifter, returning the epoch values ClickHouse stores.
+    """
+    epochs = []
+    for timestamp in timestamps:
+        new_dt = datetime.datetime.strptime(timestamp, timestamp_format) + shift
+        if unit == SECONDS:
+            epochs.append(int((new_dt - EPOCH).total_seconds()))
+        else:
+            epochs.append((new_dt - EPOCH) // datetime.timedelta(microseconds=1))
+    return epochs
+
+def truncated(shift, unit):
+    """
+    Returns shift truncated to the unit, as a DateTime column can't hold less than a second.
+    """
+    if unit == SECONDS:
+        return datetime.timedelta(seconds=int(shift.total_seconds()))
+    return shift
+
+# The loglines and messages shifted one by one, as the loaders did before DateRewriter
+
+def per_row_apache(logline, shift):
+    date_pattern = r'\[(Mon|Tue|Wed|Thu|Fri|Sat|Sun) (Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) \d{1,2} \d{2}:\d{2}:\d{2} \d{4}\]'
+    date_match = re.search(date_pattern, logline)
+    if not date_match:
+        return logline
+    date_str = date_match.group(0)
+    new_logline_date = datetime.datetime.strptime(date_str[1:-1], "%a %b %d %H:%M:%S %Y") + shift
+    return logline.replace(date_str, f"[{new_logline_date.strftime('%a %b %d %H:%M:%S %Y')}]")
+
+def per_row_hadoop(logline, shift):
+    date_match = re.search(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3})', logline)
+    if not date_match:
+        return logline
+    orig_date_str = date_match.group(1)
+    new_logline_date = datetime.datetime.strptime(orig_date_str, "%Y-%m-%d %H:%M:%S,%f") + shift
+    return logline.replace(orig_date_str, new_logline_date.strftime("%Y-%m-%d %H:%M:%S,%f")[:-3])
+
+def day_spaces(day):
+    return "  " if day < 10 else " "
+
+def per_row_linux(text, shift, orig_year):
+    result = text
+    unix_log_pattern = r'^(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)(\s+)(\d{1,2})\s+(\d{2}:\d{2}:\d{2})\s+(.+)$'
+    match = re.match(unix_log_pattern, result)
+    if match:
+        month_name, spaces, day_num, time_str, rest = match.groups()
+        hour, minute, second = map(int, time_str.split(':'))
+        new_dt = datetime.datetime(orig_year, MONTH_NAMES.index(month_name) + 1, int(day_num), hour, minute, second) + shift
+        result = f"{new_dt.strftime('%b')}{day_spaces(new_dt.day)}{new_dt.day} {new_dt.strftime('%H:%M:%S')} {rest}"
+
+    embedded_date_pattern = r'(Mon|Tue|Wed|Thu|Fri|Sat|Sun) (Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)(\s+)(\d{1,2}) (\d{2}:\d{2}:\d{2}) (\d{4})'
+    for match in re.finditer(embedded_date_pattern, result):
+        hour, minute, second = map(int, match.group(5).split(':'))
+        new_dt = datetime.datetime(int(match.group(6)), MONTH_NAMES.index(match.group(2)) + 1, int(match.group(4)),
+                                   hour, minute, second) + shift
+        new_date_str = (f"{new_dt.strftime('%a')} {new_dt.strftime('%b')}{day_spaces(new_dt.day)}{new_dt.day} "
+                        f"{new_dt.strftime('%H:%M:%S')} {new_dt.year}")
+        result = result.replace(match.group(0), new_date_str)
+    return result
+
+def per_row_openssh(logline, shift, year):
+    date_pattern = r'(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+(\d{1,2})\s+(\d{2}:\d{2}:\d{2})'
+    date_match = re.search(date_pattern, logline)
+    if not date_match:
+        return logline
+    hours, minutes, seconds = map(int, date_match.group(3).split(':'))
+    new_date = datetime.datetime(year, MONTH_NAMES.index(date_match.group(1)) + 1, int(date_match.group(2)),
+                                 hours, minutes, seconds) + shift
+    new_date_str = f"{new_date.strftime('%b')}{day_spaces(new_date.day)}{new_date.day} {new_date.strftime('%H:%M:%S')}"
+    return logline.replace(date_match.group(0), new_date_str)
+
+class TimeShifterTest(unittest.TestCase):
+    def check_dataset(self, name, timestamp_format, unit):
+        timestamps = dataset_timestamps(name)
+        for shift in SHIFTS:
+            shifter = TimeShifter.from_microseconds(shift // datetime.timedelta(microseconds=1), unit)
+            self.assertEqual(shifter.timedelta, truncated(shift, unit))
+            expected = per_row_epochs(timestamps, shifter.timedelta, timestamp_format, unit)
+            self.assertEqual(shifter.shift_column(timestamps).tolist(), expected, shift)
+
+    def test_seconds(self):
+        self.check_dataset("apache", "%Y-%m-%dT%H:%M:%S", SECONDS)
+        self.check_dataset("linux", "%Y-%m-%dT%H:%M:%S", SECONDS)
+
+    def test_microseconds(self):
+        self.check_dataset("hadoop", "%Y-%m-%dT%H:%M:%S.%f", MICROSECONDS)
+
+    def test_leap_day(self):
+        shifter = TimeShifter.from_microseconds(24 * 3600 * 10 ** 6)
+        self.assertEqual(shifter.shift_array(["2008-02-28T23:59:59", "2007-02-28T23:59:59"]).tolist(),
+                         [datetime.datetime(2008, 2, 29, 23, 59, 59), datetime.datetime(2007, 3, 1, 23, 59, 59)])
+
+    def test_max_timestamp_becomes_now(self):
+        for unit in (SECONDS, MICROSECONDS):
+            before = utc_now(unit)
+            shifted = TimeShifter("2015-10-17T21:48:16.337000", unit).shift_array(["2015-10-17T21:48:16.337000"])[0]
+            self.assertLessEqual(before, shifted)
+            self.assertLessEqual(shifted, utc_now(unit))
+
+    def test_microseconds_of_a_load(self):
+        shifter = TimeShifter("2005-12-04T04:47:44", SECONDS)
+        again = TimeShifter.from_microseconds(shifter.microseconds, SECONDS)
+        self.assertEqual(again.shift, shifter.shift)
+        self.assertEqual(shifter.microseconds % 10 ** 6, 0)
+
+    def test_shift_column_dtype(self):
+        column = TimeShifter.from_microseconds(0).shift_column(["1970-01-01T00:00:01"])
+        self.assertEqual(column.dtype, np.int64)
+        self.assertEqual(column.tolist(), [1])
+
+class DateRewriterTest(unittest.TestCase):
+    def shifts(self):
+        # The loaders shift the text by the shift of the timestamps
+        return [truncated(shift, SECONDS) for shift in SHIFTS if shift] + [datetime.timedelta(microseconds=1500)]
+
+    def test_apache(self):
+        loglines = [record["logline"] for record in dataset_records("apache")]
+        for shift in self.shifts():
+            rewriter = load_apache.logline_rewriter(shift)
+            shifted = [rewriter.replace_first(logline) for logline in loglines]
+            self.assertEqual(shifted, [per_row_apache(logline, shift) for logline in loglines], shift)
+            if shift >= datetime.timedelta(seconds=1):
+                self.assertNotEqual(shifted, loglines)
+
+    def test_hadoop(self):
+        loglines = [record["logline"] for record in dataset_records("hadoop")]
+        for shift in self.shifts():
+            rewriter = load_hadoop.logline_rewriter(shift)
+            shifted = [rewriter.replace_first(logline) for logline in loglines]
+            self.assertEqual(shifted, [per_row_hadoop(logline, shift) for logline in loglines], shift)
+            self.assertNotEqual(shifted, loglines)
+
+    def test_linux(self):
+        # The first records, and all those with embedded dates
+        records = dataset_records("linux", count=None)
+        records = records[:5000] + [record for record in records[5000:]
+                                    if re.search(load_linux.EMBEDDED_DATE_PATTERN, record["msg"])]
+        for shift in self.shifts():
+            rewriters = load_linux.date_rewriters(shift)
+            for field in ("logline", "msg"):
+                texts = [(record[field], int(record["timestamp"][:4])) for record in records]
+                self.assertEqual([load_linux.shift_dates_in_text(text, rewriters, year) for text, year in texts],
+                                 [per_row_linux(text, shift, year) for text, year in texts], (shift, field))
+
+    def test_linux_embedded_dates(self):
+        shift = datetime.timedelta(days=3, hours=12)
+        text = "Jan  9 23:00:00 combo ftpd[1]: connection from 1.2.3.4 () at Mon Jan  9 23:00:00 2006 and Tue Feb 28 13:00:00 2006"
+        self.assertEqual(load_linux.shift_dates_in_text(text, load_linux.date_rewriters(shift), 2006),
+                         "Jan 13 11:00:00 combo ftpd[1]: connection from 1.2.3.4 () at Fri Jan 13 11:00:00 2006 and Sat Mar  4 01:00:00 2006")
+        self.assertEqual(load_linux.shift_dates_in_text(text, load_linux.date_rewriters(shift), 2006),
+                         per_row_linux(text, shift, 2006))
+
+    def test_openssh(self):
+        for shift in self.shifts():
+            rewriter = load_openssh.logline_rewriter(shift)
+            for timestamp, logline in OPENSSH_LINES:
+                year = int(timestamp[:4])
+                self.assertEqual(rewriter.replace_first(logline, year), per_row_openssh(logline, shift, year), (shift, logline))
+
+    def test_no_shift(self):
+        text = "Dec  4 04:47:44 combo sshd[1]: at Sun Dec  4 04:47:44 2005 [Sun Dec 04 04:47:44 2005]"
+        rewriters = load_linux.date_rewriters(datetime.timedelta(0))
+        for rewriter in (load_apache.logline_rewriter(datetime.timedelta(0)), *rewriters):
+            self.assertIsInstance(rewriter, UnshiftedDates)
+        self.assertEqual(load_apache.logline_rewriter(datetime.timedelta(0)).replace_first(text), text)
+        self.assertEqual(load_linux.shift_dates_in_text(text, rewriters, 2005), text)
+
+    def test_cache(self):
+        rewriter = DateRewriter(r"\d+", lambda date_str, year: str(int(date_str) + year), maxsize=2)
+        self.assertEqual(rewriter.replace_all("1 2 1", 10), "11 12 11")
+        self.assertEqual(rewriter.replace_first("1 2 1", 5), "6 2 6")
+        self.assertEqual(rewriter.replace_prefix("x 1", 5), "x 1")
+        info = rewriter.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 3, 2))
+        self.assertEqual(rewriter.hit_rate, 0.25)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+import argparse
+import datetime
+import types
+import unittest
+from unittest import mock
+
+import windows
+from windows import Window, add_window_args, frame_positions, parse_bound, parse_duration, parse_sample
+
+START = datetime.datetime(2024, 3, 1)
+
+def timestamp(minute):
+    return (START + datetime.timedelta(minutes=minute)).isoformat()
+
+def index(frame_count, frame_rows=100):
+    """
+    Returns the index of frames of frame_rows rows one minute apart.
+    """
+    return [
+        {"rows": frame_rows, "min_timestamp": timestamp(n * frame_rows), "max_timestamp": timestamp((n + 1) * frame_rows - 1)}
+        for n in range(frame_count)
+    ]
+
+def records(frames):
+    """
+    Returns the records of an index of frames, numbered with their seq.
+    """
+    rows = sum(frame["rows"] for frame in frames)
+    return [types.SimpleNamespace(seq=seq, timestamp=timestamp(seq)) for seq in range(rows)]
+
+def window_args(since=None, until=None, sample=1.0):
+    return argparse.Namespace(since=since, until=until, sample=sample)
+
+class ParseTest(unittest.TestCase):
+    def test_parse_duration(self):
+        self.assertEqual(parse_duration("90m"), datetime.timedelta(minutes=90))
+        self.assertEqual(parse_duration("1.5d"), datetime.timedelta(hours=36))
+        self.assertEqual(parse_duration("2w"), datetime.timedelta(days=14))
+        for value in ("3", "d", "3y", "-3d", "3d "):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                parse_duration(value)
+
+    def test_parse_bound(self):
+        self.assertEqual(parse_bound("12h"), datetime.timedelta(hours=12))
+        self.assertEqual(parse_bound("2026-10-15"), datetime.datetime(2026, 10, 15))
+        self.assertEqual(parse_bound("2026-10-15T08:00"), datetime.datetime(2026, 10, 15, 8))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            parse_bound("yesterday")
+
+    def test_parse_bound_offset(self):
+        # Dates with an offset are compared in UTC, like the timestamps of the datasets
+        self.assertEqual(parse_bound("2024-01-01T00:00:00+02:00"), datetime.datetime(2023, 12, 31, 22))
+        self.assertEqual(parse_bound("2024-01-01T08:30-05:30"), datetime.datetime(2024, 1, 1, 14))
+        self.assertEqual(parse_bound("2024-01-01T00:00:00Z"), datetime.datetime(2024, 1, 1))
+        self.assertIsNone(parse_bound("2024-01-01T00:00:00+00:00").tzinfo)
+
+    def test_parse_sample(self):
+        self.assertEqual(parse_sample("0.25"), 0.25)
+        self.assertEqual(parse_sample("1"), 1.0)
+        for value in ("0", "1.5", "-0.5"):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                parse_sample(value)
+
+class FromArgsTest(unittest.TestCase):
+    def test_options(self):
+        parser = argparse.ArgumentParser()
+        add_window_args(parser)
+        args = parser.parse_args(["--since", "3d", "--sample", "0.5"])
+        window = Window.from_args(args, timestamp(7 * 24 * 60), datetime.timedelta(0))
+        self.assertEqual(window.since, timestamp(4 * 24 * 60))
+        self.assertEqual(window.sample, 0.5)
+        self.assertIsNone(Window.from_args(parser.parse_args([]), timestamp(0), datetime.timedelta(0)))
+
+    def test_full_load(self):
+        self.assertIsNone(Window.from_args(window_args(), timestamp(999), datetime.timedelta(days=1)))
+
+    def test_durations(self):
+        window = Window.from_args(window_args(since=datetime.timedelta(hours=2), until=datetime.timedelta(hours=1)),
+                                  timestamp(999), datetime.timedelta(days=1000))
+        self.assertEqual(window.since, timestamp(879))
+        self.assertEqual(window.until, timestamp(939))
+
+    def test_dates_of_the_shifted_table(self):
+        shift = datetime.timedelta(days=1000)
+        window = Window.from_args(window_args(since=START + shift + datetime.timedelta(minutes=150)),
+                                  timestamp(999), shift)
+        self.assertEqual(window.since, timestamp(150))
+        self.assertIsNone(window.until)
+
+    def test_date_with_offset(self):
+        shift = datetime.timedelta(days=1000)
+        since = (START + shift + datetime.timedelta(minutes=150)).isoformat() + "+01:00"
+        window = Window.from_args(window_args(since=parse_bound(since)), timestamp(999), shift)
+        self.assertEqual(window.since, timestamp(90))
+
+    def test_sample_only(self):
+        window = Window.from_args(window_args(sample=0.5), timestamp(999), datetime.timedelta(0))
+        self.assertIsNone(window.since)
+        self.assertIsNone(window.until)
+        self.assertEqual(window.sample, 0.5)
+
+class SelectTest(unittest.TestCase):
+    def selected(self, window, frames):
+        return [start for start, _ in window.select(frames)]
+
+    def test_frame_positions(self):
+        frames = [{"rows": 10}, {"rows": 5}, {"rows": 20}]
+        self.assertEqual([start for start, _ in frame_positions(frames)], [0, 10, 15])
+
+    def test_bounds(self):
+        frames = index(10)
+        # since is inclusive and until exclusive, as row by row
+        self.assertEqual(self.selected(Window(since=timestamp(250), until=timestamp(500)), frames), [200, 300, 400])
+        self.assertEqual(self.selected(Window(since=timestamp(299), until=timestamp(501)), frames), [200, 300, 400, 500])
+        self.assertEqual(self.selected(Window(since=timestamp(300), until=timestamp(400)), frames), [300])
+        self.assertEqual(self.selected(Window(since=timestamp(950)), frames), [900])
+        self.assertEqual(self.selected(Window(until=timestamp(100)), frames), [0])
+
+    def test_outside_of_dataset(self):
+        frames = index(10)
+        self.assertEqual(self.selected(Window(since=timestamp(1000)), frames), [])
+        self.assertEqual(self.selected(Window(until=timestamp(0)), frames), [])
+
+    def test_frames_without_timestamps(self):
+        frames = index(3) + [{"rows": 100, "min_timestamp": None, "max_timestamp": None}]
+        self.assertEqual(self.selected(Window(since=timestamp(250)), frames), [200, 300])
+
+    def test_indexes(self):
+        window = Window(since=timestamp(250))
+        self.assertTrue(window.indexes(index(3)))
+        self.assertFalse(window.indexes([{"offset": 0, "size": 10, "rows": 100}]))
+
+    def test_same_rows_as_filter(self):
+        frames = index(10)
+        window = Window(since=timestamp(250), until=timestamp(733))
+        selected = [
+            record for start, frame in window.select(frames)
+            for record in window.filter(records(frames)[start:start + frame["rows"]])
+        ]
+        self.assertEqual(selected, list(window.filter(records(frames))))
+        self.assertEqual([record.seq for record in selected], list(range(250, 733)))
+
+class SampleTest(unittest.TestCase):
+    def test_sample_count(self):
+        frames = index(100)
+        for sample, count in ((1.0, 100), (0.5, 50), (0.25, 25), (0.1, 10), (0.333, 34), (0.001, 1)):
+            self.assertEqual(len(Window(sample=sample).select(frames)), count, sample)
+
+    def test_sample_spread(self):
+        frames = index(12)
+        starts = [start for start, _ in Window(sample=0.25).select(frames)]
+        self.assertEqual(starts, [0, 400, 800])
+
+    def test_sample_of_window(self):
+        frames = index(12)
+        starts = [start for start, _ in Window(since=timestamp(300), sample=0.5).select(frames)]
+        # Every other frame, counted from the first frame of the window
+        self.assertEqual(starts, [300, 500, 700, 900, 1100])
+
+    def test_sample_without_index(self):
+        # Without an index, the blocks of FRAME_ROWS rows are sampled like the frames
+        frames = index(12)
+        window = Window(sample=0.25)
+        with mock.patch.object(windows, "FRAME_ROWS", 100):
+            filtered = list(window.filter(records(frames), sample=True))
+        selected = [record for start, frame in window.select(frames)
+                    for record in records(frames)[start:start + frame["rows"]]]
+        self.assertEqual(filtered, selected)
+
+    def test_records_without_timestamp(self):
+        window = Window(since=timestamp(5))
+        record = types.SimpleNamespace(seq=0, timestamp=None)
+        self.assertEqual(list(window.filter([record])), [record])
+
+if __name__ == "__main__":
+    unittest.main()
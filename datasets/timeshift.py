@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Vectorized timestamp shifting shared by the log loaders.
+
+A whole column of ISO-8601 timestamps is parsed at once into a NumPy
+datetime64 array, shifted with a single array addition and converted to
+integer epoch values. clickhouse_driver writes integers into DateTime and
+DateTime64 columns as they are, so no per-row datetime objects are created.
+
+Timestamps in the datasets carry no timezone; they are treated as UTC.
+
+Dates embedded in loglines and messages are rewritten with DateRewriter, which
+memoizes the shifted replacement of every matched date substring. Log lines
+come in bursts sharing the same second, so most rewrites become a cache lookup.
+Loads that don't shift the text, such as the raw tables of --virtual-shift
+(see virtual_shift.py), use UnshiftedDates, which doesn't even look for dates.
+"""
+
+import datetime
+import functools
+import re
+
+import numpy as np
+
+# Maximum number of distinct date substrings remembered by a DateRewriter.
+DEFAULT_CACHE_SIZE = 65536
+
+# Units of the integers expected by clickhouse_driver for the column types we use.
+SECONDS = "s"        # DateTime
+MICROSECONDS = "us"  # DateTime64(6)
+
+def parse_timestamps(values, unit=SECONDS):
+    """
+    Parses a sequence of ISO-8601 strings, e.g. "2015-10-17T21:48:16.337000",
+    into a datetime64 array with the given unit.
+    """
+    return np.array(values, dtype=f"datetime64[{unit}]")
+
+def utc_now(unit=SECONDS):
+    """
+    Returns the current UTC time as a datetime64 value with the given unit.
+    """
+    return np.datetime64(datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None), unit)
+
+class TimeShifter:
+    """
+    Shifts timestamps so that max_timestamp (an ISO-8601 string) becomes the current time.
+    """
+
+    def __init__(self, max_timestamp, unit=SECONDS):
+        self.unit = unit
+        self.shift = utc_now(unit) - parse_timestamps([max_timestamp], unit)[0]
+
+    @classmethod
+    def from_microseconds(cls, microseconds, unit=SECONDS):
+        """
+        Returns a TimeShifter applying a known shift, e.g. the one of an earlier load.
+        """
+        shifter = cls.__new__(cls)
+        shifter.unit = unit
+        shifter.shift = np.timedelta64(microseconds, "us").astype(f"timedelta64[{unit}]")
+        return shifter
+
+    @property
+    def microseconds(self):
+        """
+        The shift as an integer number of microseconds.
+        """
+        return int(self.shift / np.timedelta64(1, "us"))
+
+    @property
+    def timedelta(self):
+        """
+        The shift as a datetime.timedelta, for rewriting dates embedded in text.
+        """
+        return datetime.timedelta(microseconds=self.microseconds)
+
+    def shift_array(self, values):
+        """
+        Parses and shifts a sequence of ISO-8601 strings, returning a datetime64 array.
+        """
+        return parse_timestamps(values, self.unit) + self.shift
+
+    def shift_column(self, values):
+        """
+        Parses and shifts a sequence of ISO-8601 strings, returning an int64 array of
+        epoch values (seconds or microseconds, depending on the unit) ready to be
+        inserted into a DateTime / DateTime64 column.
+        """
+        return self.shift_array(values).astype(np.int64)
+
+class DateRewriter:
+    """
+    Replaces dates matched by pattern with their shifted version.
+    shift_date(date_str, year) receives the matched substring and an optional
+    year (for formats that don't carry one) and returns the replacement.
+    Replacements are kept in a bounded LRU cache keyed on (date_str, year).
+    """
+
+    def __init__(self, pattern, shift_date, maxsize=DEFAULT_CACHE_SIZE):
+        self.pattern = re.compile(pattern)
+        self._shift_date = functools.lru_cache(maxsize=maxsize)(shift_date)
+
+    def replace_first(self, text, year=None):
+        """
+        Shifts the first date found in text, replacing every occurrence of it.
+        """
+        match = self.pattern.search(text)
+        if not match:
+            return text
+        date_str = match.group(0)
+        return text.replace(date_str, self._shift_date(date_str, year))
+
+    def replace_prefix(self, text, year=None):
+        """
+        Shifts the date at the very beginning of text, if there is one.
+        """
+        match = self.pattern.match(text)
+        if not match:
+            return text
+        return self._shift_date(match.group(0), year) + text[match.end():]
+
+    def replace_all(self, text, year=None):
+        """
+        Shifts every date found in text.
+        """
+        return self.pattern.sub(lambda match: self._shift_date(match.group(0), year), text)
+
+    def cache_info(self):
+        """
+        Returns the functools cache statistics (hits, misses, maxsize, currsize).
+        """
+        return self._shift_date.cache_info()
+
+    @property
+    def hit_rate(self):
+        """
+        Fraction of rewrites served from the cache.
+        """
+        info = self.cache_info()
+        lookups = info.hits + info.misses
+        return info.hits / lookups if lookups else 0.0
+
+class UnshiftedDates(DateRewriter):
+    """
+    A DateRewriter for a zero shift, which leaves the text as it is.
+    """
+
+    def __init__(self):
+        super().__init__(r"(?!)", lambda date_str, year: date_str)
+
+    def replace_first(self, text, year=None):
+        return text
+
+    replace_prefix = replace_all = replace_first
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Query-time time shifting of the log tables, with --virtual-shift.
+
+A regular load rewrites every timestamp and every date embedded in logline/msg
+so that the end of the dataset becomes 'now', which is redone on every reload
+and is stale a day later. With --virtual-shift, a loader instead:
+  • inserts the records as they are into <table>_raw, which has the schema and
+    the rollup (see rollups.py) of <table>, without rewriting any date,
+  • creates <table> as a view over it, adding an offset to the timestamps and
+    shifting the dates in the text with the loader's server-side expressions
+    (see server_shift.py), which ClickHouse only evaluates for the rows a query
+    returns,
+  • creates <table>_per_minute as a view over the rollup of the raw table,
+    shifted by the same offset.
+
+Queries read <table> and <table>_per_minute as before. The offset is a constant
+of the views, so a filter on the timestamp of <table> still uses the primary key
+of the raw table (timestamp + offset is monotonic). It's a whole number of
+minutes, so the minutes of the rollup stay minutes, and the end of the dataset
+lands within the minute before 'now'.
+
+Moving the tables to 'now' again only replaces the views, a metadata change.
+The loaders do it on start when the table already holds the dataset (see
+fingerprints.py), and so does this module:
+  python virtual_shift.py linux openssh
+append.py inserts the new records of these tables into their raw table, as they are.
+"""
+
+import argparse
+import datetime
+import importlib
+
+from connection import add_connection_args, connect
+from rollups import drop_rollup, rollup_table
+from server_shift import UNIT_MICROSECONDS
+from timeshift import TimeShifter
+
+# The offsets of the views are whole numbers of minutes, in microseconds
+OFFSET_STEP_US = 60 * 1000000
+
+def raw_table(table):
+    return f"{table}_raw"
+
+def is_virtual(client, table):
+    """
+    Returns whether table is the view of a table loaded with --virtual-shift.
+    """
+    rows = client.execute(
+        "SELECT engine FROM system.tables WHERE database = currentDatabase() AND name = %(table)s",
+        {"table": table},
+    )
+    return bool(rows) and rows[0][0] == "View"
+
+def drop_raw_table(client, table):
+    """
+    Drops the raw table of table and its rollup, e.g. before table is recreated.
+    The views themselves are dropped like tables.
+    """
+    raw = raw_table(table)
+    drop_rollup(client, raw)
+    client.execute(f"DROP TABLE IF EXISTS {raw}")
+
+def view_offset_us(shift_us):
+    """
+    Rounds a shift down to the offset of the views, a whole number of minutes.
+    """
+    return shift_us // OFFSET_STEP_US * OFFSET_STEP_US
+
+def load_shifters(args, max_timestamp, unit):
+    """
+    Returns the TimeShifter moving max_timestamp (an ISO-8601 string) to 'now' in
+    the table of a load, and the one shifting the records it inserts: the same, or
+    no shift with --virtual-shift, whose views apply a shift rounded to minutes.
+    """
+    shifter = TimeShifter(max_timestamp, unit)
+    if not args.virtual_shift:
+        return shifter, shifter
+    return (TimeShifter.from_microseconds(view_offset_us(shifter.microseconds), unit),
+            TimeShifter.from_microseconds(0, unit))
+
+def view_sql(view, source, columns, expressions):
+    """
+    Returns the statement (re)creating view with the columns computed by expressions
+    from source. They're computed under other names first, as they may use columns
+    of source the view replaces (e.g. the year of the original timestamp).
+    """
+    shifted = ", ".join(f"{expression} AS shifted_{column}" for column, expression in zip(columns, expressions))
+    renamed = ", ".join(f"shifted_{column} AS {column}" for column in columns)
+    return f"CREATE OR REPLACE VIEW {view} AS SELECT {renamed} FROM (SELECT {shifted} FROM {source})"
+
+def create_views(client, table, loader_name, offset_us):
+    """
+    Creates (or moves) table and its rollup as views over the raw table and its
+    rollup, shifted by offset_us with the shifted_columns of the loader module
+    loader_name.
+    """
+    loader = importlib.import_module(loader_name)
+    raw = raw_table(table)
+    shift = offset_us // UNIT_MICROSECONDS[loader.SHIFT_UNIT]
+    client.execute(view_sql(table, raw, loader.TABLE_COLUMNS, loader.shifted_columns(shift)))
+    keys = loader.ROLLUP_KEYS
+    client.execute(view_sql(rollup_table(table), rollup_table(raw), ["minute", *keys, "count"],
+                            [f"minute + {offset_us // 1000000}", *keys, "count"]))
+
+def add_virtual_shift_arg(parser):
+    """
+    Adds the --virtual-shift option.
+    """
+    parser.add_argument("--virtual-shift", action="store_true",
+                        help="Insert the records as they are and shift them at query time through views "
+                             "(see virtual_shift.py)")
+
+def main():
+    # append.py and fingerprints.py import this module
+    from append import SOURCES
+    from fingerprints import read_fingerprint, refresh_views
+
+    parser = argparse.ArgumentParser(description="Move the tables loaded with --virtual-shift to 'now'.")
+    parser.add_argument("sources", nargs="+", choices=SOURCES, help="Log sources of the tables")
+    add_connection_args(parser)
+    args = parser.parse_args()
+
+    # Connect to ClickHouse (see connection.py)
+    client = connect(args)
+    for source in args.sources:
+        table = f"{source}_logs"
+        if not is_virtual(client, table):
+            print(f"{table} wasn't loaded with --virtual-shift, skipping it.")
+            continue
+        offset_us = refresh_views(client, table, f"load_{source}", read_fingerprint(client, table))
+        print(f"{table} is now shifted by {datetime.timedelta(microseconds=offset_us)}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Partial loads of a time window of a log dataset, e.g. to stand up a stack quickly
+with the last few days of data only:
+  --since BOUND   only the rows at or after BOUND,
+  --until BOUND   only the rows before BOUND,
+  --sample F      only a fraction F of the chunks in the window, spread evenly over it.
+
+A BOUND is either a duration before the end of the dataset, which is 'now' once
+it's shifted (e.g. 90m, 12h, 3d or 2w), or a date and time in the shifted table,
+in UTC unless it has an offset, e.g. 2026-10-15, 2026-10-15T08:00 or
+2026-10-15T10:00+02:00:
+  python load_linux.py --since 3d
+  python load_all.py --since 2w --until 1w --sample 0.25
+
+The chunks are the frames of the dataset (see frames.py): the frame index of its
+metadata sidecar has the minimum and maximum timestamp of every frame, so only
+the frames overlapping the window are read and decompressed, and a partial load
+takes time proportional to the window. The rows of the frames at the edges of
+the window are filtered one by one. Datasets without the index are read whole
+and filtered row by row; --sample then keeps a fraction of the blocks of
+FRAME_ROWS rows.
+
+The table is shifted like for a full load (the end of the dataset becomes 'now'),
+and its rows keep their position in the file as seq, so append.py continues it
+as usual.
+"""
+
+import argparse
+import datetime
+import math
+import re
+
+from frames import FRAME_ROWS
+
+# A duration, e.g. 90m, 12h, 3d or 2w
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)([smhdw])")
+
+DURATION_UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+
+def parse_duration(value):
+    """
+    Parses a duration such as 90m, 12h, 3d or 2w into a datetime.timedelta.
+    """
+    match = DURATION_PATTERN.fullmatch(value)
+    if not match:
+        raise argparse.ArgumentTypeError(f"expected a duration such as 10m or 3d, got {value!r}")
+    return datetime.timedelta(**{DURATION_UNITS[match.group(2)]: float(match.group(1))})
+
+def parse_bound(value):
+    """
+    Parses a window bound into a datetime.timedelta (a duration before the end
+    of the dataset) or a naive UTC datetime.datetime (in the shifted table), like
+    the timestamps of the datasets.
+    """
+    if DURATION_PATTERN.fullmatch(value):
+        return parse_duration(value)
+    try:
+        # fromisoformat only reads the Z suffix from Python 3.11 on
+        bound = datetime.datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a duration such as 3d or a date such as 2026-10-15, got {value!r}")
+    if bound.tzinfo is not None:
+        bound = bound.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return bound
+
+def parse_sample(value):
+    sample = float(value)
+    if not 0 < sample <= 1:
+        raise argparse.ArgumentTypeError("the sample must be a fraction in (0, 1]")
+    return sample
+
+def window_requested(args):
+    """
+    Returns whether the options ask for a partial load.
+    """
+    return args.since is not None or args.until is not None or args.sample < 1
+
+def frame_positions(frames):
+    """
+    Yields every frame of an index with the position of its first row in the file.
+    """
+    start = 0
+    for frame in frames:
+        yield start, frame
+        start += frame["rows"]
+
+class Window:
+    """
+    The rows of a partial load: since and until are ISO-8601 timestamps of the
+    dataset (before shifting), or None, and sample the fraction of chunks kept.
+    """
+
+    def __init__(self, since=None, until=None, sample=1.0):
+        self.since = since
+        self.until = until
+        self.sample = sample
+
+    @classmethod
+    def from_args(cls, args, max_timestamp, shift):
+        """
+        Returns the window of the options of a load whose max_timestamp (an ISO-8601
+        string) is shifted by shift (a datetime.timedelta), or None for a full load.
+        """
+        if not window_requested(args):
+            return None
+        end = datetime.datetime.fromisoformat(max_timestamp)
+
+        def timestamp(bound):
+            if bound is None:
+                return None
+            if isinstance(bound, datetime.timedelta):
+                return (end - bound).isoformat()
+            # Back from the shifted table to the dataset
+            return (bound - shift).isoformat()
+
+        return cls(timestamp(args.since), timestamp(args.until), args.sample)
+
+    def __str__(self):
+        bounds = f"{self.since or 'the start'} .. {self.until or 'the end'}"
+        return bounds if self.sample == 1 else f"{bounds}, {self.sample:.0%} of the chunks"
+
+    def indexes(self, frames):
+        """
+        Returns whether a frame index has the timestamps of its frames.
+        """
+        return all("min_timestamp" in frame for frame in frames)
+
+    def overlaps(self, frame):
+        if frame["min_timestamp"] is None:
+            # No timestamps to filter on
+            return True
+        # ISO-8601 timestamps with a fixed format sort lexicographically
+        if self.since is not None and frame["max_timestamp"] < self.since:
+            return False
+        return self.until is None or frame["min_timestamp"] < self.until
+
+    def sampled(self, index):
+        """
+        Returns whether the chunk at index (among those of the window) is part of
+        the sample, keeping every 1/sample-th chunk.
+        """
+        return math.ceil((index + 1) * self.sample) > math.ceil(index * self.sample)
+
+    def select(self, frames):
+        """
+        Returns the frames of an index that hold rows of the window, each with the
+        position of its first row in the file.
+        """
+        overlapping = [(start, frame) for start, frame in frame_positions(frames) if self.overlaps(frame)]
+        return [item for index, item in enumerate(overlapping) if self.sampled(index)]
+
+    def contains(self, timestamp):
+        return ((self.since is None or timestamp >= self.since)
+                and (self.until is None or timestamp < self.until))
+
+    def filter(self, records, sample=False):
+        """
+        Yields the records (numbered with their seq) of the window. With sample,
+        the blocks of FRAME_ROWS records are sampled like the chunks of an index.
+        """
+        for record in records:
+            if sample and not self.sampled(record.seq // FRAME_ROWS):
+                continue
+            if record.timestamp is None or self.contains(record.timestamp):
+                yield record
+
+def add_window_args(parser):
+    """
+    Adds the --since, --until and --sample options.
+    """
+    group = parser.add_argument_group("partial loads (see windows.py)")
+    group.add_argument("--since", type=parse_bound,
+                       help="Only load the rows from this time on: a duration before now, e.g. 3d, or a date")
+    group.add_argument("--until", type=parse_bound,
+                       help="Only load the rows before this time: a duration before now, e.g. 1d, or a date")
+    group.add_argument("--sample", type=parse_sample, default=1.0,
+                       help="Fraction of the chunks of the time window to load (default: 1)")
@@ -8,8 +8,10 @@ import (
 	"net/http"
 )
 
+// EnrichIPRequest enriches a single IP, or with IPs set, any number of them in one query.
 type EnrichIPRequest struct {
-	IP string `json:"ip"`
+	IP  string   `json:"ip"`
+	IPs []string `json:"ips"`
 }
 
 type EnrichIPResponse struct {
@@ -30,6 +32,113 @@ type EnrichIPResponse struct {
 	Zipcode      *string `json:"zipcode"`
 }
 
+type EnrichIPsResponse struct {
+	Results []EnrichIPResponse `json:"results"`
+}
+
+// enrichIPsQuery looks the IPs up in the ip_dict dictionary created by
+// datasets/load_ips.py. The dictionary is keyed by IPv6 (IPv4 addresses are
+// IPv4-mapped), so every address is normalized with toIPv6OrDefault. Unknown and
+// invalid IPs are left out.
+const enrichIPsQuery = `SELECT
+	dictGet('ip_dict', 'allocated_at', key),
+	dictGet('ip_dict', 'asn', key),
+	dictGet('ip_dict', 'asn_country', key),
+	dictGet('ip_dict', 'city', key),
+	dictGet('ip_dict', 'country_long', key),
+	dictGet('ip_dict', 'country_short', key),
+	dictGet('ip_dict', 'hostname', key),
+	ip,
+	dictGet('ip_dict', 'isp', key),
+	dictGet('ip_dict', 'latitude', key),
+	dictGet('ip_dict', 'longitude', key),
+	dictGet('ip_dict', 'region', key),
+	dictGet('ip_dict', 'registry', key),
+	dictGet('ip_dict', 'timezone', key),
+	dictGet('ip_dict', 'zipcode', key)
+FROM (
+	SELECT ip, tuple(toIPv6OrDefault(ip)) AS key
+	FROM (SELECT arrayJoin(?) AS ip)
+)
+WHERE dictHas('ip_dict', key)`
+
+// enrichIPsTableQuery looks the IPs up in the ip_data table, when the ip_dict
+// dictionary is missing (e.g. ip_data was loaded before load_ips.py created it).
+// Unknown IPs are left out.
+const enrichIPsTableQuery = `SELECT
+	allocated_at,
+	asn,
+	asn_country,
+	city,
+	country_long,
+	country_short,
+	hostname,
+	ip,
+	isp,
+	latitude,
+	longitude,
+	region,
+	registry,
+	timezone,
+	zipcode
+FROM ip_data
+WHERE has(?, ip)
+LIMIT 1 BY ip`
+
+// queryEnrichments runs one of the enrichment queries for the IPs.
+func queryEnrichments(query string, ips []string) ([]EnrichIPResponse, error) {
+	rows, err := DefaultDB.Query(query, ips)
+	if err != nil {
+		return nil, err
+	}
+	defer rows.Close()
+
+	results := []EnrichIPResponse{}
+	for rows.Next() {
+		var response EnrichIPResponse
+		err = rows.Scan(
+			&response.AllocatedAt,
+			&response.ASN,
+			&response.ASNCountry,
+			&response.City,
+			&response.CountryLong,
+			&response.CountryShort,
+			&response.Hostname,
+			&response.IP,
+			&response.ISP,
+			&response.Latitude,
+			&response.Longitude,
+			&response.Region,
+			&response.Registry,
+			&response.Timezone,
+			&response.Zipcode,
+		)
+		if err != nil {
+			return nil, err
+		}
+		results = append(results, response)
+	}
+	return results, rows.Err()
+}
+
+// enrichIPs returns the enrichment of every known IP with a single query, through
+// the ip_dict dictionary or else the ip_data table.
+func enrichIPs(ips []string) ([]EnrichIPResponse, error) {
+	if len(ips) == 0 {
+		return []EnrichIPResponse{}, nil
+	}
+
+	results, err := queryEnrichments(enrichIPsQuery, ips)
+	if err != nil {
+		log.Println("ip_dict lookup failed, querying the ip_data table: ", err)
+		results, err = queryEnrichments(enrichIPsTableQuery, ips)
+		if err != nil {
+			return nil, fmt.Errorf("neither the ip_dict dictionary nor the ip_data table could be queried (run datasets/load_ips.py): %w", err)
+		}
+	}
+	return results, nil
+}
+
 func HandleEnrichIP(w http.ResponseWriter, r *http.Request) {
 
 	log.Println("Enrich IP request received", r.Method)
@@ -72,66 +181,29 @@ func HandleEnrichIP(w http.ResponseWriter, r *http.Request) {
 		return
 	}
 
-	query := fmt.Sprintf(`SELECT 
-		allocated_at,
-		asn,
-		asn_country,
-		city,
-		country_long,
-		country_short, 
-		hostname,
-		ip,
-		isp,
-		latitude,
-		longitude,
-		region,
-		registry,
-		timezone,
-		zipcode
-	FROM ip_data WHERE ip = '%s'`, request.IP)
-
-	rows, err := DefaultDB.Query(query)
-
-	if err != nil {
-		writeError(fmt.Errorf("error enriching IP: %w", err))
-	}
-
-	defer rows.Close()
-	var response EnrichIPResponse
-	if rows.Next() {
-
-		err = rows.Scan(
-			&response.AllocatedAt,
-			&response.ASN,
-			&response.ASNCountry,
-			&response.City,
-			&response.CountryLong,
-			&response.CountryShort,
-			&response.Hostname,
-			&response.IP,
-			&response.ISP,
-			&response.Latitude,
-			&response.Longitude,
-			&response.Region,
-			&response.Registry,
-			&response.Timezone,
-			&response.Zipcode,
-		)
-
-		if err != nil {
-			writeError(fmt.Errorf("error enriching IP: %w", err))
-			return
-		}
-
+	ips := request.IPs
+	if ips == nil {
+		ips = []string{request.IP}
 	}
 
+	results, err := enrichIPs(ips)
 	if err != nil {
 		writeError(fmt.Errorf("error enriching IP: %w", err))
 		return
 	}
-	log.Println("Enrich IP request received", request.IP)
-
-	responseBody, err := json.Marshal(response)
+	log.Println("Enriched IPs", len(ips), "found", len(results))
+
+	var responseBody []byte
+	if request.IPs != nil {
+		responseBody, err = json.Marshal(EnrichIPsResponse{Results: results})
+	} else {
+		// A single IP is answered with its enrichment, empty if it's unknown
+		var response EnrichIPResponse
+		if len(results) > 0 {
+			response = results[0]
+		}
+		responseBody, err = json.Marshal(response)
+	}
 
 	if err != nil {
 		writeError(err)
@@ -0,0 +1,176 @@
+package backend
+
+import (
+	"database/sql/driver"
+	"encoding/json"
+	"errors"
+	"net/http"
+	"net/http/httptest"
+	"strings"
+	"testing"
+
+	"github.com/DATA-DOG/go-sqlmock"
+	"github.com/stretchr/testify/assert"
+)
+
+// passThroughConverter hands the query arguments to sqlmock as they are, as the
+// ClickHouse driver binds arrays (the IPs) itself.
+type passThroughConverter struct{}
+
+func (passThroughConverter) ConvertValue(v interface{}) (driver.Value, error) {
+	return v, nil
+}
+
+// mockDB replaces DefaultDB with a sqlmock database for the duration of a test.
+func mockDB(t *testing.T) sqlmock.Sqlmock {
+	return mockDBMatching(t, sqlmock.QueryMatcherEqual)
+}
+
+// mockDBMatching is mockDB with the queries matched by matcher, e.g. for queries
+// rewritten by the pipe syntax transpiler.
+func mockDBMatching(t *testing.T, matcher sqlmock.QueryMatcher) sqlmock.Sqlmock {
+	db, mock, err := sqlmock.New(
+		sqlmock.QueryMatcherOption(matcher),
+		sqlmock.ValueConverterOption(passThroughConverter{}),
+	)
+	if err != nil {
+		t.Fatalf("sqlmock: %s", err)
+	}
+	previous := DefaultDB
+	DefaultDB = db
+	t.Cleanup(func() {
+		DefaultDB = previous
+		db.Close()
+	})
+	return mock
+}
+
+// ipsArg matches the array of IPs bound to the enrichment queries.
+type ipsArg []string
+
+func (a ipsArg) Match(v driver.Value) bool {
+	ips, ok := v.([]string)
+	return ok && assert.ObjectsAreEqual([]string(a), ips)
+}
+
+var enrichmentColumns = []string{
+	"allocated_at", "asn", "asn_country", "city", "country_long", "country_short", "hostname", "ip",
+	"isp", "latitude", "longitude", "region", "registry", "timezone", "zipcode",
+}
+
+// enrichmentRows returns the rows of an enrichment query knowing the IPs, all in Poland.
+func enrichmentRows(ips ...string) *sqlmock.Rows {
+	rows := sqlmock.NewRows(enrichmentColumns)
+	for _, ip := range ips {
+		rows.AddRow(nil, "5617", nil, nil, "Poland", "PL", nil, ip, nil, nil, nil, nil, nil, nil, nil)
+	}
+	return rows
+}
+
+func TestEnrichIPs_dictionary(t *testing.T) {
+	mock := mockDB(t)
+	mock.ExpectQuery(enrichIPsQuery).
+		WithArgs(ipsArg{"1.2.3.4", "10.0.0.1"}).
+		WillReturnRows(enrichmentRows("1.2.3.4"))
+
+	results, err := enrichIPs([]string{"1.2.3.4", "10.0.0.1"})
+
+	assert.NoError(t, err)
+	assert.Len(t, results, 1)
+	assert.Equal(t, "1.2.3.4", results[0].IP)
+	assert.Equal(t, "PL", *results[0].CountryShort)
+	assert.Nil(t, results[0].City)
+	assert.NoError(t, mock.ExpectationsWereMet())
+}
+
+func TestEnrichIPs_tableFallback(t *testing.T) {
+	mock := mockDB(t)
+	mock.ExpectQuery(enrichIPsQuery).
+		WithArgs(ipsArg{"1.2.3.4"}).
+		WillReturnError(errors.New("dictionary ip_dict doesn't exist"))
+	mock.ExpectQuery(enrichIPsTableQuery).
+		WithArgs(ipsArg{"1.2.3.4"}).
+		WillReturnRows(enrichmentRows("1.2.3.4"))
+
+	results, err := enrichIPs([]string{"1.2.3.4"})
+
+	assert.NoError(t, err)
+	assert.Len(t, results, 1)
+	assert.Equal(t, "Poland", *results[0].CountryLong)
+	assert.NoError(t, mock.ExpectationsWereMet())
+}
+
+func TestEnrichIPs_noDictionaryNorTable(t *testing.T) {
+	mock := mockDB(t)
+	mock.ExpectQuery(enrichIPsQuery).WillReturnError(errors.New("dictionary ip_dict doesn't exist"))
+	mock.ExpectQuery(enrichIPsTableQuery).WillReturnError(errors.New("table ip_data doesn't exist"))
+
+	_, err := enrichIPs([]string{"1.2.3.4"})
+
+	assert.ErrorContains(t, err, "load_ips.py")
+	assert.ErrorContains(t, err, "table ip_data doesn't exist")
+	assert.NoError(t, mock.ExpectationsWereMet())
+}
+
+func TestEnrichIPs_empty(t *testing.T) {
+	mock := mockDB(t)
+
+	results, err := enrichIPs([]string{})
+
+	assert.NoError(t, err)
+	assert.Empty(t, results)
+	assert.NotNil(t, results)
+	assert.NoError(t, mock.ExpectationsWereMet())
+}
+
+func enrichIPRequest(t *testing.T, body string) map[string]interface{} {
+	recorder := httptest.NewRecorder()
+	HandleEnrichIP(recorder, httptest.NewRequest(http.MethodPost, "/enrich_ip", strings.NewReader(body)))
+
+	assert.Equal(t, http.StatusOK, recorder.Code)
+	var response map[string]interface{}
+	assert.NoError(t, json.Unmarshal(recorder.Body.Bytes(), &response))
+	return response
+}
+
+func TestHandleEnrichIP_single(t *testing.T) {
+	mock := mockDB(t)
+	mock.ExpectQuery(enrichIPsQuery).
+		WithArgs(ipsArg{"1.2.3.4"}).
+		WillReturnRows(enrichmentRows("1.2.3.4"))
+
+	response := enrichIPRequest(t, `{"ip": "1.2.3.4"}`)
+
+	assert.Equal(t, "1.2.3.4", response["ip"])
+	assert.Equal(t, "PL", response["country_short"])
+	assert.NoError(t, mock.ExpectationsWereMet())
+}
+
+func TestHandleEnrichIP_unknownSingle(t *testing.T) {
+	mock := mockDB(t)
+	mock.ExpectQuery(enrichIPsQuery).
+		WithArgs(ipsArg{"10.0.0.1"}).
+		WillReturnRows(enrichmentRows())
+
+	response := enrichIPRequest(t, `{"ip": "10.0.0.1"}`)
+
+	// An unknown IP is answered with an empty enrichment, as before
+	assert.Equal(t, "", response["ip"])
+	assert.Nil(t, response["country_short"])
+	assert.NoError(t, mock.ExpectationsWereMet())
+}
+
+func TestHandleEnrichIP_batch(t *testing.T) {
+	mock := mockDB(t)
+	mock.ExpectQuery(enrichIPsQuery).
+		WithArgs(ipsArg{"1.2.3.4", "10.0.0.1", "5.6.7.8"}).
+		WillReturnRows(enrichmentRows("1.2.3.4", "5.6.7.8"))
+
+	response := enrichIPRequest(t, `{"ips": ["1.2.3.4", "10.0.0.1", "5.6.7.8"]}`)
+
+	results, ok := response["results"].([]interface{})
+	assert.True(t, ok)
+	assert.Len(t, results, 2)
+	assert.Equal(t, "5.6.7.8", results[1].(map[string]interface{})["ip"])
+	assert.NoError(t, mock.ExpectationsWereMet())
+}
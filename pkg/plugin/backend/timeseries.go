@@ -15,6 +15,56 @@ import (
 	"github.com/QuesmaOrg/quesma/platform/parsers/sql/parser/core"
 )
 
+// Per-minute rollups of the log tables, created by the dataset loaders (see datasets/rollups.py).
+// They hold pre-aggregated row counts, so histograms don't have to scan the raw tables.
+var rollupTables = map[string]string{
+	"apache_logs":  "apache_logs_per_minute",
+	"hadoop_logs":  "hadoop_logs_per_minute",
+	"linux_logs":   "linux_logs_per_minute",
+	"openssh_logs": "openssh_logs_per_minute",
+}
+
+func queryTimeSeries(query string) ([]TimeSeriesElement, error) {
+	log.Println("TimeSeries Query: ", query)
+
+	tokens := lexer_core.Lex(query, dialect_sqlparse.SqlparseRules)
+	node := core.TokensToNode(tokens)
+
+	transforms.GroupParenthesis(node)
+	pipe_syntax.GroupPipeSyntax(node)
+	pipe_syntax.ExpandMacros(node)
+	pipe_syntax.ExpandEnrichments(node, DefaultDB)
+	pipe_syntax.Transpile(node)
+
+	transpiledSQL := transforms.ConcatTokenNodes(node)
+
+	rows, err := DefaultDB.Query(transpiledSQL)
+	if err != nil {
+		return nil, fmt.Errorf("error executing timeseries query: %w", err)
+	}
+	defer rows.Close()
+
+	data := []TimeSeriesElement{}
+	for rows.Next() {
+		var date string
+		var count int
+		err = rows.Scan(&date, &count)
+		if err != nil {
+			return nil, fmt.Errorf("error scanning row: %w", err)
+		}
+
+		data = append(data, TimeSeriesElement{
+			Date:  date,
+			Count: count,
+		})
+	}
+
+	if rows.Err() != nil {
+		return nil, fmt.Errorf("error iterating rows: %w", rows.Err())
+	}
+	return data, nil
+}
+
 func HandleTimeSeries(w http.ResponseWriter, r *http.Request) {
 
 	cors(&w)
@@ -74,50 +124,27 @@ func HandleTimeSeries(w http.ResponseWriter, r *http.Request) {
 
 	query := fmt.Sprintf(" SELECT date_trunc('hour',`%s`), count(*)  FROM \"%s\" where `%s` between FROM_UNIXTIME(%d) and FROM_UNIXTIME(%d) GROUP BY  1 order by 1 ", timestampField, request.TableName, timestampField, request.StartDate, request.EndDate)
 
-	log.Println("TimeSeries Query: ", query)
-
-	tokens := lexer_core.Lex(query, dialect_sqlparse.SqlparseRules)
-	node := core.TokensToNode(tokens)
-
-	transforms.GroupParenthesis(node)
-	pipe_syntax.GroupPipeSyntax(node)
-	pipe_syntax.ExpandMacros(node)
-	pipe_syntax.ExpandEnrichments(node, DefaultDB)
-	pipe_syntax.Transpile(node)
-
-	transpiledSQL := transforms.ConcatTokenNodes(node)
-
-	rows, err := DefaultDB.Query(transpiledSQL)
-
-	if err != nil {
-		writeErr("Error executing timeseries query.", err)
-		return
-	}
-
-	defer rows.Close()
-
-	response := TimeSeriesResponse{
-		Data: []TimeSeriesElement{},
+	var data []TimeSeriesElement
+	if rollup, ok := rollupTables[request.TableName]; ok {
+		// Sum the per-minute counts. The range is rounded to whole minutes.
+		rollupQuery := fmt.Sprintf(" SELECT date_trunc('hour',`minute`), sum(`count`)  FROM \"%s\" where `minute` between toStartOfMinute(FROM_UNIXTIME(%d)) and FROM_UNIXTIME(%d) GROUP BY  1 order by 1 ", rollup, request.StartDate, request.EndDate)
+		data, err = queryTimeSeries(rollupQuery)
+		if err != nil {
+			// e.g. the table was loaded before the loaders created rollups
+			log.Println("Rollup query failed, scanning the table: ", err)
+		}
 	}
 
-	for rows.Next() {
-		var date string
-		var count int
-		err = rows.Scan(&date, &count)
+	if data == nil {
+		data, err = queryTimeSeries(query)
 		if err != nil {
-			writeErr("Error scanning row", err)
+			writeErr("Error executing timeseries query.", err)
 			return
 		}
-
-		response.Data = append(response.Data, TimeSeriesElement{
-			Date:  date,
-			Count: count,
-		})
 	}
 
-	if rows.Err() != nil {
-		writeErr("Error iterating rows", rows.Err())
-		return
+	response := TimeSeriesResponse{
+		Data: data,
 	}
 
 	w.WriteHeader(200)
@@ -0,0 +1,100 @@
+package backend
+
+import (
+	"encoding/json"
+	"errors"
+	"net/http"
+	"net/http/httptest"
+	"strings"
+	"testing"
+
+	"github.com/DATA-DOG/go-sqlmock"
+	"github.com/stretchr/testify/assert"
+)
+
+// The queries go through the transpiler, so they're matched by the table they read
+const (
+	rollupQueryPattern = `apache_logs_per_minute`
+	tableQueryPattern  = `apache_logs[^_]`
+)
+
+var timeSeriesColumns = []string{"date", "count"}
+
+func timeSeriesRequest(t *testing.T, tableName string) (int, map[string]interface{}) {
+	body := `{"query": "", "startDate": 1700000000, "endDate": 1700007200, "tableName": "` + tableName + `"}`
+	recorder := httptest.NewRecorder()
+	HandleTimeSeries(recorder, httptest.NewRequest(http.MethodPost, "/timeseries", strings.NewReader(body)))
+
+	var response map[string]interface{}
+	assert.NoError(t, json.Unmarshal(recorder.Body.Bytes(), &response))
+	return recorder.Code, response
+}
+
+func TestHandleTimeSeries_rollup(t *testing.T) {
+	mock := mockDBMatching(t, sqlmock.QueryMatcherRegexp)
+	mock.ExpectQuery(rollupQueryPattern).
+		WillReturnRows(sqlmock.NewRows(timeSeriesColumns).
+			AddRow("2023-11-14 22:00:00", 120).
+			AddRow("2023-11-14 23:00:00", 80))
+
+	code, response := timeSeriesRequest(t, "apache_logs")
+
+	assert.Equal(t, http.StatusOK, code)
+	data := response["data"].([]interface{})
+	assert.Len(t, data, 2)
+	assert.Equal(t, float64(120), data[0].(map[string]interface{})["count"])
+	// The table isn't scanned
+	assert.NoError(t, mock.ExpectationsWereMet())
+}
+
+func TestHandleTimeSeries_emptyRollup(t *testing.T) {
+	mock := mockDBMatching(t, sqlmock.QueryMatcherRegexp)
+	mock.ExpectQuery(rollupQueryPattern).WillReturnRows(sqlmock.NewRows(timeSeriesColumns))
+
+	code, response := timeSeriesRequest(t, "apache_logs")
+
+	// No rows in the range isn't a reason to scan the table
+	assert.Equal(t, http.StatusOK, code)
+	assert.Empty(t, response["data"])
+	assert.NoError(t, mock.ExpectationsWereMet())
+}
+
+func TestHandleTimeSeries_rollupFallback(t *testing.T) {
+	mock := mockDBMatching(t, sqlmock.QueryMatcherRegexp)
+	mock.ExpectQuery(rollupQueryPattern).
+		WillReturnError(errors.New("table apache_logs_per_minute doesn't exist"))
+	mock.ExpectQuery(tableQueryPattern).
+		WillReturnRows(sqlmock.NewRows(timeSeriesColumns).AddRow("2023-11-14 22:00:00", 7))
+
+	code, response := timeSeriesRequest(t, "apache_logs")
+
+	assert.Equal(t, http.StatusOK, code)
+	data := response["data"].([]interface{})
+	assert.Len(t, data, 1)
+	assert.Equal(t, float64(7), data[0].(map[string]interface{})["count"])
+	assert.NoError(t, mock.ExpectationsWereMet())
+}
+
+func TestHandleTimeSeries_fallbackError(t *testing.T) {
+	mock := mockDBMatching(t, sqlmock.QueryMatcherRegexp)
+	mock.ExpectQuery(rollupQueryPattern).WillReturnError(errors.New("table apache_logs_per_minute doesn't exist"))
+	mock.ExpectQuery(tableQueryPattern).WillReturnError(errors.New("table apache_logs doesn't exist"))
+
+	code, response := timeSeriesRequest(t, "apache_logs")
+
+	assert.Equal(t, http.StatusInternalServerError, code)
+	assert.Contains(t, response["error"], "table apache_logs doesn't exist")
+	assert.NoError(t, mock.ExpectationsWereMet())
+}
+
+func TestHandleTimeSeries_noRollup(t *testing.T) {
+	mock := mockDBMatching(t, sqlmock.QueryMatcherRegexp)
+	mock.ExpectQuery(`device_logs`).
+		WillReturnRows(sqlmock.NewRows(timeSeriesColumns).AddRow("2023-11-14 22:00:00", 3))
+
+	code, response := timeSeriesRequest(t, "device_logs")
+
+	assert.Equal(t, http.StatusOK, code)
+	assert.Len(t, response["data"], 1)
+	assert.NoError(t, mock.ExpectationsWereMet())
+}
@@ -1,8 +1,7 @@
-import { getBackendSrv } from "@grafana/runtime";
 import { TabularResult, IpInfo } from "../../lib/types";
+import { enrichIps } from "../../lib/enrichIp";
 import { X } from "lucide-react";
-import React, { useEffect, useState } from "react";
-import { getBackendUrl } from "../../constants";
+import React, { useEffect, useMemo, useState } from "react";
 
 interface RowDetailPanelProps {
   tabularResult: TabularResult;
@@ -42,18 +41,21 @@ const searchButtonStyle = {
   fontSize: '12px'
 };
 
-function enrichmentsFor(column: string, value: string) {
+const IPV4_PATTERN = /^[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}$/;
 
+// rowIps are all the IPs of the row, enriched together
+function enrichmentsFor(column: string, value: string, rowIps: string[]) {
 
 
 
 
-  if (value.match(/^[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}$/)) {
+
+  if (value.match(IPV4_PATTERN)) {
     return <div>
       <a style={buttonStyle} href={`https://ipinfo.io/${value}`} target="_blank" rel="noopener noreferrer">View on ipinfo.io</a>
       <a style={buttonStyle} href={`https://whois.domaintools.com/${value}`} target="_blank" rel="noopener noreferrer">View on domaintools</a>
       <a style={buttonStyle} onClick={() => alert('Here you will redirected to the block IP page')}>Block IP</a>
-      <EnrichedIP ip={value} />
+      <EnrichedIP ip={value} rowIps={rowIps} />
     </div>
   }
 
@@ -113,7 +115,7 @@ function enrichmentsFor(column: string, value: string) {
 }
 
 
-function EnrichedIP(props: { ip: string }) {
+function EnrichedIP(props: { ip: string, rowIps: string[] }) {
 
   const [ipInfo, setIpInfo] = useState<IpInfo | null>(null);
   const [error, setError] = useState<string | null>(null);
@@ -121,29 +123,20 @@ function EnrichedIP(props: { ip: string }) {
 
   useEffect(() => {
     if (show) {
-      getBackendSrv().fetch({
-        url: getBackendUrl('enrich_ip'),
-        method: 'POST',
-        data: JSON.stringify({ ip: props.ip }),
-        headers: {
-          'Content-Type': 'application/json'
+      // One request for all the IPs of the row, so showing the others needs none
+      enrichIps(props.rowIps).then(
+        (enriched) => {
+          // An unknown IP is shown with empty details
+          setIpInfo(enriched.get(props.ip) ?? ({ ip: props.ip } as IpInfo));
         },
-        showErrorAlert: false
-      }).subscribe({
-        next: (response) => {
-
-          const d = response.data as IpInfo;
-          setIpInfo(d);
-
-        },
-        error: (error) => {
+        (error) => {
           setError(error.message);
         }
-      });
+      );
     } else {
       setIpInfo(null);
     }
-  }, [props.ip, show])
+  }, [props.ip, props.rowIps, show])
 
   const tableStyle = { border: '1px solid #ccc', borderCollapse: 'collapse' as const };
   const cellStyle = { padding: '8px', border: '1px solid #ccc' };
@@ -281,6 +274,10 @@ export function RowDetailPanel({ tabularResult, selectedRow, onClose, isOpen }:
     }, 300);
   };
 
+  // The same array for every render of a row, so the EnrichedIP effects don't run again
+  const row = selectedRow == null ? undefined : tabularResult.rows[selectedRow];
+  const rowIps = useMemo(() => (row ?? []).filter((value) => IPV4_PATTERN.test(value)), [row]);
+
   if (selectedRow == null) {
     return null;
   }
@@ -315,7 +312,7 @@ export function RowDetailPanel({ tabularResult, selectedRow, onClose, isOpen }:
                   <td className="detail-panel-table-cell" style={{ fontWeight: 500 }}>{column}</td>
                   <td className="detail-panel-table-cell" style={{ wordBreak: 'break-word' }}>
                     {tabularResult.rows[selectedRow][index]}
-                    {enrichmentsFor(column, tabularResult.rows[selectedRow][index])}
+                    {enrichmentsFor(column, tabularResult.rows[selectedRow][index], rowIps)}
                   </td>
                 </tr>
               ))}
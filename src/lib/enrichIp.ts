@@ -0,0 +1,31 @@
+import { getBackendSrv } from "@grafana/runtime";
+import { lastValueFrom } from "rxjs";
+import { getBackendUrl } from "../constants";
+import { IpInfo } from "./types";
+
+interface EnrichIpsResponse {
+  results: IpInfo[];
+}
+
+// Enrichments already fetched, by IP (null for IPs the backend doesn't know)
+const enrichments = new Map<string, IpInfo | null>();
+
+// Enriches the IPs with a single request to the backend's batch enrich_ip endpoint,
+// for those that weren't fetched yet.
+export async function enrichIps(ips: string[]): Promise<Map<string, IpInfo | null>> {
+  const missing = Array.from(new Set(ips)).filter((ip) => !enrichments.has(ip));
+  if (missing.length > 0) {
+    const response = await lastValueFrom(getBackendSrv().fetch<EnrichIpsResponse>({
+      url: getBackendUrl('enrich_ip'),
+      method: 'POST',
+      data: JSON.stringify({ ips: missing }),
+      headers: {
+        'Content-Type': 'application/json'
+      },
+      showErrorAlert: false
+    }));
+    missing.forEach((ip) => enrichments.set(ip, null));
+    response.data.results.forEach((info) => enrichments.set(info.ip, info));
+  }
+  return new Map(ips.map((ip) => [ip, enrichments.get(ip) ?? null]));
+}